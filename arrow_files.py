@@ -0,0 +1,126 @@
+"""Typed column reads of glacier data in Arrow IPC (Feather) and Parquet files.
+
+pyarrow is an optional dependency, imported when the first such file is read.
+Columns come back as NumPy arrays sharing the Arrow buffers where the types
+allow it (numbers without missing values, and text whose values all have the
+same length), so no value goes through a Python string.
+"""
+import numpy as np
+
+# file extensions read through pyarrow
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.parquet')
+
+
+def _pyarrow():
+    # import pyarrow only when an Arrow or Parquet file is read
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.feather
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Reading Arrow, Feather or Parquet files requires the pyarrow package") from None
+    return pyarrow
+
+
+def _check_columns(schema, names, label):
+    missing = [name for name in names if name not in schema.names]
+    if missing:
+        raise ValueError(f"{label} has no column '{missing[0]}'")
+
+
+def read_table(file_path, names, label):
+    """Read only the named columns of a file, memory-mapping Arrow IPC files."""
+    pa = _pyarrow()
+    if file_path.suffix == '.parquet':
+        _check_columns(pa.parquet.read_schema(file_path), names, label)
+        return pa.parquet.read_table(file_path, columns=names)
+
+    with pa.memory_map(str(file_path)) as source:
+        _check_columns(pa.ipc.open_file(source).schema, names, label)
+    return pa.feather.read_table(file_path, columns=names, memory_map=True)
+
+
+def iter_batches(file_path, names, chunk_size, label):
+    """Yield record batches of at most `chunk_size` rows holding only the named columns.
+
+    Parquet files are decoded a batch at a time, so memory stays bounded by the batch size.
+    """
+    pa = _pyarrow()
+    if file_path.suffix == '.parquet':
+        parquet_file = pa.parquet.ParquetFile(file_path)
+        _check_columns(parquet_file.schema_arrow, names, label)
+        yield from parquet_file.iter_batches(batch_size=chunk_size, columns=names)
+    else:
+        yield from read_table(file_path, names, label).to_batches(max_chunksize=chunk_size)
+
+
+def _array(column):
+    # one contiguous array from a table column or batch column, with dictionary encoding undone
+    pa = _pyarrow()
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if pa.types.is_dictionary(column.type):
+        column = column.dictionary_decode()
+    return column
+
+
+def first_missing(column):
+    """Return the position of the first missing value of a column, or None if there are none."""
+    column = _array(column)
+    if column.null_count == 0:
+        return None
+    return int(np.flatnonzero(column.is_null().to_numpy(zero_copy_only=False))[0])
+
+
+def numbers(column, dtype):
+    """Return a numeric column as a NumPy array of `dtype`, or None if it is not numeric.
+
+    Missing values become NaN, so check for them with `first_missing` first
+    when a column must be complete.
+    """
+    pa = _pyarrow()
+    column = _array(column)
+    if not (pa.types.is_integer(column.type) or pa.types.is_floating(column.type)):
+        return None
+    if column.null_count > 0:
+        column = column.cast(pa.float64())
+    return np.asarray(column.to_numpy(zero_copy_only=False), dtype=dtype)
+
+
+def text(column):
+    """Return a text column as (fixed-width bytes array, byte length of each value), or None if it is not text.
+
+    The array shares the Arrow buffer when every value has the same length,
+    and is otherwise filled in one vectorized copy. Missing values are empty.
+    """
+    pa = _pyarrow()
+    column = _array(column)
+    if pa.types.is_string_view(column.type) or pa.types.is_binary_view(column.type):
+        column = column.cast(pa.large_binary())
+    if not (pa.types.is_string(column.type) or pa.types.is_large_string(column.type)
+            or pa.types.is_binary(column.type) or pa.types.is_large_binary(column.type)):
+        return None
+
+    size = len(column)
+    if size == 0:
+        return np.empty(0, dtype='S1'), np.empty(0, dtype=np.int64)
+
+    offset_type = np.int64 if pa.types.is_large_string(column.type) or pa.types.is_large_binary(column.type) \
+        else np.int32
+    _, offsets_buffer, data_buffer = column.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=offset_type, count=size + 1,
+                            offset=column.offset * np.dtype(offset_type).itemsize).astype(np.int64)
+    data = np.frombuffer(data_buffer, dtype=np.uint8) if data_buffer is not None else np.empty(0, dtype=np.uint8)
+    lengths = np.diff(offsets)
+    width = max(int(lengths.max()), 1)
+
+    if (lengths == width).all():
+        return np.frombuffer(data, dtype=f'S{width}', count=size, offset=int(offsets[0])), lengths
+
+    padded = np.zeros(size * width, dtype=np.uint8)
+    starts = np.repeat(offsets[:-1] - offsets[0], lengths)
+    rows = np.repeat(np.arange(size) * width, lengths)
+    padded[rows + np.arange(len(starts)) - starts] = data[offsets[0]:offsets[-1]]
+    return padded.view(f'S{width}'), lengths
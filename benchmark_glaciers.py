@@ -0,0 +1,187 @@
+"""Benchmarks for the hot paths of GlacierCollection on synthetic data.
+
+Synthetic sheet-A/sheet-EE files are generated once per size into a data
+directory and reused by later runs. Results are written to JSON together with
+the commit they were measured on, and can be compared with an earlier run:
+
+    python benchmark_glaciers.py --sizes 1000 100000 --output results.json
+    python benchmark_glaciers.py --sizes 1000 100000 --compare results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import numpy as np
+from datetime import datetime, timezone
+from pathlib import Path
+from glaciers import GlacierCollection
+
+GLACIER_HEADER = "POLITICAL_UNIT,NAME,WGMS_ID,LATITUDE,LONGITUDE,PRIM_CLASSIFIC,FORM,FRONTAL_CHARS\n"
+MASS_BALANCE_HEADER = "POLITICAL_UNIT,NAME,WGMS_ID,YEAR,LOWER_BOUND,UPPER_BOUND,ANNUAL_BALANCE\n"
+UNITS = ['AR', 'CA', 'CH', 'CL', 'IN', 'IS', 'IT', 'NO', 'NZ', 'US']
+DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def glacier_id(number):
+    """Return a unique 5-character ID for a glacier number, in base 36 so a million glaciers fit."""
+    characters = []
+    for _ in range(5):
+        number, digit = divmod(number, 36)
+        characters.append(DIGITS[digit])
+    return ''.join(reversed(characters))
+
+
+def generate_dataset(directory, size, seed=0):
+    """Write synthetic sheet-A.csv and sheet-EE.csv files for `size` glaciers into `directory`.
+
+    Each glacier has up to 20 years of measurements, each year a full
+    measurement followed by two altitude bands. Returns the two paths.
+    """
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    glacier_file = directory / 'sheet-A.csv'
+    mass_balance_file = directory / 'sheet-EE.csv'
+
+    with open(glacier_file, 'w') as glaciers, open(mass_balance_file, 'w') as mass_balances:
+        glaciers.write(GLACIER_HEADER)
+        mass_balances.write(MASS_BALANCE_HEADER)
+
+        for number in range(size):
+            gid, unit, name = glacier_id(number), rng.choice(UNITS), f"GLACIER {number}"
+            glaciers.write(f"{unit},{name},{gid},{rng.uniform(-80, 80):.5f},{rng.uniform(-179, 179):.5f},"
+                           f"{rng.randint(1, 9)},{rng.randint(0, 9)},{rng.randint(0, 9)}\n")
+
+            for year in range(2000, 2000 + rng.randint(0, 20)):
+                mass_balances.write(f"{unit},{name},{gid},{year},9999,9999,{rng.randint(-2000, 1000)}\n")
+                mass_balances.write(f"{unit},{name},{gid},{year},1000,1500,{rng.randint(-500, 500)}\n")
+                mass_balances.write(f"{unit},{name},{gid},{year},1500,2000,{rng.randint(-500, 500)}\n")
+
+    return glacier_file, mass_balance_file
+
+
+def dataset(data_dir, size):
+    # generated files for a size, made on first use
+    directory = data_dir / f'glaciers-{size}'
+    if not (directory / 'sheet-EE.csv').is_file():
+        generate_dataset(directory, size)
+    return directory / 'sheet-A.csv', directory / 'sheet-EE.csv'
+
+
+def measure(function, repeat):
+    """Call `function` `repeat` times and return the time taken by each call in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def benchmarks(glacier_file, mass_balance_file, columnar, plot_dir):
+    """Return (name, function) pairs timing each hot path on one dataset and backend."""
+    collection = GlacierCollection(glacier_file, columnar=columnar)
+    collection.read_mass_balance_data(mass_balance_file, bulk=True)
+    # repeated queries would be answered from the result cache, timing dict lookups rather than the queries
+    collection.configure_result_cache(maxsize=0)
+    rng = np.random.default_rng(0)
+    lats, lons = rng.uniform(-90, 90, 100).tolist(), rng.uniform(-180, 180, 100).tolist()
+    measured = next(glacier for glacier in collection.glaciers.values() if glacier.mass_balances)
+
+    def read_mass_balance_data(bulk):
+        def read():
+            GlacierCollection(glacier_file, columnar=columnar).read_mass_balance_data(mass_balance_file, bulk=bulk)
+        return read
+
+    def find_nearest():
+        for lat, lon in zip(lats, lons):
+            collection.find_nearest(lat, lon, n=5)
+
+    def summary():
+        with contextlib.redirect_stdout(io.StringIO()):
+            collection.summary()
+
+    return [('GlacierCollection.__init__', lambda: GlacierCollection(glacier_file, columnar=columnar)),
+            ('__init__ + read_mass_balance_data', read_mass_balance_data(False)),
+            ('__init__ + read_mass_balance_data(bulk=True)', read_mass_balance_data(True)),
+            ('find_nearest x100', find_nearest),
+            ('filter_by_code', lambda: collection.filter_by_code('5?1')),
+            ('sort_by_latest_mass_balance', lambda: collection.sort_by_latest_mass_balance(n=5)),
+            ('summary', summary),
+            ('plot_mass_balance', lambda: measured.plot_mass_balance(plot_dir / 'mass_balance.png')),
+            ('plot_extremes', lambda: collection.plot_extremes(plot_dir / 'extremes.png'))]
+
+
+def run_benchmarks(sizes, data_dir, repeat=3, backends=('dict', 'columnar')):
+    """Time every benchmark for each size and backend, returning the results as a JSON-ready dict.
+
+    The first call of each benchmark is also timed, so cold times are included
+    in `seconds`; `best` is the fastest call.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as plot_dir:
+        for size in sizes:
+            glacier_file, mass_balance_file = dataset(data_dir, size)
+            for backend in backends:
+                for name, function in benchmarks(glacier_file, mass_balance_file, backend == 'columnar',
+                                                 Path(plot_dir)):
+                    seconds = measure(function, repeat)
+                    results.append({'name': name, 'size': size, 'backend': backend, 'seconds': seconds,
+                                    'best': min(seconds), 'median': float(np.median(seconds))})
+
+    return {'commit': current_commit(), 'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'results': results}
+
+
+def current_commit():
+    # the commit being measured, if this is a git checkout
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current):
+    """Return lines comparing the best times of two runs, as current / baseline."""
+    best = {(result['name'], result['size'], result['backend']): result['best'] for result in baseline['results']}
+    lines = [f"{'benchmark':<45} {'size':>8} {'backend':>9} {'before':>10} {'after':>10} {'ratio':>7}"]
+    for result in current['results']:
+        before = best.get((result['name'], result['size'], result['backend']))
+        if before is not None:
+            lines.append(f"{result['name']:<45} {result['size']:>8} {result['backend']:>9} {before:>10.4f} "
+                         f"{result['best']:>10.4f} {result['best'] / before:>7.2f}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000],
+                        help="numbers of glaciers to benchmark with (1000000 is supported but slow)")
+    parser.add_argument('--repeat', type=int, default=3, help="calls timed per benchmark")
+    parser.add_argument('--backends', nargs='+', choices=['dict', 'columnar'], default=['dict', 'columnar'])
+    parser.add_argument('--data-dir', type=Path, default=Path(tempfile.gettempdir()) / 'glacier-benchmarks',
+                        help="where synthetic datasets are generated and reused")
+    parser.add_argument('--output', type=Path, default=Path('benchmark_results.json'))
+    parser.add_argument('--compare', type=Path, help="earlier results to compare with")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.data_dir, args.repeat, args.backends)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            print('\n'.join(compare(json.load(file), results)))
+    else:
+        for result in results['results']:
+            print(f"{result['name']:<45} {result['size']:>8} {result['backend']:>9} {result['best']:>10.4f}s")
+
+
+if __name__ == '__main__':
+    main()
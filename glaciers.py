@@ -1,13 +1,491 @@
+import arrow_files
+import asyncio
 import csv
+import glob
+import hashlib
+import json
+import instrumentation
+import os
+import sys
+import threading
+import warnings
+import numpy as np
+from array import array
+from arrow_files import ARROW_EXTENSIONS
+from collections.abc import ItemsView, Mapping, MutableMapping, ValuesView
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from pathlib import PosixPath
-from matplotlib import pyplot as plt
+from functools import wraps
+from itertools import chain, repeat
+from pathlib import Path, PosixPath
+from types import MappingProxyType
 from os.path import splitext
-from utils import haversine_distance
+from indexes import BandIndex, CodeIndex, YearIndex
+from locks import ReadWriteLock
+from results import ResultCache
+from spatial import SphericalIndex, km_to_chord
+from storage import GlacierStore, MeasurementLedger, encode_columns, fold_measurements, ledger_keys
+from utils import file_fingerprint, file_hash, fingerprint_matches, haversine_distance_array
+
+
+def _pyplot():
+    # matplotlib is slow to import, so load it on first use, drawing off-screen with Agg
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot
+    return pyplot
+
+
+def _render_mass_balances(tasks):
+    """Save one mass-balance plot per (name, years, balances, output path, digest) task.
+
+    Runs in the plotting worker processes of `GlacierCollection.plot_all_mass_balances`.
+    A single figure is set up once and redrawn for every task, and each plot's
+    digest is written next to it so unchanged glaciers can be skipped next time.
+    """
+    plt = _pyplot()
+    plot, plot_axes = plt.subplots()
+    line, = plot_axes.plot([], [])
+    plot_axes.set_title("Graph of net mass-balance per year")
+    plot_axes.set_xlabel("Year")
+    plot_axes.set_ylabel("Mass-balance")
+
+    for name, years, balances, output_path, digest in tasks:
+        line.set_data(years, balances)
+        line.set_label(name)
+        plot_axes.relim()
+        plot_axes.autoscale_view()
+        plot_axes.legend()
+        plot.tight_layout()
+        plot.savefig(output_path)
+        Path(f'{output_path}.sha256').write_text(digest)
+
+    plt.close(plot)
+    return len(tasks)
+
+
+def _is_float(value):
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _check_year_range(years):
+    # years filters are None (every year) or an inclusive (first, last) pair of integer years
+    if years is None:
+        return
+
+    if not (type(years) == tuple and len(years) == 2 and all(type(year) == int for year in years)):
+        raise TypeError("Year range must be a tuple of two integer years (first, last)")
+
+    if years[0] > years[1]:
+        raise ValueError("First year of year range is after the last year")
+
+
+def _check_region(units, bbox):
+    # region filters of the loaders: None, or a collection of political unit codes and a
+    # (lat_min, lat_max, lon_min, lon_max) box, returned as a frozenset and a tuple
+    if units is not None:
+        if not (type(units) in (set, frozenset, list, tuple) and all(type(unit) == str for unit in units)):
+            raise TypeError("Political units to load must be a set, list or tuple of string codes")
+        units = frozenset(units)
+
+    if bbox is not None:
+        if not (type(bbox) in (list, tuple) and len(bbox) == 4 and all(type(value) in (int, float) for value in bbox)):
+            raise TypeError("Bounding box must be a tuple of four numbers (lat_min, lat_max, lon_min, lon_max)")
+
+        if bbox[0] > bbox[1] or bbox[2] > bbox[3]:
+            raise ValueError("Bounding box minimum is greater than its maximum")
+        bbox = tuple(bbox)
+
+    return units, bbox
+
+
+def _filtered_fingerprint(file_path, units=None, bbox=None, years=None):
+    # fingerprint of a source file, with the filters it was read with for load_cache to read it again
+    fingerprint = file_fingerprint(file_path)
+    filters = {'units': None if units is None else sorted(units), 'bbox': None if bbox is None else list(bbox),
+               'years': None if years is None else list(years)}
+    filters = {name: value for name, value in filters.items() if value is not None}
+    if filters:
+        fingerprint['filters'] = filters
+    return fingerprint
+
+
+def _filters_from_record(source):
+    # keyword arguments reading a source again with the filters recorded by _filtered_fingerprint
+    filters = source.get('filters', {})
+    return {name: tuple(value) if name != 'units' else set(value) for name, value in filters.items()}
+
+
+def _in_region(units, lats, lons, region_units, bbox):
+    # mask of the glaciers inside region filters, given as arrays of unit codes (bytes) and coordinates
+    keep = np.ones(len(lats), dtype=bool)
+    if region_units is not None:
+        keep &= np.isin(units, [unit.encode() for unit in region_units])
+    if bbox is not None:
+        keep &= (lats >= bbox[0]) & (lats <= bbox[1]) & (lons >= bbox[2]) & (lons <= bbox[3])
+    return keep
+
+
+def _parse_mass_balance_chunks(file_path, chunk_size, units=None, years=None):
+    """Yield (row numbers, IDs, years, lower bounds, upper bounds, balances, partial) arrays per chunk of a mass-balance file.
+
+    Typed columns are parsed `chunk_size` rows at a time and each column is
+    validated as a whole. Rows without an annual balance are left out, as are
+    rows outside the political `units` or the inclusive `years` range if given,
+    before any other field of them is checked.
+    """
+    if file_path.suffix in ARROW_EXTENSIONS:
+        yield from _parse_mass_balance_table(file_path, chunk_size, units, years)
+        return
+
+    with open(file_path, 'r') as file:
+        file.seek(0)
+        header = file.readline()
+        header = header[:-1].split(',')
+
+        if header == ['']:
+            raise EOFError("No mass-balance data specified in the input file")
+
+        columns = [header.index(name) for name in ('WGMS_ID', 'YEAR', 'LOWER_BOUND', 'UPPER_BOUND', 'ANNUAL_BALANCE')]
+        fields = [('id', 'S16'), ('year', np.int64), ('lower', np.int64), ('upper', np.int64), ('balance', 'S32')]
+        # the political unit column is only read when filtering on it
+        if units is not None:
+            columns.append(header.index('POLITICAL_UNIT'))
+            fields.append(('unit', 'S2'))
+        dtype = np.dtype(fields)
+        current_year = datetime.now().year
+        first_row = 0
+
+        while True:
+            try:
+                with warnings.catch_warnings():
+                    # an exhausted file is how the loop ends, not a problem
+                    warnings.simplefilter('ignore', UserWarning)
+                    chunk = np.loadtxt(file, delimiter=',', quotechar='"', usecols=columns, dtype=dtype,
+                                       max_rows=chunk_size, ndmin=1)
+            except ValueError as error:
+                raise ValueError(f"Invalid value in rows {first_row} to {first_row + chunk_size - 1} "
+                                 f"of mass-balance file: {error}")
+
+            if len(chunk) == 0:
+                break
+
+            keep = np.ones(len(chunk), dtype=bool)
+            if units is not None:
+                keep &= np.isin(chunk['unit'], [unit.encode() for unit in units])
+            if years is not None:
+                keep &= (chunk['year'] >= years[0]) & (chunk['year'] <= years[1])
+
+            yield _check_mass_balance_chunk(first_row, chunk, current_year, keep)
+            first_row += len(chunk)
+
+    if first_row == 0:
+        raise EOFError("No mass-balance data specified in the input file")
+
+
+def _check_mass_balance_chunk(first_row, chunk, current_year, keep):
+    measured = np.flatnonzero((chunk['balance'] != b'') & keep)
+    row_numbers = first_row + measured
+
+    try:
+        mass_balances = chunk['balance'][measured].astype(np.float64)
+    except ValueError:
+        invalid = [k for k, value in enumerate(chunk['balance'][measured].tolist()) if not _is_float(value)]
+        raise ValueError(f"Mass-balance on row {row_numbers[invalid[0]]} of mass-balance file is not numeric")
+
+    return _check_measurements(row_numbers, chunk['id'][measured], chunk['year'][measured], chunk['lower'][measured],
+                               chunk['upper'][measured], mass_balances, current_year)
+
+
+def _check_measurements(row_numbers, ids, years, lower_bounds, upper_bounds, mass_balances, current_year):
+    # the checks and partial flags shared by every mass-balance file format
+    partial = ~((lower_bounds == 9999) & (upper_bounds == 9999))
+
+    invalid_years = np.flatnonzero((years < 0) | (years > current_year))
+    if len(invalid_years) > 0:
+        raise ValueError(f"Invalid year given of mass-balance reading on row {row_numbers[invalid_years[0]]} "
+                         "(should be a positive and of maximum value the current year (not in future))")
+
+    return row_numbers, ids, years, lower_bounds, upper_bounds, mass_balances, partial
+
+
+def _table_column(table, name, rows, label, kind):
+    # one column of an Arrow table or batch as a NumPy array, raising on missing or mistyped values
+    # and reporting the row of the file (given in `rows` for each row of the table) they were on
+    column = table.column(name)
+    missing = arrow_files.first_missing(column)
+    if missing is not None:
+        raise ValueError(f"No {name} given on row {rows[missing]} of {label}")
+
+    if kind == 'text':
+        values = arrow_files.text(column)
+        numbers = arrow_files.numbers(column, np.int64) if values is None and name == 'WGMS_ID' else None
+        if numbers is not None:
+            # numeric IDs, with the leading zeros they have in CSV files
+            ids = np.char.zfill(numbers.astype('S'), 5)
+            values = ids, np.char.str_len(ids)
+        if values is None:
+            raise ValueError(f"Column {name} of {label} is not text")
+        return values
+
+    values = arrow_files.numbers(column, np.float64 if kind == 'number' else np.int64)
+    digits = arrow_files.text(column) if values is None and kind == 'digit' else None
+    if digits is not None:
+        # classification digits stored as text, as in CSV files
+        characters, lengths = digits
+        invalid = np.flatnonzero(lengths != 1)
+        if len(invalid) > 0:
+            raise ValueError(f"{name} on row {rows[invalid[0]]} of {label} is not a single digit")
+        values = characters.view(np.uint8).astype(np.int64) - ord('0')
+    if values is None:
+        raise ValueError(f"Column {name} of {label} is not numeric")
+
+    return values
+
+
+def _read_glacier_table(file_path, region_units=None, bbox=None):
+    """Return the validated columns of an Arrow or Parquet glacier data file, as from `storage.encode_columns`.
+
+    Each column is read with its own type and checked as a whole, applying the
+    checks made on each row of a CSV file. With `region_units` or `bbox`, rows
+    outside the region are dropped before any column but those deciding it is checked.
+    """
+    label = "data file"
+    table = arrow_files.read_table(file_path, ['WGMS_ID', 'NAME', 'POLITICAL_UNIT', 'LATITUDE', 'LONGITUDE',
+                                               'PRIM_CLASSIFIC', 'FORM', 'FRONTAL_CHARS'], label)
+    if table.num_rows == 0:
+        raise EOFError("No glaciers specified in the input data file")
+
+    rows = np.arange(table.num_rows)
+    if region_units is not None or bbox is not None:
+        units, _ = _table_column(table, 'POLITICAL_UNIT', rows, label, 'text')
+        lats = _table_column(table, 'LATITUDE', rows, label, 'number') if bbox is not None else np.zeros(len(rows))
+        lons = _table_column(table, 'LONGITUDE', rows, label, 'number') if bbox is not None else np.zeros(len(rows))
+        rows = np.flatnonzero(_in_region(units, lats, lons, region_units, bbox))
+        table = table.take(rows)
+
+    ids, id_lengths = _table_column(table, 'WGMS_ID', rows, label, 'text')
+    names, _ = _table_column(table, 'NAME', rows, label, 'text')
+    units, unit_lengths = _table_column(table, 'POLITICAL_UNIT', rows, label, 'text')
+    lats = _table_column(table, 'LATITUDE', rows, label, 'number')
+    lons = _table_column(table, 'LONGITUDE', rows, label, 'number')
+    digits = [_table_column(table, name, rows, label, 'digit') for name in ('PRIM_CLASSIFIC', 'FORM', 'FRONTAL_CHARS')]
+
+    # validity checks, each over a whole column
+    invalid = rows[id_lengths != 5]
+    if len(invalid) > 0:
+        raise ValueError(f"Glacier ID on row {invalid[0]} of data file is not the correct length (should be 5 digits)")
+
+    invalid = rows[unit_lengths != 2]
+    if len(invalid) > 0:
+        raise ValueError(f"Political unit code on row {invalid[0]} of data file of incorrect length "
+                         "(should be length 2)")
+
+    characters = units.view(np.uint8).reshape(-1, 2)
+    upper = ((characters >= ord('A')) & (characters <= ord('Z'))).any(axis=1)
+    lower = ((characters >= ord('a')) & (characters <= ord('z'))).any(axis=1)
+    invalid = rows[(units != b'99') & (lower | ~upper)]
+    if len(invalid) > 0:
+        raise ValueError(f"Political unit code on row {invalid[0]} of data file invalid "
+                         "(should either be capital letters or the unknown code '99')")
+
+    invalid = rows[~((lats >= -90) & (lats <= 90))]
+    if len(invalid) > 0:
+        raise ValueError(f"Invalid latitude on row {invalid[0]} of data file (should be in range -90 to 90)")
+
+    invalid = rows[~((lons >= -180) & (lons <= 180))]
+    if len(invalid) > 0:
+        raise ValueError(f"Invalid longitude on row {invalid[0]} of data file (should be in range -180 to 180)")
+
+    for name, values in zip(('Primary classification', 'Form', 'Frontal characteristics'), digits):
+        invalid = rows[(values < 0) | (values > 9)]
+        if len(invalid) > 0:
+            raise ValueError(f"{name} on row {invalid[0]} of data file is not a single digit")
+
+    codes = digits[0] * 100 + digits[1] * 10 + digits[2]
+    invalid = rows[codes < 100]
+    if len(invalid) > 0:
+        raise ValueError(f"The glacier type code on row {invalid[0]} of data file must be 3-digits")
+
+    order = np.argsort(ids, kind='stable')
+    repeated = np.flatnonzero(ids[order][1:] == ids[order][:-1])
+    if len(repeated) > 0:
+        raise KeyError(f"Glacier ID on row {rows[order[repeated[0] + 1]]} of data file not unique "
+                       "(or glacier specified multiple times)")
+
+    return ids.astype('S5', copy=False), names, units.astype('S2', copy=False), lats, lons, codes.astype(np.int16)
+
+
+def _parse_mass_balance_table(file_path, chunk_size, region_units=None, year_range=None):
+    # _parse_mass_balance_chunks for Arrow and Parquet files, reading typed columns a batch at a time
+    label = "mass-balance file"
+    current_year = datetime.now().year
+    first_row = 0
+    names = ['WGMS_ID', 'YEAR', 'LOWER_BOUND', 'UPPER_BOUND', 'ANNUAL_BALANCE']
+
+    for batch in arrow_files.iter_batches(file_path, names + (['POLITICAL_UNIT'] if region_units is not None else []),
+                                          chunk_size, label):
+        size = batch.num_rows
+        rows = np.arange(first_row, first_row + size)
+        first_row += size
+
+        # rows outside the filters are dropped before their other columns are checked
+        if region_units is not None or year_range is not None:
+            keep = np.ones(size, dtype=bool)
+            if region_units is not None:
+                units, _ = _table_column(batch, 'POLITICAL_UNIT', rows, label, 'text')
+                keep &= np.isin(units, [unit.encode() for unit in region_units])
+            if year_range is not None:
+                years = _table_column(batch, 'YEAR', rows, label, 'integer')
+                keep &= (years >= year_range[0]) & (years <= year_range[1])
+            batch = batch.take(np.flatnonzero(keep))
+            rows = rows[keep]
+
+        ids, _ = _table_column(batch, 'WGMS_ID', rows, label, 'text')
+        years = _table_column(batch, 'YEAR', rows, label, 'integer')
+        lower_bounds = _table_column(batch, 'LOWER_BOUND', rows, label, 'integer')
+        upper_bounds = _table_column(batch, 'UPPER_BOUND', rows, label, 'integer')
+        mass_balances = arrow_files.numbers(batch.column('ANNUAL_BALANCE'), np.float64)
+        if mass_balances is None:
+            raise ValueError(f"Column ANNUAL_BALANCE of {label} is not numeric")
+
+        # rows without an annual balance are left out, as blank ones are in CSV files
+        measured = np.flatnonzero(~np.isnan(mass_balances))
+        yield _check_measurements(rows[measured], ids[measured], years[measured], lower_bounds[measured],
+                                  upper_bounds[measured], mass_balances[measured], current_year)
+
+    if first_row == 0:
+        raise EOFError("No mass-balance data specified in the input file")
+
+
+def _expand_files(files, label):
+    # a list of Path objects, or a Path holding a glob pattern, as a list of paths
+    if type(files) == PosixPath:
+        matches = sorted(Path(match) for match in glob.glob(str(files), recursive=True))
+        if len(matches) == 0:
+            raise FileNotFoundError(f"No {label} match the pattern '{files}'")
+        return matches
+
+    if not (type(files) in (list, tuple) and all(type(file) == PosixPath for file in files)):
+        raise TypeError(f"The {label} are not specified as a list of Path objects or a glob pattern Path")
+
+    return list(files)
+
+
+def _parse_glacier_file(file_path, units=None, bbox=None):
+    # glacier columns and fingerprint of one glacier data file, for GlacierCollection.from_files
+    collection = GlacierCollection(file_path, columnar=True, units=units, bbox=bbox)
+    store = collection._store
+    return (store.ids, store.names, store.units, store.lats, store.lons, store.codes), collection._sources[0][1]
+
+
+def _parse_mass_balance_file(file_path, chunk_size, units=None, years=None):
+    # every checked measurement and the fingerprint of one mass-balance file, for GlacierCollection.from_files
+    fingerprint = _filtered_fingerprint(file_path, units=units, years=years)
+    chunks = list(_parse_mass_balance_chunks(file_path, chunk_size, units, years))
+    return [np.concatenate(column) for column in zip(*chunks)], fingerprint
+
+
+# glaciers keep up to this many measurements as tuples, and more as parallel arrays of years and values
+SMALL_MASS_BALANCES = 8
+# shared by the years and values of every glacier without measurements
+_NO_MEASUREMENTS = ()
+
+
+class MassBalances(MutableMapping):
+    """{year: mass-balance} view of a Glacier's measurements, in the order they were added.
+
+    The view is live, so it shows measurements added after it was taken.
+    Assigning a year replaces its measurement (or adds it) and deleting one
+    removes it, keeping the glacier's latest measurement and the summary of
+    its collections up to date.
+    """
+
+    __slots__ = ('_glacier',)
+
+    def __init__(self, glacier):
+        self._glacier = glacier
+
+    def __getitem__(self, year):
+        try:
+            return self._glacier._values[self._glacier._years.index(year)]
+        except (ValueError, TypeError):
+            raise KeyError(year) from None
+
+    def __setitem__(self, year, mass_balance):
+        self._glacier._set_mass_balance(year, mass_balance)
+
+    def __delitem__(self, year):
+        self._glacier._delete_mass_balance(year)
+
+    def __contains__(self, year):
+        try:
+            return year in self._glacier._years
+        except TypeError:
+            return False
+
+    def __iter__(self):
+        return iter(self._glacier._years)
+
+    def __len__(self):
+        return len(self._glacier._years)
+
+    def values(self):
+        return _MassBalanceValues(self)
+
+    def items(self):
+        return _MassBalanceItems(self)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class _MassBalanceValues(ValuesView):
+    def __iter__(self):
+        return iter(self._mapping._glacier._values)
+
+
+class _MassBalanceItems(ItemsView):
+    def __iter__(self):
+        return zip(self._mapping._glacier._years, self._mapping._glacier._values)
 
 
 class Glacier:
+    __slots__ = ('id', 'name', 'unit', '_lat', '_lon', 'type', '_years', '_values',
+                 'earliest_year', 'latest_year', 'latest_mass_balance', '_collections')
+
     def __init__(self, glacier_id, name, unit, lat, lon, code):
+        self._check_attributes(glacier_id, name, unit, lat, lon, code)
+
+        self.id = glacier_id
+        self.name = name
+        # only a few hundred political units exist, so glaciers share their code strings
+        self.unit = sys.intern(unit)
+        self._lat, self._lon = lat, lon
+        self.type = code
+        self._years = self._values = _NO_MEASUREMENTS
+        # kept up to date as measurements are added, None until the first one
+        self.earliest_year = None
+        self.latest_year = None
+        self.latest_mass_balance = None
+        # collections to tell about new measurements, see GlacierCollection._measurement_added
+        self._collections = ()
+
+    def __getstate__(self):
+        # the collections holding a glacier are not pickled with it, so a copy belongs to none
+        return {name: getattr(self, name) for name in self.__slots__ if name != '_collections'}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._collections = ()
+
+    @staticmethod
+    def _check_attributes(glacier_id, name, unit, lat, lon, code):
         # check parameters are of the correct type
         if type(glacier_id) != str:
             raise TypeError("Glacier ID is not a string")
@@ -45,15 +523,25 @@ class Glacier:
         if len(str(code)) != 3:
             raise ValueError("The glacier type code must be 3-digits")
 
-        self.id = glacier_id
-        self.name = name
-        self.unit = unit
-        self.coordinates = (lat, lon)
-        self.type = code
-        self.mass_balances = {}
-
     def add_mass_balance_measurement(self, year, mass_balance, partial):
-        # check parameters
+        self._check_editable()
+
+        return self._add_measurement(year, mass_balance, partial)
+
+    def _add_measurement(self, year, mass_balance, partial):
+        # collections reading a file check once that they are not frozen, then add each row through here
+        year = self._check_measurement(year, mass_balance)
+
+        if not (type(partial) == bool):
+            raise TypeError("Input mass-balance measurement does not indicate whether measurement is partial or full (through boolean type)")
+
+        self._record_mass_balance(year, mass_balance, partial)
+
+        return True
+
+    @staticmethod
+    def _check_measurement(year, mass_balance):
+        # check parameters, returning the year as an integer
         if not (type(year) == int or (type(year) == str and str(year).isnumeric())):
             raise TypeError("Year of mass-balance measurement not of supported type (integer or numeric string)")
 
@@ -65,20 +553,146 @@ class Glacier:
         if not (type(mass_balance) == int or type(mass_balance) == float):
             raise TypeError("Mass-balance measurement not of supported numeric type")
 
-        if not (type(partial) == bool):
-            raise TypeError("Input mass-balance measurement does not indicate whether measurement is partial or full (through boolean type)")
+        return year
+
+    def _check_editable(self):
+        if any(collection._frozen for collection in self._collections):
+            raise TypeError("Glacier belongs to a frozen collection, so its measurements cannot be changed")
+
+    def _set_mass_balance(self, year, mass_balance):
+        # replace or add one year's measurement, as `glacier.mass_balances[year] = mass_balance`
+        self._check_editable()
+        year = self._check_measurement(year, mass_balance)
+
+        if year in self._years:
+            position = self._years.index(year)
+            if type(self._values) == array:
+                self._values[position] = mass_balance
+            else:
+                self._values = self._values[:position] + (mass_balance,) + self._values[position + 1:]
+        else:
+            self._append_mass_balances([year], [mass_balance])
+
+        self._measurements_edited()
+
+    def _delete_mass_balance(self, year):
+        # remove one year's measurement, as `del glacier.mass_balances[year]`
+        self._check_editable()
+        try:
+            position = self._years.index(year)
+        except (ValueError, TypeError):
+            raise KeyError(year) from None
+
+        if type(self._years) == array:
+            del self._years[position]
+            del self._values[position]
+        elif len(self._years) == 1:
+            self._years = self._values = _NO_MEASUREMENTS
+        else:
+            self._years = self._intern_years(self._years[:position] + self._years[position + 1:])
+            self._values = self._values[:position] + self._values[position + 1:]
+
+        self._measurements_edited()
+
+    def _measurements_edited(self):
+        # earliest and latest years worked out again, since an edit can move them either way
+        if not self._years:
+            self.earliest_year = self.latest_year = self.latest_mass_balance = None
+        else:
+            self.earliest_year, self.latest_year = min(self._years), max(self._years)
+            self.latest_mass_balance = self._values[self._years.index(self.latest_year)]
+
+        for collection in self._collections:
+            collection._measurements_edited()
 
+    def _record_mass_balance(self, year, mass_balance, partial):
         # update glacier with measurement
-        if year in self.mass_balances.keys():
-            # if partial measurement and already exists in dict, add to this value to get sum
-            if partial:
-                self.mass_balances[year] += mass_balance
+        if year in self._years:
+            # N.B. if key exists but measurement isn't partial, this value is ignored
+            if not partial:
+                return
+            # if partial measurement and already exists, add to this value to get sum
+            self._add_to_mass_balance(self._years.index(year), mass_balance)
         else:
             # if measurement doesnt exist yet, add it
-            self.mass_balances.update({year: mass_balance})
-        # N.B. if key exists but measurement isn't partial, this value is ignored
+            self._append_mass_balances([year], [mass_balance])
 
-        return True
+        self._track_measurements(year, year)
+
+    def _merge_mass_balances(self, years, values, partial_sums):
+        # add measurements already combined per year by storage.fold_measurements
+        if len(years) == 0:
+            return
+
+        if not self._years:
+            self._append_mass_balances(years, values)
+        else:
+            new_years, new_values = [], []
+            for year, value, partial_sum in zip(years, values, partial_sums):
+                if year in self._years:
+                    self._add_to_mass_balance(self._years.index(year), partial_sum)
+                else:
+                    new_years.append(year)
+                    new_values.append(value)
+            self._append_mass_balances(new_years, new_values)
+
+        self._track_measurements(min(years), max(years))
+
+    def _append_mass_balances(self, years, values):
+        # keep a few measurements as tuples, and switch to parallel arrays once there are more
+        if type(self._years) == array:
+            self._years.extend(years)
+            self._values.extend(values)
+        elif len(self._years) + len(years) > SMALL_MASS_BALANCES:
+            self._years = array('h', [*self._years, *years])
+            self._values = array('d', [*self._values, *values])
+        elif years:
+            self._years = self._intern_years(self._years + tuple(years))
+            self._values += tuple(values)
+
+    def _intern_years(self, years):
+        # glaciers in a collection share equal tuples of years through it
+        if self._collections:
+            return self._collections[0]._shared_years.setdefault(years, years)
+        return years
+
+    def _add_to_mass_balance(self, position, mass_balance):
+        if type(self._values) == array:
+            self._values[position] += mass_balance
+        else:
+            values = list(self._values)
+            values[position] += mass_balance
+            self._values = tuple(values)
+
+    @property
+    def coordinates(self):
+        return self._lat, self._lon
+
+    @property
+    def mass_balances(self):
+        return MassBalances(self)
+
+    @mass_balances.setter
+    def mass_balances(self, mass_balances):
+        # replace every measurement, as with the plain dict glaciers used to keep
+        view = MassBalances(self)
+        view.clear()
+        view.update(mass_balances)
+
+    def _track_measurements(self, earliest, latest):
+        # update the tracked years and latest value after measurements between two years changed
+        previous = self.latest_mass_balance
+
+        if self.latest_year is None:
+            self.earliest_year, self.latest_year = earliest, latest
+        else:
+            self.earliest_year = min(self.earliest_year, earliest)
+            self.latest_year = max(self.latest_year, latest)
+
+        self.latest_mass_balance = self._values[self._years.index(self.latest_year)]
+
+        for collection in self._collections:
+            collection._measurement_added(self, previous)
 
     def plot_mass_balance(self, output_path):
         # check parameters and glacier
@@ -92,6 +706,7 @@ class Glacier:
         x_vals = self.mass_balances.keys()
         y_vals = self.mass_balances.values()
 
+        plt = _pyplot()
         plot, plot_axes = plt.subplots()
         plot_axes.plot(x_vals, y_vals, label=self.name)
         plot_axes.set_title("Graph of net mass-balance per year")
@@ -100,134 +715,766 @@ class Glacier:
         plot_axes.legend()
         plot.tight_layout()
         plot.savefig(output_path)
+        plt.close(plot)
+
+
+class GlacierView(Glacier):
+    """A glacier whose attributes and measurements live in one row of a GlacierStore.
+
+    `mass_balances` is a read-only mapping rebuilt from the store on access, so
+    measurements must be added through `add_mass_balance_measurement`.
+    """
+
+    __slots__ = ('_store', '_row')
+
+    # a frozen collection marks its store read-only, which refuses the measurement
+    _collections = ()
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    @property
+    def id(self):
+        return self._store.ids[self._row].decode()
+
+    @property
+    def name(self):
+        return self._store.names[self._row].decode()
+
+    @property
+    def unit(self):
+        return self._store.units[self._row].decode()
+
+    @property
+    def coordinates(self):
+        return float(self._store.lats[self._row]), float(self._store.lons[self._row])
+
+    @property
+    def type(self):
+        return int(self._store.codes[self._row])
+
+    @property
+    def mass_balances(self):
+        # read-only, since edits to a copy of the store's measurements would be silently lost
+        return MappingProxyType(self._store.mass_balances(self._row))
+
+    @property
+    def earliest_year(self):
+        return self._store.span(self._row)[0]
+
+    @property
+    def latest_year(self):
+        return self._store.span(self._row)[1]
+
+    @property
+    def latest_mass_balance(self):
+        return self._store.span(self._row)[2]
+
+    def _record_mass_balance(self, year, mass_balance, partial):
+        self._store.add_measurement(self._row, year, mass_balance, partial)
+
+    def __setstate__(self, state):
+        self._store, self._row = state['_store'], state['_row']
+
+    def __eq__(self, other):
+        return isinstance(other, GlacierView) and self._store is other._store and self._row == other._row
+
+    def __hash__(self):
+        return hash((id(self._store), self._row))
+
+
+class StoredGlaciers(Mapping):
+    """Read-only {glacier ID: GlacierView} mapping over a GlacierStore."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, glacier_id):
+        row = self._store.row(glacier_id)
+        if row < 0:
+            raise KeyError(glacier_id)
+        return GlacierView(self._store, row)
+
+    def __iter__(self):
+        for glacier_id in self._store.ids:
+            yield glacier_id.decode()
+
+    def __len__(self):
+        return len(self._store)
+
+
+def _check_out_of_core(directory, columnar):
+    # the out_of_core directory of the loaders, returning whether the collection is columnar
+    if directory is None:
+        return columnar
+
+    if not (type(directory) == PosixPath):
+        raise TypeError("Out-of-core directory not specified as a Path object")
+
+    if directory.exists() and not directory.is_dir():
+        raise ValueError("Out-of-core path exists and is not a directory")
+
+    return True
+
+
+def _check_track_rows(track_rows, out_of_core):
+    # the track_rows flag of the loaders, which out-of-core collections cannot set
+    if not (type(track_rows) == bool):
+        raise TypeError("Input parameter 'track_rows' must be of boolean type")
+
+    if track_rows and out_of_core is not None:
+        raise ValueError("Rows read into an out-of-core collection are not kept, so 'track_rows' cannot be set")
+
+
+def _cached_query(method):
+    # serve calls of a query method repeating earlier arguments from the collection's result cache;
+    # argument types are part of the key, so 1 and True or 1 and 1.0 are told apart
+    @wraps(method)
+    def cached(self, *args, **kwargs):
+        key = (method.__name__, tuple((type(value), value) for value in args),
+               tuple(sorted((name, type(value), value) for name, value in kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+
+        # a copy, so callers changing the returned list do not change the cached one
+        return list(self._results.get(key, self._data_version(), lambda: method(self, *args, **kwargs)))
+
+    return cached
 
 
 class GlacierCollection:
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, columnar=False, chunk_size=65536, units=None, bbox=None, out_of_core=None,
+                 track_rows=False):
+        """Read the glaciers of a glacier data file, by default all of them.
+
+        `units` (a set of political unit codes) and `bbox` (a (lat_min, lat_max,
+        lon_min, lon_max) tuple) keep only the glaciers inside that region. Other
+        rows are skipped as soon as the fields deciding it are read, without
+        validating the rest of the row, and the measurements of glaciers left out
+        are ignored by `read_mass_balance_data`. With `out_of_core` (a directory
+        Path), the collection is columnar and keeps its measurements in
+        memory-mapped files in that directory (see `GlacierStore.keep_on_disk`).
+        With `track_rows`, every mass-balance row read is kept in a ledger, which
+        `update_mass_balance_data` and the altitude-band queries need.
+        """
         # check parameters
         if not (type(file_path) == PosixPath):
             raise TypeError("File loading glacier data from not specified as a Path object")
 
+        if not (type(columnar) == bool):
+            raise TypeError("Input parameter 'columnar' must be of boolean type")
+
+        columnar = _check_out_of_core(out_of_core, columnar)
+        _check_track_rows(track_rows, out_of_core)
+
+        if not (type(chunk_size) == int and chunk_size > 0):
+            raise ValueError("Input parameter 'chunk_size' must be a positive integer")
+
+        units, bbox = _check_region(units, bbox)
+
         if not file_path.is_file():
             raise FileNotFoundError("Specified glacier data file does not exist")
 
         _, extension = splitext(file_path)
-        if extension != '.csv':
-            raise ValueError(f"Glacier data file must be '.csv' not '{extension}'")
-
-        # load glacier data from file
+        if extension != '.csv' and extension not in ARROW_EXTENSIONS:
+            raise ValueError(f"Glacier data file must be '.csv', '.arrow', '.feather' or '.parquet' not '{extension}'")
+
+        source = ('glaciers', _filtered_fingerprint(file_path, units, bbox))
+
+        if extension in ARROW_EXTENSIONS:
+            # typed columns, checked a column at a time and handed straight to the store
+            self._initialise_from_columns(_read_glacier_table(file_path, units, bbox), columnar, track_rows)
+            self._sources.append(source)
+            instrumentation.add_rows(len(self.glaciers))
+            if out_of_core is not None:
+                self._store.keep_on_disk(out_of_core)
+            return
+
+        self._initialise(track_rows=track_rows)
+        self._sources.append(source)
+        columns = ([], [], [], [], [], [])
+        chunks = []
+        stored_ids = set()
+
+        # stream glacier data from file, building glaciers row by row
         with open(file_path, 'r') as file:
             file.seek(0)
             header = file.readline()
             header = header[:-1].split(',')
             reader = csv.reader(file)
-            body = list(reader)
-
-        if not (len(body) > 0):
-            raise EOFError("No glaciers specified in the input data file")
-
-        self.glaciers = {}
-        id_index = header.index('WGMS_ID')
-        name_index = header.index('NAME')
-        unit_index = header.index('POLITICAL_UNIT')
-        lat_index = header.index('LATITUDE')
-        lon_index = header.index('LONGITUDE')
-        type1_index = header.index('PRIM_CLASSIFIC')
-        type2_index = header.index('FORM')
-        type3_index = header.index('FRONTAL_CHARS')
-
-        for i in range(len(body)):
-            row = body[i]
-            gid = row[id_index]
-            name = row[name_index]
-            unit = row[unit_index]
-            lat = row[lat_index]
-            lon = row[lon_index]
-            type1 = row[type1_index]
-            type2 = row[type2_index]
-            type3 = row[type3_index]
-
-            # validity checks
-            if not lat.replace('.', '', 1).replace('-', '', 1).isnumeric():
-                raise ValueError(f"Specified latitude on row {i} of data file is not numeric")
-
-            if not lon.replace('.', '', 1).replace('-', '', 1).isnumeric():
-                raise ValueError(f"Specified longitude on row {i} of data file is not numeric")
-
-            if not (len(type1) == 1 and type1.isdigit()):
-                raise ValueError(f"Primary classification on row {i} of data file is not a single digit")
-
-            if not (len(type2) == 1 and type2.isdigit()):
-                raise ValueError(f"Form on row {i} of data file is not a single digit")
-
-            if not (len(type3) == 1 and type3.isdigit()):
-                raise ValueError(f"Frontal characteristics on row {i} of data file is not a single digit")
-
-            lat = float(lat)
-            lon = float(lon)
-            code = int(type1 + type2 + type3)
-
-            if gid in self.glaciers.keys():
-                raise KeyError(f"Glacier ID on row {i} of data file not unique (or glacier specified multiple times)")
-
-            self.glaciers.update({gid: Glacier(gid, name, unit, lat, lon, code)})
-
-    def read_mass_balance_data(self, file_path):
+            first_row = next(reader, None)
+
+            if first_row is None:
+                raise EOFError("No glaciers specified in the input data file")
+
+            id_index = header.index('WGMS_ID')
+            name_index = header.index('NAME')
+            unit_index = header.index('POLITICAL_UNIT')
+            lat_index = header.index('LATITUDE')
+            lon_index = header.index('LONGITUDE')
+            type1_index = header.index('PRIM_CLASSIFIC')
+            type2_index = header.index('FORM')
+            type3_index = header.index('FRONTAL_CHARS')
+
+            for i, row in enumerate(chain([first_row], reader)):
+                unit = row[unit_index]
+
+                # rows outside the region are skipped before the rest of the row is looked at
+                if units is not None and unit not in units:
+                    continue
+
+                lat = row[lat_index]
+                lon = row[lon_index]
+
+                # validity checks
+                if not lat.replace('.', '', 1).replace('-', '', 1).isnumeric():
+                    raise ValueError(f"Specified latitude on row {i} of data file is not numeric")
+
+                if not lon.replace('.', '', 1).replace('-', '', 1).isnumeric():
+                    raise ValueError(f"Specified longitude on row {i} of data file is not numeric")
+
+                lat = float(lat)
+                lon = float(lon)
+
+                if bbox is not None and not (bbox[0] <= lat <= bbox[1] and bbox[2] <= lon <= bbox[3]):
+                    continue
+
+                gid = row[id_index]
+                name = row[name_index]
+                type1 = row[type1_index]
+                type2 = row[type2_index]
+                type3 = row[type3_index]
+
+                if not (len(type1) == 1 and type1.isdigit()):
+                    raise ValueError(f"Primary classification on row {i} of data file is not a single digit")
+
+                if not (len(type2) == 1 and type2.isdigit()):
+                    raise ValueError(f"Form on row {i} of data file is not a single digit")
+
+                if not (len(type3) == 1 and type3.isdigit()):
+                    raise ValueError(f"Frontal characteristics on row {i} of data file is not a single digit")
+
+                code = int(type1 + type2 + type3)
+
+                if gid in self.glaciers.keys() or gid in stored_ids:
+                    raise KeyError(f"Glacier ID on row {i} of data file not unique (or glacier specified multiple times)")
+
+                if columnar:
+                    Glacier._check_attributes(gid, name, unit, lat, lon, code)
+                    stored_ids.add(gid)
+                    for column, value in zip(columns, (gid, name, unit, lat, lon, code)):
+                        column.append(value)
+
+                    # move each full chunk of rows into compact arrays
+                    if len(columns[0]) == chunk_size:
+                        chunks.append(encode_columns(*columns))
+                        for column in columns:
+                            column.clear()
+                else:
+                    self._register(Glacier(gid, name, unit, lat, lon, code))
+
+            instrumentation.add_rows(i + 1)
+
+        if columnar:
+            chunks.append(encode_columns(*columns))
+            self._store = GlacierStore(*[np.concatenate(column) for column in zip(*chunks)])
+            self.glaciers = StoredGlaciers(self._store)
+
+        if out_of_core is not None:
+            self._store.keep_on_disk(out_of_core)
+
+    def __getstate__(self):
+        # a frozen collection's read-only proxy cannot be pickled, so the dict behind it is
+        state = self.__dict__.copy()
+        if type(self.glaciers) == MappingProxyType:
+            state['glaciers'] = dict(self.glaciers)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # glaciers are pickled without their collections, so the copy attaches itself again
+        if self._store is None:
+            for glacier in self.glaciers.values():
+                glacier._collections = (self,)
+            if self._frozen:
+                self.glaciers = MappingProxyType(self.glaciers)
+
+    def _initialise(self, store=None, track_rows=False):
+        # empty state shared by every way of creating a collection
+        self.glaciers = {} if store is None else StoredGlaciers(store)
+        self._store = store
+        self._generation = 0
+        # measurements added to the glaciers of a dict-backed collection, and the
+        # earliest year, number of measured glaciers and number that shrank at
+        # their latest measurement, kept up to date by _measurement_added
+        self._measurements = 0
+        self._latest_counts = (None, 0, 0)
+        # glaciers the counts were kept for, so glaciers put into the dict directly are noticed;
+        # -1 after measurements were edited through `mass_balances`, which the counts cannot follow
+        self._counted = 0
+        # tuples of years measured, shared between the glaciers with a few measurements
+        self._shared_years = {}
+        # indexes and other structures derived from the glaciers, see _derived
+        self._indexes = {}
+        # results of repeated queries, see _cached_query
+        self._results = ResultCache()
+        # (role, fingerprint) of every file the collection was read from, for the cache
+        self._sources = []
+        # every mass-balance row read, so later versions of a file can be diffed against it, if `track_rows`
+        self._ledger = MeasurementLedger() if track_rows else None
+        # held by the async methods: shared by queries, exclusive for changes
+        self._access = ReadWriteLock()
+        # set by freeze, after which the collection never changes
+        self._frozen = False
+
+    def _initialise_from_columns(self, columns, columnar, track_rows=False):
+        # empty state, then the glaciers given by checked columns as from storage.encode_columns
+        if columnar:
+            self._initialise(GlacierStore(*columns), track_rows)
+            return
+
+        self._initialise(track_rows=track_rows)
+        for gid, name, unit, lat, lon, code in zip(*[column.tolist() for column in columns]):
+            self._register(Glacier(gid.decode(), name.decode(), unit.decode(), lat, lon, code))
+
+    def read_mass_balance_data(self, file_path, chunk_size=65536, bulk=False, units=None, years=None):
+        """Add the measurements of a mass-balance file to the glaciers of the collection.
+
+        With `bulk=True`, rows are parsed and validated a chunk of `chunk_size`
+        rows at a time and written straight into the glaciers, skipping the
+        per-measurement checks of `Glacier.add_mass_balance_measurement`.
+        `units` (a set of political unit codes) and `years` (an inclusive (first,
+        last) range) keep only those measurements, skipping other rows before the
+        rest of the row is checked.
+        """
         # check parameters
+        if not (type(bulk) == bool):
+            raise TypeError("Input parameter 'bulk' must be of boolean type")
+
+        self._check_mass_balance_file(file_path, chunk_size)
+        units, _ = _check_region(units, None)
+        _check_year_range(years)
+        fingerprint = _filtered_fingerprint(file_path, units=units, years=years)
+
+        # Arrow and Parquet files hold typed columns, so they are always read in bulk
+        if bulk or file_path.suffix in ARROW_EXTENSIONS:
+            self._read_mass_balance_bulk(file_path, chunk_size, units, years)
+        else:
+            self._read_mass_balance_rows(file_path, chunk_size, units, years)
+
+        self._sources.append(('mass_balance', fingerprint))
+
+        return True
+
+    def _region_filtered(self):
+        # whether the glaciers were loaded with `units` or `bbox`, leaving some of a file's glaciers out
+        return any(role == 'glaciers' and ('units' in fingerprint.get('filters', {}) or
+                                           'bbox' in fingerprint.get('filters', {}))
+                   for role, fingerprint in self._sources)
+
+    def _check_mass_balance_file(self, file_path, chunk_size):
+        if self._frozen:
+            raise TypeError("Collection is frozen, so mass-balance data cannot be added")
+
         if type(file_path) != PosixPath:
             raise TypeError("File holding mass-balance data not specified as a Path object")
 
+        if not (type(chunk_size) == int and chunk_size > 0):
+            raise ValueError("Input parameter 'chunk_size' must be a positive integer")
+
         if not file_path.is_file():
             raise FileNotFoundError("Specified glacier mass-balance data file does not exist")
 
         _, extension = splitext(file_path)
-        if extension != '.csv':
-            raise ValueError(f"Glacier mass-balance file must be '.csv' not '{extension}'")
-
-        # load mass balance data from file
+        if extension != '.csv' and extension not in ARROW_EXTENSIONS:
+            raise ValueError("Glacier mass-balance file must be '.csv', '.arrow', '.feather' or '.parquet' "
+                             f"not '{extension}'")
+
+    def update_mass_balance_data(self, file_path, chunk_size=65536, units=None, years=None):
+        """Apply only the rows of a mass-balance file that are new or changed since earlier reads.
+
+        Rows are matched with those read before by glacier ID, year and altitude
+        bounds, so the file can be a full new version of a file read earlier or
+        just its new rows, and reading the same row twice never adds a partial
+        balance twice. New rows are added as by `read_mass_balance_data(bulk=True)`.
+        A changed balance replaces the old one wherever the old one counted
+        (partial measurements, and the first measurement of a glacier-year).
+        `units` and `years` filter the rows as in `read_mass_balance_data`; if
+        neither is given, the filters the file was last read with are used.
+        Returns the number of new or changed rows.
+        """
+        # check parameters
+        self._check_mass_balance_file(file_path, chunk_size)
+        units, _ = _check_region(units, None)
+        _check_year_range(years)
+
+        if units is None and years is None:
+            filters = self._recorded_filters(file_path)
+            units, years = filters.get('units'), filters.get('years')
+
+        fingerprint = _filtered_fingerprint(file_path, units=units, years=years)
+
+        if self._ledger is None:
+            raise TypeError("Rows read into the collection are not kept (see 'track_rows'), so it cannot be updated")
+
+        chunks = list(_parse_mass_balance_chunks(file_path, chunk_size, units, years))
+        row_numbers, ids, years, lower_bounds, upper_bounds, mass_balances, partial = \
+            [np.concatenate(column) for column in zip(*chunks)]
+        rows, positions, balances = self._ledger.diff(ids, years, lower_bounds, upper_bounds, mass_balances)
+        instrumentation.add_rows(len(ids))
+        new, changed = positions < 0, positions >= 0
+
+        # a changed balance moves its glacier-year by the difference, if the old balance counted
+        counted = partial[rows[changed]] | self._ledger.first_of_year(positions[changed])
+        differences = balances[changed] - self._ledger.balances[positions[changed]]
+        self._ledger.replace(positions[changed], balances[changed])
+
+        # each new key is added as the one measurement its rows combine to
+        added = rows[new]
+        self._add_parsed_measurements(row_numbers[added], ids[added], years[added], lower_bounds[added],
+                                      upper_bounds[added], balances[new], partial[added])
+        applied = rows[changed][counted]
+        self._add_parsed_measurements(row_numbers[applied], ids[applied], years[applied], lower_bounds[applied],
+                                      upper_bounds[applied], differences[counted], np.ones(len(applied), dtype=bool),
+                                      record=False)
+
+        self._sources.append(('mass_balance_update', fingerprint))
+
+        return len(rows)
+
+    def _recorded_filters(self, file_path):
+        # filters a mass-balance file was last read with, as keyword arguments
+        path = str(Path(file_path).resolve())
+        for role, source in reversed(self._sources):
+            if role in ('mass_balance', 'mass_balance_update') and source['path'] == path:
+                return _filters_from_record(source)
+        return {}
+
+    def _read_mass_balance_rows(self, file_path, chunk_size, units=None, years=None):
+        # stream mass balance data from file, adding measurements row by row
         with open(file_path, 'r') as file:
             file.seek(0)
             header = file.readline()
             header = header[:-1].split(',')
             reader = csv.reader(file)
-            body = list(reader)
+            first_row = next(reader, None)
+
+            if first_row is None:
+                raise EOFError("No mass-balance data specified in the input file")
+
+            id_index = header.index('WGMS_ID')
+            year_index = header.index('YEAR')
+            mass_balance_index = header.index('ANNUAL_BALANCE')
+            lb_index = header.index('LOWER_BOUND')
+            ub_index = header.index('UPPER_BOUND')
+            unit_index = header.index('POLITICAL_UNIT') if units is not None else None
+            # glaciers left out of a collection loaded for a region have their measurements skipped
+            region = self._region_filtered()
+            # ID, year, lower bound, upper bound and balance of each measurement added since they were
+            # last recorded in the ledger, one after another in a flat list
+            added = []
+
+            try:
+                for i, row in enumerate(chain([first_row], reader)):
+                    if units is not None and row[unit_index] not in units:
+                        continue
+
+                    gid = row[id_index]
+                    year = int(row[year_index])
+
+                    if years is not None and not (years[0] <= year <= years[1]):
+                        continue
+
+                    mass_balance = row[mass_balance_index]
+
+                    if mass_balance == '':
+                        continue
+                    else:
+                        mass_balance = float(mass_balance)
+
+                    l_bound = int(row[lb_index])
+                    u_bound = int(row[ub_index])
+
+                    if l_bound == 9999 and u_bound == 9999:
+                        is_partial = False
+                    else:
+                        is_partial = True
+
+                    if gid not in self.glaciers.keys():
+                        if region:
+                            continue
+                        raise KeyError(f"Glacier on row {i} of mass-balance file trying to be populated with mass-balance data not present in collection")
+
+                    self.glaciers[gid]._add_measurement(year, mass_balance, is_partial)
+                    added.extend((gid, year, l_bound, u_bound, mass_balance))
+
+                    # keep the store's buffer of new measurements and the ledger compact
+                    if (i + 1) % chunk_size == 0:
+                        if self._store is not None:
+                            self._store.flush()
+                        self._record_rows(added)
+                        added = []
+            finally:
+                # measurements applied before an error are recorded too
+                self._record_rows(added)
+
+            instrumentation.add_rows(i + 1)
+
+    def _read_mass_balance_bulk(self, file_path, chunk_size, units=None, years=None):
+        for measurements in _parse_mass_balance_chunks(file_path, chunk_size, units, years):
+            self._add_parsed_measurements(*measurements)
+            instrumentation.add_rows(len(measurements[0]))
+
+    def _on_disk(self):
+        # whether the measurements are kept in memory-mapped files, see GlacierStore.keep_on_disk
+        return self._store is not None and self._store.directory is not None
+
+    def _record(self, ids, years, lower_bounds, upper_bounds, mass_balances):
+        # keep rows applied to the collection in the ledger, if it tracks them
+        if self._ledger is not None:
+            self._ledger.record(ids, years, lower_bounds, upper_bounds, mass_balances)
+
+    def _record_rows(self, added):
+        # record the rows applied by _read_mass_balance_rows in the ledger, a column at a time
+        if not added or self._ledger is None:
+            return
+
+        ids, years, lower_bounds, upper_bounds, mass_balances = [added[k::5] for k in range(5)]
+        self._ledger.record_keys(ledger_keys(ids, years, lower_bounds, upper_bounds), mass_balances)
+
+    def _add_parsed_measurements(self, row_numbers, ids, years, lower_bounds, upper_bounds, mass_balances, partial,
+                                 record=True):
+        # write measurements checked by _parse_mass_balance_chunks into the glaciers, and the ledger if `record`
+        if self._store is not None:
+            rows = self._store.rows(ids)
+            unknown = np.flatnonzero(rows < 0)
+        else:
+            gids, rows = np.unique(ids, return_inverse=True)
+            gids = np.char.decode(gids).tolist()
+            missing = set(gids) - self.glaciers.keys()
+            unknown = np.flatnonzero(np.isin(rows, [k for k, gid in enumerate(gids) if gid in missing]))
+
+        if len(unknown) > 0 and self._region_filtered():
+            # glaciers left out of a collection loaded for a region have their measurements skipped
+            known = np.ones(len(ids), dtype=bool)
+            known[unknown] = False
+            self._add_parsed_measurements(row_numbers[known], ids[known], years[known], lower_bounds[known],
+                                          upper_bounds[known], mass_balances[known], partial[known], record)
+            return
+
+        if len(unknown) > 0:
+            raise KeyError(f"Glacier on row {row_numbers[unknown[0]]} of mass-balance file trying to be populated "
+                           "with mass-balance data not present in collection")
+
+        if record:
+            self._record(ids, years, lower_bounds, upper_bounds, mass_balances)
+
+        if self._store is not None:
+            self._store.add_measurements(rows, years, mass_balances, partial)
+            return
+
+        # combine each glacier-year in one pass, then hand every glacier its share
+        rows, years, values, partial_sums = fold_measurements(rows, years, mass_balances, partial)
+        bounds = np.searchsorted(rows, np.arange(len(gids) + 1)).tolist()
+        years, values, partial_sums = years.tolist(), values.tolist(), partial_sums.tolist()
+
+        for k, gid in enumerate(gids):
+            start, end = bounds[k], bounds[k + 1]
+            self.glaciers[gid]._merge_mass_balances(years[start:end], values[start:end], partial_sums[start:end])
+
+    @classmethod
+    def from_files(cls, glacier_files, mass_balance_files=(), columnar=False, workers=None, chunk_size=65536,
+                   units=None, bbox=None, years=None, out_of_core=None, track_rows=False):
+        """Build a collection from several glacier data files and mass-balance files.
+
+        Each set of files is given as a list of Path objects or as a Path holding a
+        glob pattern, such as Path('regions/*/sheet-A.csv'). Files are parsed by a
+        pool of `workers` processes (by default one per CPU) and merged in order:
+        a glacier ID given in more than one glacier data file raises a KeyError,
+        and measurements are added as by `read_mass_balance_data(bulk=True)`.
+        `units`, `bbox` and `years` filter the files as in the constructor and
+        `read_mass_balance_data`, and `out_of_core` and `track_rows` keep the
+        measurements on disk and the rows read in a ledger as in the constructor.
+        """
+        # check parameters
+        glacier_files = _expand_files(glacier_files, "glacier data files")
+        mass_balance_files = _expand_files(mass_balance_files, "mass-balance files")
+        units, bbox = _check_region(units, bbox)
+        _check_year_range(years)
 
-        if len(body) == 0:
-            raise EOFError("No mass-balance data specified in the input file")
+        if len(glacier_files) == 0:
+            raise ValueError("No glacier data files specified")
 
-        id_index = header.index('WGMS_ID')
-        year_index = header.index('YEAR')
-        mass_balance_index = header.index('ANNUAL_BALANCE')
-        lb_index = header.index('LOWER_BOUND')
-        ub_index = header.index('UPPER_BOUND')
+        if not (type(columnar) == bool):
+            raise TypeError("Input parameter 'columnar' must be of boolean type")
 
-        for row in body:
-            gid = row[id_index]
-            year = int(row[year_index])
-            mass_balance = row[mass_balance_index]
+        columnar = _check_out_of_core(out_of_core, columnar)
+        _check_track_rows(track_rows, out_of_core)
 
-            if mass_balance == '':
-                continue
-            else:
-                mass_balance = float(mass_balance)
+        if workers is None:
+            workers = os.cpu_count() or 1
 
-            l_bound = int(row[lb_index])
-            u_bound = int(row[ub_index])
+        if not (type(workers) == int):
+            raise TypeError("Input number of workers is not an integer")
 
-            if l_bound == 9999 and u_bound == 9999:
-                is_partial = False
-            else:
-                is_partial = True
+        if workers < 1:
+            raise ValueError("Input number of workers must be positive")
+
+        if not (type(chunk_size) == int and chunk_size > 0):
+            raise ValueError("Input parameter 'chunk_size' must be a positive integer")
+
+        for file_path in mass_balance_files:
+            if not file_path.is_file():
+                raise FileNotFoundError(f"Specified glacier mass-balance data file {file_path} does not exist")
 
-            if mass_balance != '':
-                if gid not in self.glaciers.keys():
-                    raise KeyError("Glacier trying to be populated with mass-balance data not present in collection")
+            _, extension = splitext(file_path)
+            if extension != '.csv' and extension not in ARROW_EXTENSIONS:
+                raise ValueError("Glacier mass-balance file must be '.csv', '.arrow', '.feather' or '.parquet' "
+                                 f"not '{extension}'")
 
-                self.glaciers[gid].add_mass_balance_measurement(int(year), float(mass_balance), is_partial)
+        # parse every file at once, glacier and mass-balance files alike
+        if workers == 1 or len(glacier_files) + len(mass_balance_files) == 1:
+            glacier_results = list(map(_parse_glacier_file, glacier_files, repeat(units), repeat(bbox)))
+            mass_balance_results = list(map(_parse_mass_balance_file, mass_balance_files, repeat(chunk_size),
+                                            repeat(units), repeat(years)))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                glacier_results = executor.map(_parse_glacier_file, glacier_files, repeat(units), repeat(bbox))
+                mass_balance_results = executor.map(_parse_mass_balance_file, mass_balance_files, repeat(chunk_size),
+                                                    repeat(units), repeat(years))
+                glacier_results, mass_balance_results = list(glacier_results), list(mass_balance_results)
+
+        columns = [np.concatenate(column) for column in zip(*[result[0] for result in glacier_results])]
+        ids, counts = np.unique(columns[0], return_counts=True)
+        if (counts > 1).any():
+            raise KeyError(f"Glacier ID {ids[counts > 1][0].decode()} specified in more than one glacier data file")
+
+        collection = cls.__new__(cls)
+        collection._initialise_from_columns(columns, columnar, track_rows)
+        collection._sources = [('glaciers', fingerprint) for _, fingerprint in glacier_results]
+        if out_of_core is not None:
+            collection._store.keep_on_disk(out_of_core)
+
+        for measurements, fingerprint in mass_balance_results:
+            collection._add_parsed_measurements(*measurements)
+            collection._sources.append(('mass_balance', fingerprint))
+
+        return collection
+
+    def save_cache(self, path):
+        """Write a binary snapshot of the collection to the directory `path`.
+
+        The snapshot holds the glacier columns and measurement table as .npy files
+        plus a record of the source files, which `load_cache` uses to tell
+        whether the snapshot is still up to date.
+        """
+        # check parameters
+        if not (type(path) == PosixPath):
+            raise TypeError("Directory cache to be saved to not specified as a Path object")
+
+        path.mkdir(parents=True, exist_ok=True)
+        store = self._store if self._store is not None else self._build_store()
+        store.save(path)
+        if self._ledger is not None:
+            self._ledger.save(path)
+        else:
+            MeasurementLedger.remove(path)
+
+        sources = []
+        for role, fingerprint in self._sources:
+            fingerprint = dict(fingerprint)
+            # only hash files that have not changed since they were read
+            if fingerprint_matches(fingerprint):
+                fingerprint['sha256'] = file_hash(fingerprint['path'])
+            sources.append({'role': role, **fingerprint})
+
+        temporary = path / 'sources.json.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(sources, file)
+        os.replace(temporary, path / 'sources.json')
 
         return True
 
+    @classmethod
+    def load_cache(cls, path):
+        """Load a collection from a snapshot written by `save_cache`.
+
+        The snapshot's arrays are memory-mapped, so processes loading the same
+        snapshot share its pages. If any source file has changed since the
+        snapshot was written, the collection is read from the source files
+        instead and the snapshot is rewritten.
+        """
+        # check parameters
+        if not (type(path) == PosixPath):
+            raise TypeError("Directory cache to be loaded from not specified as a Path object")
+
+        if not (path / 'sources.json').is_file():
+            raise FileNotFoundError("Specified glacier cache does not exist")
+
+        with open(path / 'sources.json', 'r') as file:
+            sources = json.load(file)
+
+        if all(fingerprint_matches(source) for source in sources):
+            collection = cls.__new__(cls)
+            collection._initialise(GlacierStore.load(path))
+            collection._sources = [(source.pop('role'), source) for source in sources]
+            collection._ledger = MeasurementLedger.load(path)
+            return collection
+
+        # a snapshot saved with a ledger is rebuilt keeping the rows read
+        track_rows = MeasurementLedger.load(path) is not None
+
+        # stale snapshot: rebuild from the sources
+        glacier_files = [Path(source['path']) for source in sources if source['role'] == 'glaciers']
+        mass_balance_files = [Path(source['path']) for source in sources if source['role'] == 'mass_balance']
+        if len(glacier_files) == 0:
+            raise ValueError("Glacier cache does not record the glacier data files it was built from")
+
+        # files are read again with the filters they were first read with
+        glacier_filters = _filters_from_record(next(source for source in sources if source['role'] == 'glaciers'))
+        if any('filters' in source for source in sources if source['role'] == 'mass_balance'):
+            collection = cls.from_files(glacier_files, columnar=True, track_rows=track_rows, **glacier_filters)
+            for source in sources:
+                if source['role'] == 'mass_balance':
+                    collection.read_mass_balance_data(Path(source['path']), bulk=True, **_filters_from_record(source))
+        else:
+            collection = cls.from_files(glacier_files, mass_balance_files, columnar=True, track_rows=track_rows,
+                                        **glacier_filters)
+
+        for source in sources:
+            if source['role'] == 'mass_balance_update':
+                collection.update_mass_balance_data(Path(source['path']), **_filters_from_record(source))
+
+        collection.save_cache(path)
+
+        return collection
+
+    def _build_store(self):
+        # columnar copy of a dict-backed collection
+        glaciers = list(self.glaciers.values())
+        store = GlacierStore(*encode_columns([glacier.id for glacier in glaciers],
+                                             [glacier.name for glacier in glaciers],
+                                             [glacier.unit for glacier in glaciers],
+                                             [glacier.coordinates[0] for glacier in glaciers],
+                                             [glacier.coordinates[1] for glacier in glaciers],
+                                             [glacier.type for glacier in glaciers]))
+
+        rows, years, mass_balances = [], [], []
+        for row, glacier in enumerate(glaciers):
+            rows.extend([row] * len(glacier.mass_balances))
+            years.extend(glacier.mass_balances.keys())
+            mass_balances.extend(glacier.mass_balances.values())
+
+        store.add_measurements(rows, years, mass_balances, np.zeros(len(rows), dtype=bool))
+        store.compact()
+
+        return store
+
+    @_cached_query
     def find_nearest(self, lat, lon, n=5):
         """Get the n glaciers closest to the given coordinates."""
         # check parameters
@@ -253,21 +1500,273 @@ class GlacierCollection:
             raise ValueError(f"There are not 'n={n}' glaciers in the dataset to return")
 
         # calculate nearest glaciers
-        nearest = {}
+        index = self._spatial_index()
+        positions, chords = index.nearest(lat, lon, n)
+
+        if len(positions) > 0:
+            # widen to every glacier the index cannot tell apart from the n-th, then rank exactly
+            positions = index.within(lat, lon, chords[-1] * (1 + 1e-9) + 1e-12)
+
+        _, positions = self._rank_by_distance(index, lat, lon, positions)
+
+        return self._names_at(positions[:n]).tolist()
 
-        for k, v in self.glaciers.items():
-            lat2, lon2 = v.coordinates
-            dist = haversine_distance(lat, lon, lat2, lon2)
+    def find_nearest_many(self, lats, lons, n=5, chunk_size=None):
+        """Get the n glaciers closest to each of many coordinates.
 
-            if len(nearest.keys()) < n:
-                nearest.update({v.name: dist})
-            elif dist < max(nearest.values()):
-                maxi = max(nearest, key=nearest.get)
-                nearest.pop(maxi)
-                nearest.update({v.name: dist})
+        Returns (ids, names, distances) arrays of shape (M, n) for M query points,
+        nearest first, with distances in km.
+        """
+        # check parameters once for the whole batch
+        lats = np.asarray(lats)
+        lons = np.asarray(lons)
 
-        return list(nearest.keys())
+        if not (lats.ndim == 1 and lats.shape == lons.shape):
+            raise ValueError("Latitudes and longitudes must be one-dimensional and of the same length")
 
+        if not (np.issubdtype(lats.dtype, np.integer) or np.issubdtype(lats.dtype, np.floating)):
+            raise TypeError("Latitudes are not of accepted numeric type")
+
+        if not (np.issubdtype(lons.dtype, np.integer) or np.issubdtype(lons.dtype, np.floating)):
+            raise TypeError("Longitudes are not of accepted numeric type")
+
+        if not np.all((-90 <= lats) & (lats <= 90)):
+            raise ValueError("Invalid latitude given (should be in range -90 to 90)")
+
+        if not np.all((-180 <= lons) & (lons <= 180)):
+            raise ValueError("Invalid longitude given (should be in range -180 to 180)")
+
+        if type(n) != int:
+            raise TypeError("The number of glaciers to return 'n' is not an integer")
+
+        if n < 0:
+            raise ValueError("The number of glaciers to return 'n' must be non-negative")
+
+        if len(self.glaciers.keys()) < n:
+            raise ValueError(f"There are not 'n={n}' glaciers in the dataset to return")
+
+        if not (chunk_size is None or (type(chunk_size) == int and chunk_size > 0)):
+            raise ValueError("Input parameter 'chunk_size' must be a positive integer or None")
+
+        # calculate nearest glaciers
+        instrumentation.add_rows(len(lats))
+        index = self._spatial_index()
+        positions, _ = index.nearest_many(lats, lons, n, chunk_size)
+        distances = haversine_distance_array(lats[:, None], lons[:, None], index.lats[positions], index.lons[positions])
+
+        # rank each row by exact distance, like find_nearest
+        order = np.lexsort((positions, distances), axis=1)
+        positions = np.take_along_axis(positions, order, axis=1)
+        distances = np.take_along_axis(distances, order, axis=1)
+
+        return self._ids_at(positions), self._names_at(positions), distances
+
+    def find_within_radius(self, lat, lon, radius):
+        """Get the glaciers within `radius` km of the given coordinates, nearest first."""
+        # check parameters
+        if not (type(lat) == int or type(lat) == float):
+            raise TypeError("Latitude is not of accepted numeric type")
+
+        if not (-90 <= lat <= 90):
+            raise ValueError("Invalid latitude given (should be in range -90 to 90)")
+
+        if not (type(lon) == int or type(lon) == float):
+            raise TypeError("Longitude is not of accepted numeric type")
+
+        if not (-180 <= lon <= 180):
+            raise ValueError("Invalid longitude given (should be in range -180 to 180)")
+
+        if not (type(radius) == int or type(radius) == float):
+            raise TypeError("Search radius is not of accepted numeric type")
+
+        if radius < 0:
+            raise ValueError("Search radius must be non-negative")
+
+        index = self._spatial_index()
+        positions = index.within(lat, lon, km_to_chord(radius) * (1 + 1e-9) + 1e-12)
+
+        distances, positions = self._rank_by_distance(index, lat, lon, positions)
+
+        return self._names_at(positions[distances <= radius]).tolist()
+
+    def add_glacier(self, glacier):
+        """Add a Glacier object to the collection."""
+        if self._frozen:
+            raise TypeError("Collection is frozen, so glaciers cannot be added")
+
+        if not isinstance(glacier, Glacier):
+            raise TypeError("Glacier to add is not a Glacier object")
+
+        if glacier.id in self.glaciers.keys():
+            raise KeyError("Glacier ID already present in collection")
+
+        if self._store is not None:
+            row = self._store.append(glacier.id, glacier.name, glacier.unit, *glacier.coordinates, glacier.type)
+            for year, mass_balance in glacier.mass_balances.items():
+                self._store.add_measurement(row, year, mass_balance, False)
+        else:
+            # a view lives in another collection's store, so this collection keeps its own copy
+            if isinstance(glacier, GlacierView):
+                view = glacier
+                glacier = Glacier(view.id, view.name, view.unit, *view.coordinates, view.type)
+                for year, mass_balance in view.mass_balances.items():
+                    glacier._record_mass_balance(year, mass_balance, False)
+
+            self._register(glacier)
+
+        self._generation += 1
+
+        return True
+
+    def configure_result_cache(self, maxsize=128, ttl=None, policy='lru'):
+        """Replace the cache of query results with one of the given size, lifetime and eviction policy.
+
+        `find_nearest`, `filter_by_code` and `sort_by_latest_mass_balance` calls
+        repeating earlier arguments are answered from the cache until glaciers
+        or measurements are added or changed. `maxsize=0` turns caching off.
+        """
+        self._results = ResultCache(maxsize, ttl, policy)
+        return True
+
+    def result_cache_stats(self):
+        """Return the settings, size and hit, miss, eviction, expiration and invalidation counts of the result cache."""
+        return self._results.stats()
+
+    def freeze(self):
+        """Make the collection read-only and build its indexes, so it can be queried from many threads.
+
+        Adding glaciers or measurements to a frozen collection raises a TypeError.
+        Returns the collection.
+        """
+        self._frozen = True
+
+        if self._store is not None:
+            self._store.compact()
+            self._store.read_only = True
+        else:
+            self.glaciers = MappingProxyType(self.glaciers)
+
+        # build everything queries would otherwise build on first use
+        self._glacier_list()
+        self._spatial_index()
+        self._code_index()
+        self._latest_order(False)
+        self._latest_order(True)
+        if not self._on_disk():
+            self._year_index()
+
+        return self
+
+    @staticmethod
+    def stats():
+        """Return the timings recorded while instrumentation is enabled, see `instrumentation.stats`."""
+        return instrumentation.stats()
+
+    def _register(self, glacier):
+        # add a glacier to a dict-backed collection, counting it in the summary from now on
+        glacier._collections += (self,)
+        self.glaciers.update({glacier.id: glacier})
+        self._counted += 1
+        if glacier.latest_year is not None:
+            self._measurement_added(glacier, None)
+
+    def _recount(self):
+        # rebuild the summary counts after glaciers were put into (or removed from) the dict directly
+        self._latest_counts = (None, 0, 0)
+        self._counted = len(self.glaciers)
+        for glacier in self.glaciers.values():
+            if self not in glacier._collections:
+                glacier._collections += (self,)
+            if glacier.latest_year is not None:
+                self._measurement_added(glacier, None)
+
+    def _measurement_added(self, glacier, previous):
+        """Update the summary counts after a glacier's measurements changed from a latest value of `previous`."""
+        earliest_year, measured, shrinking = self._latest_counts
+
+        if previous is None:
+            measured += 1
+        elif previous < 0:
+            shrinking -= 1
+
+        if glacier.latest_mass_balance < 0:
+            shrinking += 1
+
+        if earliest_year is None or glacier.earliest_year < earliest_year:
+            earliest_year = glacier.earliest_year
+
+        self._latest_counts = (earliest_year, measured, shrinking)
+        self._measurements += 1
+
+    def _measurements_edited(self):
+        """Mark the summary counts for rebuilding after a glacier's measurements were edited."""
+        self._measurements += 1
+        self._counted = -1
+
+    def _data_version(self, measurements=True):
+        # changes whenever glaciers (and, with `measurements`, their measurements) are added or changed;
+        # the length catches glaciers inserted into the dict directly
+        key = (self._generation, len(self.glaciers))
+        if measurements:
+            key += (self._measurements if self._store is None else self._store.version,)
+        return key
+
+    def _derived(self, name, build, measurements=False):
+        """Return a structure derived from the glaciers, rebuilding it if glaciers were added.
+
+        Structures built from the measurements pass `measurements=True` to also
+        be rebuilt when measurements are added.
+        """
+        key = self._data_version(measurements)
+        if name not in self._indexes or self._indexes[name][0] != key:
+            self._indexes[name] = (key, build())
+
+        return self._indexes[name][1]
+
+    def _glacier_list(self):
+        # glaciers of a dict-backed collection by position, as used by the indexes
+        return self._derived('glacier_list', lambda: list(self.glaciers.values()))
+
+    def _names_at(self, positions):
+        # names of the glaciers at an array of positions in the collection
+        if self._store is not None:
+            return np.char.decode(self._store.names[positions])
+        return self._derived('names', lambda: np.array([glacier.name for glacier in self._glacier_list()]))[positions]
+
+    def _spatial_index(self):
+        def build():
+            if self._store is not None:
+                return SphericalIndex(self._store.lats, self._store.lons)
+            glaciers = self._glacier_list()
+            return SphericalIndex([glacier.coordinates[0] for glacier in glaciers],
+                                  [glacier.coordinates[1] for glacier in glaciers])
+
+        return self._derived('spatial_index', build)
+
+    def _code_index(self):
+        def build():
+            if self._store is not None:
+                return CodeIndex(self._store.codes)
+            return CodeIndex([glacier.type for glacier in self._glacier_list()])
+
+        return self._derived('code_index', build)
+
+    def _rank_by_distance(self, index, lat, lon, positions):
+        # sort by exact distance, breaking ties by position in the collection
+        distances = haversine_distance_array(lat, lon, index.lats[positions], index.lons[positions])
+        order = np.lexsort((positions, distances))
+        return distances[order], positions[order]
+
+    def _find_nearest_by_scan(self, lat, lon, n):
+        """Brute-force version of `find_nearest`, checking the distance to every glacier."""
+        glaciers = list(self.glaciers.values())
+        lats = [glacier.coordinates[0] for glacier in glaciers]
+        lons = [glacier.coordinates[1] for glacier in glaciers]
+        distances = haversine_distance_array(lat, lon, lats, lons)
+        order = np.lexsort((np.arange(len(glaciers)), distances))
+        return [glaciers[position].name for position in order[:n]]
+
+    @_cached_query
     def filter_by_code(self, code_pattern):
         """Return the names of glaciers whose codes match the given pattern."""
         # check parameters
@@ -285,31 +1784,9 @@ class GlacierCollection:
             raise ValueError("Input code pattern must be all numeric characters")
 
         # filter all glaciers by pattern
-        names = []
-        code_pattern = str(code_pattern)
-        codes = [code_pattern]
-
-        while True:
-            new_codes = []
-            for code in codes:
-                if '?' in code:
-                    ind = code.index('?')
-                    new_codes.extend([code[:ind] + str(x) + code[ind+1:] for x in range(10)])
-                else:
-                    new_codes.append(code)
-
-            if new_codes == codes:
-                codes = list(map(int, codes))
-                break
-            else:
-                codes = new_codes.copy()
-
-        for k, v in self.glaciers.items():
-            if v.type in codes:
-                names.append(v.name)
-
-        return names
+        return self._names_at(self._code_index().match(code_pattern)).tolist()
 
+    @_cached_query
     def sort_by_latest_mass_balance(self, n=5, reverse=False):
         """Return the N glaciers with the highest area accumulated in the last measurement."""
         # check parameters
@@ -322,59 +1799,63 @@ class GlacierCollection:
         if not (type(reverse) == bool):
             raise TypeError("Input parameter 'reverse' must be of boolean type")
 
-        # find greatest/smallest change and return result
-        changes = {}
+        # glaciers ordered by latest change, ties broken by position in the collection
+        positions, _, _ = self._latest_table()
 
-        for k, v in self.glaciers.items():
-            if len(v.mass_balances.keys()) > 0:
-                latest_change = v.mass_balances[max(v.mass_balances.keys())]
+        if len(positions) == 0:
+            raise ValueError("No glaciers have mass-balance data, so cannot return highest/lowest changes")
 
-                if not reverse:
-                    if len(changes.keys()) < n:
-                        changes.update({latest_change: v})
-                    elif latest_change > min(changes.keys()):
-                        changes.pop(min(changes.keys()))
-                        changes.update({latest_change: v})
-                else:
-                    if len(changes.keys()) < n:
-                        changes.update({latest_change: v})
-                    elif latest_change < max(changes.keys()):
-                        changes.pop(max(changes.keys()))
-                        changes.update({latest_change: v})
+        if len(positions) < n:
+            raise ValueError("There are not 'n' glaciers in the collection with mass-balance data to sort")
 
-        if len(changes) == 0:
-            raise ValueError("No glaciers have mass-balance data, so cannot return highest/lowest changes")
+        top = positions[self._latest_order(reverse)[:n]].tolist()
 
-        result = [changes[k] for k in sorted(changes.keys(), reverse=(not reverse))]
+        if self._store is not None:
+            return [GlacierView(self._store, row) for row in top]
 
-        if not (len(result) == n):
-            raise ValueError("There are not 'n' glaciers in the collection with mass-balance data to sort")
+        glaciers = self._glacier_list()
+        return [glaciers[position] for position in top]
+
+    def _latest_table(self):
+        # (positions, years, balances) of the latest measurement of every measured glacier
+        def build():
+            if self._store is not None:
+                return self._store.latest()
+
+            measured = [(position, glacier.latest_year, glacier.latest_mass_balance)
+                        for position, glacier in enumerate(self._glacier_list()) if glacier.latest_year is not None]
+            positions, years, balances = zip(*measured) if measured else ((), (), ())
+            return (np.array(positions, dtype=np.int64), np.array(years, dtype=np.int64),
+                    np.array(balances, dtype=np.float64))
+
+        return self._derived('latest_table', build, measurements=True)
 
-        return result
+    def _latest_order(self, reverse):
+        # order of _latest_table sorting the latest changes, sorted once until measurements change
+        def build():
+            positions, _, balances = self._latest_table()
+            return np.lexsort((positions, balances if reverse else -balances))
+
+        return self._derived('latest_order_reverse' if reverse else 'latest_order', build, measurements=True)
 
     def summary(self):
         # number of glaciers
         no_glaciers = len(self.glaciers.keys())
 
-        # earliest mass-balance measurement year
-        earliest_year = datetime.now().year
-        for k, v in self.glaciers.items():
-            if len(v.mass_balances.keys()) > 0:
-                min_year_k = min(v.mass_balances.keys())
-
-                if min_year_k < earliest_year:
-                    earliest_year = min_year_k
+        if self._store is not None:
+            def count():
+                _, _, latest_changes = self._latest_table()
+                return self._store.earliest_year(), len(latest_changes), int((latest_changes < 0).sum())
 
-        # % of glaciers that shrunk at last measurement
-        glaciers_with_measurements = 0
-        shrinkers = 0
+            earliest_year, glaciers_with_measurements, shrinkers = self._derived('latest_counts', count, measurements=True)
+        else:
+            if len(self.glaciers) != self._counted:
+                self._recount()
+            earliest_year, glaciers_with_measurements, shrinkers = self._latest_counts
 
-        for k, v in self.glaciers.items():
-            if len(v.mass_balances.keys()) > 0:
-                glaciers_with_measurements += 1
-                latest_change = v.mass_balances[max(v.mass_balances.keys())]
-                if latest_change < 0:
-                    shrinkers += 1
+        # earliest mass-balance measurement year
+        if earliest_year is None:
+            earliest_year = datetime.now().year
 
         if glaciers_with_measurements == 0:
             raise ZeroDivisionError("No glaciers in collection have mass-balance data")
@@ -387,6 +1868,263 @@ class GlacierCollection:
 
         return True
 
+    def _measurement_table(self):
+        # (positions, years, balances) of every measurement, sorted by position in the collection then year
+        def build():
+            if self._store is not None:
+                self._store.compact()
+                counts = np.diff(self._store.offsets)
+                return (np.repeat(np.arange(len(counts)), counts), np.asarray(self._store.years, dtype=np.int64),
+                        np.asarray(self._store.balances))
+
+            glaciers = self._glacier_list()
+            counts = np.fromiter((len(glacier.mass_balances) for glacier in glaciers), dtype=np.int64,
+                                 count=len(glaciers))
+            positions = np.repeat(np.arange(len(glaciers)), counts)
+            years = np.fromiter(chain.from_iterable(glacier.mass_balances for glacier in glaciers), dtype=np.int64,
+                                count=len(positions))
+            balances = np.fromiter(chain.from_iterable(glacier.mass_balances.values() for glacier in glaciers),
+                                   dtype=np.float64, count=len(positions))
+            order = np.lexsort((years, positions))
+            return positions[order], years[order], balances[order]
+
+        return self._derived('measurement_table', build, measurements=True)
+
+    def _measurement_chunks(self, years=None):
+        # the measurement table in runs of whole glaciers, restricted to an inclusive (first, last) year range;
+        # an out-of-core table is read a run at a time rather than loaded, the others are a single run
+        chunks = self._store.table_chunks() if self._on_disk() else [self._measurement_table()]
+        for positions, measured_years, balances in chunks:
+            if years is not None:
+                keep = (measured_years >= years[0]) & (measured_years <= years[1])
+                positions, measured_years, balances = positions[keep], measured_years[keep], balances[keep]
+            yield positions, measured_years, balances
+
+    def _per_chunk(self, analysis, years):
+        # run a per-glacier analysis on each run of the measurement table, joining the resulting arrays
+        parts = [analysis(*measurements) for measurements in self._measurement_chunks(years)]
+        return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+    def _ids_at(self, positions):
+        # IDs of the glaciers at an array of positions in the collection
+        def build():
+            if self._store is not None:
+                # IDs are ASCII, so a cast decodes them much faster than np.char.decode
+                return self._store.ids.astype(str)
+            return np.array([glacier.id for glacier in self._glacier_list()])
+
+        return self._derived('ids', build)[positions]
+
+    def mass_balance_trends(self, years=None):
+        """Return the least-squares linear trend of the mass-balance of every glacier measured in at least two years.
+
+        `years` limits the measurements used to an inclusive (first, last) range.
+        Returns a dict of arrays: 'id', 'count' (years measured), 'slope' (change
+        in mass-balance per year) and 'intercept' (fitted mass-balance in year 0).
+        """
+        # check parameters
+        _check_year_range(years)
+
+        return self._per_chunk(self._trends, years)
+
+    def _trends(self, positions, measured_years, balances):
+        # group sums over each glacier's measurements, with years centred on the glacier's mean year
+        groups, group_of = np.unique(positions, return_inverse=True)
+        counts = np.bincount(group_of)
+        mean_years = np.bincount(group_of, weights=measured_years) / counts
+        mean_balances = np.bincount(group_of, weights=balances) / counts
+        centred = measured_years - mean_years[group_of]
+        covariances = np.bincount(group_of, weights=centred * (balances - mean_balances[group_of]))
+        variances = np.bincount(group_of, weights=centred * centred)
+
+        fitted = counts >= 2
+        slopes = covariances[fitted] / variances[fitted]
+        return {'id': self._ids_at(groups[fitted]),
+                'count': counts[fitted],
+                'slope': slopes,
+                'intercept': mean_balances[fitted] - slopes * mean_years[fitted]}
+
+    def cumulative_mass_balances(self, years=None):
+        """Return the running total of the mass-balance of every glacier, one row per glacier-year.
+
+        `years` limits the measurements used to an inclusive (first, last) range,
+        with totals starting from the first year of the range. Returns a dict of
+        arrays 'id', 'year' and 'cumulative', sorted by glacier then year.
+        """
+        # check parameters
+        _check_year_range(years)
+
+        return self._per_chunk(self._cumulative, years)
+
+    def _cumulative(self, positions, measured_years, balances):
+        # running sum over the whole table, minus the total before each glacier's first measurement
+        totals = np.cumsum(balances)
+        starts = np.flatnonzero(np.r_[True, positions[1:] != positions[:-1]]) if len(positions) else positions
+        before = np.repeat(totals[starts] - balances[starts], np.diff(np.r_[starts, len(positions)]))
+
+        return {'id': self._ids_at(positions), 'year': measured_years, 'cumulative': totals - before}
+
+    def rolling_mean_mass_balances(self, window=5, years=None):
+        """Return the mean mass-balance of every glacier over the `window` years up to each year measured.
+
+        Only measured years count towards a mean, so 'count' gives how many of the
+        `window` years were measured. `years` limits the measurements used to an
+        inclusive (first, last) range. Returns a dict of arrays 'id', 'year',
+        'count' and 'mean', one row per glacier-year, sorted by glacier then year.
+        """
+        # check parameters
+        if not (type(window) == int):
+            raise TypeError("Rolling window must be an integer number of years")
+
+        if window < 1:
+            raise ValueError("Rolling window must be at least one year")
+
+        _check_year_range(years)
+
+        return self._per_chunk(lambda *measurements: self._rolling_mean(window, *measurements), years)
+
+    def _rolling_mean(self, window, positions, measured_years, balances):
+        # the table is sorted by (position, year), so each window is a contiguous run of one glacier's rows
+        keys = positions * 65536 + measured_years
+        ends = np.arange(1, len(keys) + 1)
+        starts = np.maximum(np.searchsorted(keys, keys - (window - 1)), np.searchsorted(positions, positions))
+        totals = np.r_[0.0, np.cumsum(balances)]
+        counts = ends - starts
+
+        return {'id': self._ids_at(positions), 'year': measured_years, 'count': counts,
+                'mean': (totals[ends] - totals[starts]) / counts}
+
+    def _year_index(self):
+        def build():
+            if self._store is not None:
+                units = self._store.units.astype(str)
+            else:
+                units = [glacier.unit for glacier in self._glacier_list()]
+            return YearIndex(*self._measurement_table(), units)
+
+        return self._derived('year_index', build, measurements=True)
+
+    def _unit_codes(self):
+        # (sorted political units, code of each glacier's unit), as in the year index
+        return self._derived('unit_codes', lambda: np.unique(self._store.units.astype(str), return_inverse=True))
+
+    def _scan_year(self, year, unit):
+        # balances_in_year for an out-of-core table, scanned a run at a time instead of indexed
+        units, glacier_units = self._unit_codes()
+        found = [(positions, balances) for positions, _, balances in self._measurement_chunks((year, year))]
+        positions, balances = (np.concatenate(column) for column in zip(*found))
+        if unit is not None:
+            keep = units[glacier_units[positions]] == unit
+            positions, balances = positions[keep], balances[keep]
+
+        order = np.lexsort((positions, glacier_units[positions]))
+        return positions[order], balances[order]
+
+    def _scan_regional_means(self):
+        # annual_regional_means for an out-of-core table, summing each run's (year, unit) groups
+        units, glacier_units = self._unit_codes()
+        size = max(len(units), 1)
+        keys, sums, counts = [], [], []
+        for positions, measured_years, balances in self._measurement_chunks():
+            groups, group_of = np.unique(measured_years * size + glacier_units[positions], return_inverse=True)
+            keys.append(groups)
+            sums.append(np.bincount(group_of, weights=balances, minlength=len(groups)))
+            counts.append(np.bincount(group_of, minlength=len(groups)))
+
+        groups, group_of = np.unique(np.concatenate(keys), return_inverse=True)
+        sums = np.bincount(group_of, weights=np.concatenate(sums), minlength=len(groups))
+        counts = np.bincount(group_of, weights=np.concatenate(counts), minlength=len(groups)).astype(np.int64)
+        return groups // size, units[groups % size], counts, sums / counts
+
+    def balances_in_year(self, year, unit=None):
+        """Return the mass-balance of every glacier measured in a year, optionally only those of one political unit.
+
+        Returns a dict of arrays 'id' and 'balance', sorted by political unit and
+        then by position in the collection.
+        """
+        # check parameters
+        if not (type(year) == int):
+            raise TypeError("Year must be an integer")
+
+        if not (unit is None or type(unit) == str):
+            raise TypeError("Political unit must be a string code or None")
+
+        if self._on_disk():
+            positions, balances = self._scan_year(year, unit)
+        else:
+            positions, balances = self._year_index().year(year, unit)
+        return {'id': self._ids_at(positions), 'balance': balances}
+
+    def annual_regional_means(self):
+        """Return the mean mass-balance of the glaciers of each political unit in each year.
+
+        Returns a dict of arrays 'year', 'unit', 'count' (glaciers measured) and
+        'mean', one row per unit and year with measurements, sorted by year then unit.
+        """
+        if self._on_disk():
+            years, units, counts, means = self._scan_regional_means()
+        else:
+            years, units, counts, means = self._year_index().regional_means()
+        return {'year': years, 'unit': units, 'count': counts, 'mean': means}
+
+    def _positions_of(self, ids):
+        # positions in the collection of an array of IDs of glaciers in it
+        if self._store is not None:
+            return self._store.rows(ids)
+
+        all_ids = self._ids_at(slice(None))
+        order = self._derived('id_order', lambda: np.argsort(all_ids, kind='stable'))
+        return order[np.searchsorted(all_ids[order], np.asarray(ids).astype(str))]
+
+    def _band_index(self):
+        # altitude bands of the partial measurements, from the rows kept in the ledger
+        if self._ledger is None:
+            raise TypeError("Rows read into the collection are not kept (see 'track_rows'), so it has no altitude bands")
+
+        def build():
+            ids, years, lowers, uppers, balances = self._ledger.rows()
+            partial = ~((lowers == 9999) & (uppers == 9999))
+            return BandIndex(self._positions_of(ids[partial]), years[partial], lowers[partial], uppers[partial],
+                             balances[partial])
+
+        return self._derived('band_index', build, measurements=True)
+
+    def altitude_bands(self, glacier_id):
+        """Return the altitude-band (partial) measurements of one glacier.
+
+        Returns a dict of arrays 'year', 'lower' and 'upper' (bounds in metres
+        above sea level) and 'balance', sorted by year and then by bounds.
+        """
+        # check parameters
+        if not (type(glacier_id) == str):
+            raise TypeError("Glacier ID must be a string")
+
+        if glacier_id not in self.glaciers.keys():
+            raise KeyError("Glacier ID not present in collection")
+
+        years, lowers, uppers, balances = self._band_index().glacier(self._positions_of(np.array([glacier_id]))[0])
+        return {'year': years, 'lower': lowers, 'upper': uppers, 'balance': balances}
+
+    def balances_in_band(self, year, lower, upper):
+        """Return the summed mass-balance of the altitude bands within lower-upper metres of every glacier in a year.
+
+        Only bands lying entirely inside the range count. Returns a dict of arrays
+        'id', 'balance' and 'bands' (the number of bands summed), sorted by
+        position in the collection.
+        """
+        # check parameters
+        if not (type(year) == int):
+            raise TypeError("Year must be an integer")
+
+        if not (type(lower) == int and type(upper) == int):
+            raise TypeError("Altitude bounds must be integers")
+
+        if lower > upper:
+            raise ValueError("Lower altitude bound is greater than the upper bound")
+
+        positions, balances, counts = self._band_index().within(year, lower, upper)
+        return {'id': self._ids_at(positions), 'balance': balances, 'bands': counts}
+
     def plot_extremes(self, output_path, latest_=None):
         # check parameters
         if not (type(output_path) == PosixPath):
@@ -395,8 +2133,7 @@ class GlacierCollection:
         # retrieve growth extreme data
         grow_extreme = self.sort_by_latest_mass_balance(n=1)
         grow_extreme_glacier = grow_extreme[0]
-        latest_year = max(grow_extreme_glacier.mass_balances.keys())
-        growth = grow_extreme_glacier.mass_balances[latest_year]
+        growth = grow_extreme_glacier.latest_mass_balance
 
         if growth <= 0:
             raise ValueError("No glacier grew in latest measurements")
@@ -405,16 +2142,17 @@ class GlacierCollection:
         x_vals_grow = grow_extreme_glacier.mass_balances.keys()
         y_vals_grow = grow_extreme_glacier.mass_balances.values()
 
+        plt = _pyplot()
         plot, plot_axes = plt.subplots()
         plot_axes.plot(x_vals_grow, y_vals_grow, label=grow_extreme_glacier.name)
 
         # retrieve shrinking extreme data
         shrunk_extreme = self.sort_by_latest_mass_balance(n=1, reverse=True)
         shrunk_extreme_glacier = shrunk_extreme[0]
-        latest_year = max(shrunk_extreme_glacier.mass_balances.keys())
-        shrinkage = shrunk_extreme_glacier.mass_balances[latest_year]
+        shrinkage = shrunk_extreme_glacier.latest_mass_balance
 
         if shrinkage >= 0:
+            plt.close(plot)
             raise ValueError("No glacier shrunk in latest measurements")
 
         # plot shrinking extreme
@@ -430,3 +2168,253 @@ class GlacierCollection:
         plot_axes.legend()
         plot.tight_layout()
         plot.savefig(output_path)
+        plt.close(plot)
+
+    def plot_all_mass_balances(self, output_dir, workers=None, ids=None):
+        """Save a `plot_mass_balance` plot for many glaciers to `output_dir`, named <glacier ID>.png.
+
+        Plots are rendered by a pool of `workers` processes (by default one per
+        CPU). A hash of the plotted data is stored next to each plot as
+        <glacier ID>.png.sha256, and glaciers whose data is unchanged since their
+        plot was saved are skipped. `ids` selects the glaciers to plot, by
+        default every glacier with mass-balance data. Returns the IDs plotted.
+        """
+        # check parameters
+        if not (type(output_dir) == PosixPath):
+            raise TypeError("Directory plots to be saved to not specified as a Path object")
+
+        if not output_dir.is_dir():
+            raise ValueError("Directory plots to be saved to does not exist")
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        if not (type(workers) == int):
+            raise TypeError("Input number of workers is not an integer")
+
+        if workers < 1:
+            raise ValueError("Input number of workers must be positive")
+
+        if ids is None:
+            glaciers = [glacier for glacier in self.glaciers.values() if glacier.latest_year is not None]
+        else:
+            if not (type(ids) == list and all(type(gid) == str for gid in ids)):
+                raise TypeError("Glacier IDs to plot not given as a list of strings")
+
+            glaciers = []
+            for gid in ids:
+                if gid not in self.glaciers:
+                    raise KeyError(f"Glacier {gid} to plot not present in collection")
+                if self.glaciers[gid].latest_year is None:
+                    raise ValueError(f"No mass balance data recorded for glacier {gid} trying to be plotted")
+                glaciers.append(self.glaciers[gid])
+
+        # skip glaciers whose saved plot was drawn from the same data
+        tasks = []
+        plotted = []
+        for glacier in glaciers:
+            years, balances = list(glacier.mass_balances.keys()), list(glacier.mass_balances.values())
+            digest = hashlib.sha256(json.dumps([glacier.name, years, balances]).encode()).hexdigest()
+            output_path = output_dir / f'{glacier.id}.png'
+            hash_path = output_dir / f'{glacier.id}.png.sha256'
+
+            if not (output_path.is_file() and hash_path.is_file() and hash_path.read_text() == digest):
+                tasks.append((glacier.name, years, balances, str(output_path), digest))
+                plotted.append(glacier.id)
+
+        if not tasks:
+            return plotted
+
+        # a few batches per worker balances the load while each batch reuses one figure
+        batches = min(len(tasks), workers * 4)
+        batches = [tasks[k::batches] for k in range(batches)]
+
+        if workers == 1 or len(tasks) <= 1:
+            for batch in batches:
+                _render_mass_balances(batch)
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(batches))) as executor:
+                list(executor.map(_render_mass_balances, batches))
+
+        return plotted
+
+    @classmethod
+    async def aload(cls, file_path, mass_balance_file_path=None, columnar=False, bulk=False):
+        """Async version of creating a collection and reading a mass-balance file into it.
+
+        Parsing runs in the event loop's default executor, so the loop stays free
+        for other tasks while the files are read.
+        """
+        def load():
+            collection = cls(file_path, columnar=columnar)
+            if mass_balance_file_path is not None:
+                collection.read_mass_balance_data(mass_balance_file_path, bulk=bulk)
+            collection._compact()
+            return collection
+
+        return await asyncio.get_running_loop().run_in_executor(None, load)
+
+    async def _read(self, method, *args):
+        # run a query in the executor, alongside other queries but not changes
+        if self._frozen:
+            return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+        async with self._access.reading():
+            return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+    async def _write(self, method, *args):
+        # run a change in the executor once every running query or change has finished
+        def change():
+            try:
+                return method(*args)
+            finally:
+                self._compact()
+
+        async with self._access.writing():
+            return await asyncio.get_running_loop().run_in_executor(None, change)
+
+    def _compact(self):
+        # merge measurements queued in the store while changes hold the lock, as queries would
+        # otherwise merge them and concurrent queries could see the store half-merged
+        if self._store is not None:
+            self._store.compact()
+
+    async def afind_nearest(self, lat, lon, n=5):
+        """Async version of `find_nearest`."""
+        return await self._read(self.find_nearest, lat, lon, n)
+
+    async def afilter_by_code(self, code_pattern):
+        """Async version of `filter_by_code`."""
+        return await self._read(self.filter_by_code, code_pattern)
+
+    async def asort_by_latest_mass_balance(self, n=5, reverse=False):
+        """Async version of `sort_by_latest_mass_balance`."""
+        return await self._read(self.sort_by_latest_mass_balance, n, reverse)
+
+    async def aread_mass_balance_data(self, file_path, chunk_size=65536, bulk=False):
+        """Async version of `read_mass_balance_data`."""
+        return await self._write(self.read_mass_balance_data, file_path, chunk_size, bulk)
+
+    async def aadd_glacier(self, glacier):
+        """Async version of `add_glacier`."""
+        return await self._write(self.add_glacier, glacier)
+
+    async def aadd_mass_balance_measurement(self, glacier_id, year, mass_balance, partial):
+        """Add a measurement to the glacier with the given ID, as `Glacier.add_mass_balance_measurement`."""
+        def add():
+            if glacier_id not in self.glaciers:
+                raise KeyError(f"Glacier {glacier_id} trying to be populated with mass-balance data not present in collection")
+            return self.glaciers[glacier_id].add_mass_balance_measurement(year, mass_balance, partial)
+
+        return await self._write(add)
+
+
+class LiveGlacierCollection:
+    """Glacier data that is updated by swapping in a new frozen collection rather than changing it.
+
+    Queries run against `current`, a frozen `GlacierCollection`, without taking
+    any lock. `reload` reads the source files into a new collection, freezes it
+    and replaces `current` in a single assignment, so every query sees either
+    the old data or the new, never a mix. Callers needing several consistent
+    queries can keep a reference to `current` and query it directly.
+    """
+
+    def __init__(self, glacier_files, mass_balance_files=(), columnar=True, workers=None, track_rows=False):
+        self._files = (glacier_files, mass_balance_files)
+        self._columnar = columnar
+        self._workers = workers
+        self._track_rows = track_rows
+        # settings of the result cache of every snapshot, see configure_result_cache
+        self._result_cache = {}
+        # reloads build their collection one at a time, queries never wait on this
+        self._reloading = threading.Lock()
+        self.current = self._load(*self._files)
+
+    def _load(self, glacier_files, mass_balance_files):
+        collection = GlacierCollection.from_files(glacier_files, mass_balance_files, columnar=self._columnar,
+                                                  workers=self._workers, track_rows=self._track_rows)
+        collection.configure_result_cache(**self._result_cache)
+        return collection.freeze()
+
+    def reload(self, glacier_files=None, mass_balance_files=None):
+        """Read the source files again, or the given files instead, and swap the new data in.
+
+        Glob patterns are expanded again, so new regional files are picked up.
+        """
+        with self._reloading:
+            files = (self._files[0] if glacier_files is None else glacier_files,
+                     self._files[1] if mass_balance_files is None else mass_balance_files)
+            collection = self._load(*files)
+            self._files = files
+            self.current = collection
+
+        return True
+
+    async def areload(self, glacier_files=None, mass_balance_files=None):
+        """Async version of `reload`, building the new collection in the default executor."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.reload, glacier_files, mass_balance_files)
+
+    def configure_result_cache(self, maxsize=128, ttl=None, policy='lru'):
+        """Set up the result cache of the current snapshot, and of every snapshot swapped in later."""
+        self.current.configure_result_cache(maxsize, ttl, policy)
+        self._result_cache = {'maxsize': maxsize, 'ttl': ttl, 'policy': policy}
+        return True
+
+    def result_cache_stats(self):
+        return self.current.result_cache_stats()
+
+    def find_nearest(self, lat, lon, n=5):
+        return self.current.find_nearest(lat, lon, n)
+
+    def find_nearest_many(self, lats, lons, n=5, chunk_size=None):
+        return self.current.find_nearest_many(lats, lons, n, chunk_size)
+
+    def find_within_radius(self, lat, lon, radius):
+        return self.current.find_within_radius(lat, lon, radius)
+
+    def filter_by_code(self, code_pattern):
+        return self.current.filter_by_code(code_pattern)
+
+    def sort_by_latest_mass_balance(self, n=5, reverse=False):
+        return self.current.sort_by_latest_mass_balance(n, reverse)
+
+    def summary(self):
+        return self.current.summary()
+
+    def mass_balance_trends(self, years=None):
+        return self.current.mass_balance_trends(years)
+
+    def cumulative_mass_balances(self, years=None):
+        return self.current.cumulative_mass_balances(years)
+
+    def rolling_mean_mass_balances(self, window=5, years=None):
+        return self.current.rolling_mean_mass_balances(window, years)
+
+    def balances_in_year(self, year, unit=None):
+        return self.current.balances_in_year(year, unit)
+
+    def annual_regional_means(self):
+        return self.current.annual_regional_means()
+
+    def altitude_bands(self, glacier_id):
+        return self.current.altitude_bands(glacier_id)
+
+    def balances_in_band(self, year, lower, upper):
+        return self.current.balances_in_band(year, lower, upper)
+
+
+# operations timed while instrumentation is enabled, see instrumentation.py
+instrumentation.register(Glacier, ['_check_attributes', 'add_mass_balance_measurement', 'plot_mass_balance'])
+instrumentation.register(GlacierCollection, ['__init__', 'from_files', 'load_cache', 'save_cache',
+                                             'read_mass_balance_data', '_read_mass_balance_rows',
+                                             '_read_mass_balance_bulk', 'update_mass_balance_data',
+                                             'add_glacier', 'find_nearest', 'find_nearest_many', 'find_within_radius',
+                                             '_spatial_index', 'filter_by_code', 'sort_by_latest_mass_balance',
+                                             'summary', 'mass_balance_trends', 'cumulative_mass_balances',
+                                             'rolling_mean_mass_balances', 'balances_in_year', 'annual_regional_means',
+                                             'altitude_bands', 'balances_in_band', 'plot_extremes', 'plot_all_mass_balances', 'freeze'])
+instrumentation.register(LiveGlacierCollection, ['reload'])
+instrumentation.register(sys.modules[__name__], ['_check_mass_balance_chunk', 'haversine_distance_array'])
+
+if os.environ.get('GLACIERS_INSTRUMENTATION'):
+    instrumentation.enable()
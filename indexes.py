@@ -0,0 +1,116 @@
+import numpy as np
+
+
+class CodeIndex:
+    """Per-digit bitsets over glacier type codes.
+
+    For each of the three digit positions and each digit value, a packed bitset
+    marks the glaciers whose code has that digit there, so a pattern with
+    wildcards resolves by intersecting at most three bitsets. Results are
+    positions in the array of codes given to the constructor, in order.
+    """
+
+    def __init__(self, codes):
+        codes = np.asarray(codes, dtype=np.int64)
+        self.size = len(codes)
+        self._bits = [[np.packbits(digits == digit) for digit in range(10)]
+                      for digits in (codes // 100 % 10, codes // 10 % 10, codes % 10)]
+
+    def match(self, code_pattern):
+        """Return the positions of the codes matching a 3-character pattern, where '?' matches any digit."""
+        bits = None
+        for position, digit in enumerate(code_pattern):
+            if digit != '?':
+                digit_bits = self._bits[position][int(digit)]
+                bits = digit_bits if bits is None else bits & digit_bits
+
+        if bits is None:
+            return np.arange(self.size)
+
+        return np.flatnonzero(np.unpackbits(bits, count=self.size))
+
+
+class YearIndex:
+    """Measurements grouped by year, then by political unit.
+
+    The measurement table is sorted once by (year, unit, glacier position), so
+    the measurements of one year, or of one unit in one year, are a contiguous
+    run found by binary search. Queries therefore cost O(log n + results).
+    """
+
+    def __init__(self, positions, years, balances, units):
+        # positions, years and balances have one element per measurement; units one per glacier position
+        self.units, glacier_units = np.unique(np.asarray(units, dtype=str), return_inverse=True)
+        measurement_units = glacier_units.reshape(-1)[positions]
+
+        order = np.lexsort((positions, measurement_units, years))
+        self.positions = positions[order]
+        self.balances = balances[order]
+        self._keys = np.asarray(years, dtype=np.int64)[order] * max(len(self.units), 1) + measurement_units[order]
+
+        # one group per (year, unit) with measurements, for the regional means
+        starts = np.flatnonzero(np.r_[True, self._keys[1:] != self._keys[:-1]]) if len(self._keys) else self._keys
+        self._group_keys = self._keys[starts]
+        self._group_counts = np.diff(np.r_[starts, len(self._keys)])
+        self._group_sums = np.add.reduceat(self.balances, starts) if len(starts) else self.balances
+
+    def _key(self, year, unit):
+        return year * max(len(self.units), 1) + unit
+
+    def year(self, year, unit=None):
+        """Return (positions, balances) of the measurements of one year, of all units or just one."""
+        if unit is None:
+            first, last = self._key(year, 0), self._key(year + 1, 0)
+        else:
+            code = np.searchsorted(self.units, unit)
+            if code == len(self.units) or self.units[code] != unit:
+                return self.positions[:0], self.balances[:0]
+            first, last = self._key(year, code), self._key(year, code + 1)
+
+        start, end = np.searchsorted(self._keys, [first, last])
+        return self.positions[start:end], self.balances[start:end]
+
+    def regional_means(self):
+        """Return (years, units, counts, means) of the measurements of each unit in each year, sorted by year then unit."""
+        size = max(len(self.units), 1)
+        return (self._group_keys // size, self.units[self._group_keys % size], self._group_counts,
+                self._group_sums / self._group_counts)
+
+
+class BandIndex:
+    """Altitude-band (partial) measurements, as sorted intervals per glacier-year.
+
+    Bands are kept sorted by (glacier position, year, lower bound, upper bound),
+    so the bands of one glacier are a contiguous run, and ordered a second time
+    by (year, glacier position) so the bands of one year are too. Both are found
+    by binary search.
+    """
+
+    def __init__(self, positions, years, lowers, uppers, balances):
+        # one element per band, its glacier position, year, altitude bounds in metres and balance
+        order = np.lexsort((uppers, lowers, years, positions))
+        self.positions = np.asarray(positions, dtype=np.int64)[order]
+        self.years = np.asarray(years, dtype=np.int64)[order]
+        self.lowers = np.asarray(lowers, dtype=np.int64)[order]
+        self.uppers = np.asarray(uppers, dtype=np.int64)[order]
+        self.balances = np.asarray(balances, dtype=np.float64)[order]
+
+        # a stable sort by year keeps positions in order within each year
+        self._year_order = np.argsort(self.years, kind='stable')
+        self._sorted_years = self.years[self._year_order]
+
+    def glacier(self, position):
+        """Return (years, lowers, uppers, balances) of the bands of the glacier at a position."""
+        start, end = np.searchsorted(self.positions, [position, position + 1])
+        return self.years[start:end], self.lowers[start:end], self.uppers[start:end], self.balances[start:end]
+
+    def within(self, year, lower, upper):
+        """Return (positions, balances, counts) summing, per glacier, its bands of a year lying within lower-upper."""
+        start, end = np.searchsorted(self._sorted_years, [year, year + 1])
+        bands = self._year_order[start:end]
+        bands = bands[(self.lowers[bands] >= lower) & (self.uppers[bands] <= upper)]
+
+        positions = self.positions[bands]
+        starts = np.flatnonzero(np.r_[True, positions[1:] != positions[:-1]]) if len(bands) else bands
+        sums = np.add.reduceat(self.balances[bands], starts) if len(bands) else self.balances[bands]
+        return positions[starts], sums, np.diff(np.r_[starts, len(bands)])
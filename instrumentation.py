@@ -0,0 +1,207 @@
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+# latencies kept per operation for the percentiles
+LATENCY_SAMPLES = 10000
+
+_registry = []  # (owner, attribute name, operation name) of everything that can be instrumented
+_originals = {}  # (owner, attribute name): the uninstrumented attribute, while enabled
+_records = {}
+_lock = threading.Lock()
+_local = threading.local()
+_enabled = False
+
+
+class _Record:
+    # running totals for one operation
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+
+def register(owner, names, prefix=None):
+    """Make attributes of a class or module instrumentable, under the operation names <prefix>.<name>.
+
+    Nothing changes until `enable` is called, so registered functions cost
+    nothing extra while instrumentation is off.
+    """
+    prefix = owner.__name__ if prefix is None else prefix
+    for name in names:
+        _registry.append((owner, name, f'{prefix}.{name}'))
+
+
+def enable():
+    """Start recording calls of every registered function."""
+    global _enabled
+    with _lock:
+        for owner, name, operation in _registry:
+            if (owner, name) not in _originals:
+                original = owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)
+                _originals[(owner, name)] = original
+                setattr(owner, name, _wrap(original, operation))
+        _enabled = True
+
+
+def disable():
+    """Stop recording and restore the original functions. Recorded stats are kept."""
+    global _enabled
+    with _lock:
+        for (owner, name), original in _originals.items():
+            setattr(owner, name, original)
+        _originals.clear()
+        _enabled = False
+
+
+def reset():
+    """Forget all recorded stats."""
+    with _lock:
+        _records.clear()
+
+
+def is_enabled():
+    return _enabled
+
+
+def _wrap(function, operation):
+    # staticmethod and classmethod objects are unwrapped, timed, then rewrapped
+    if isinstance(function, (staticmethod, classmethod)):
+        return type(function)(_wrap(function.__func__, operation))
+
+    @wraps(function)
+    def timed(*args, **kwargs):
+        stack = _local.__dict__.setdefault('stack', [])
+        stack.append(0)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _record(operation, time.perf_counter() - start, stack.pop())
+
+    return timed
+
+
+def _record(operation, seconds, rows):
+    with _lock:
+        record = _records.setdefault(operation, _Record())
+        record.calls += 1
+        record.seconds += seconds
+        record.rows += rows
+        record.latencies.append(seconds)
+
+
+def add_rows(count):
+    """Count rows processed by the innermost instrumented call running in this thread."""
+    if _enabled:
+        stack = _local.__dict__.get('stack')
+        if stack:
+            stack[-1] += count
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def stats():
+    """Return {operation: stats} for every operation called while instrumentation was enabled.
+
+    Each entry has the number of calls, total seconds, mean, 50th/90th/99th
+    percentile and maximum latency in seconds (over the last LATENCY_SAMPLES
+    calls), rows processed and rows processed per second.
+    """
+    with _lock:
+        records = {operation: (record.calls, record.seconds, record.rows, list(record.latencies))
+                   for operation, record in _records.items()}
+
+    return {operation: {'calls': calls,
+                        'seconds': seconds,
+                        'mean': seconds / calls,
+                        'p50': _percentile(latencies, 0.5),
+                        'p90': _percentile(latencies, 0.9),
+                        'p99': _percentile(latencies, 0.99),
+                        'max': max(latencies),
+                        'rows': rows,
+                        'rows_per_second': rows / seconds if seconds > 0 else 0.0}
+            for operation, (calls, seconds, rows, latencies) in sorted(records.items())}
+
+
+def to_json(operation_stats=None):
+    """Return stats (by default the current `stats()`) as a JSON string."""
+    return json.dumps(stats() if operation_stats is None else operation_stats, indent=2)
+
+
+def to_prometheus(operation_stats=None, namespace='glaciers'):
+    """Return stats (by default the current `stats()`) in the Prometheus text exposition format."""
+    operation_stats = stats() if operation_stats is None else operation_stats
+    lines = [f'# HELP {namespace}_operation_seconds Latency of glacier operations.',
+             f'# TYPE {namespace}_operation_seconds summary']
+    for operation, entry in operation_stats.items():
+        for quantile, key in (('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99')):
+            lines.append(f'{namespace}_operation_seconds{{operation="{operation}",quantile="{quantile}"}} {entry[key]!r}')
+        lines.append(f'{namespace}_operation_seconds_sum{{operation="{operation}"}} {entry["seconds"]!r}')
+        lines.append(f'{namespace}_operation_seconds_count{{operation="{operation}"}} {entry["calls"]}')
+
+    lines += [f'# HELP {namespace}_operation_rows_total Rows processed by glacier operations.',
+              f'# TYPE {namespace}_operation_rows_total counter']
+    for operation, entry in operation_stats.items():
+        lines.append(f'{namespace}_operation_rows_total{{operation="{operation}"}} {entry["rows"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class Profile:
+    """Results of a `profile` block: `stats` from cProfile, and memory use from tracemalloc."""
+
+    def __init__(self):
+        self.stats = None
+        self.peak_memory = None
+        self.memory_top = None
+
+    def report(self, limit=20):
+        """Return the slowest functions by cumulative time and the lines allocating most memory, as text."""
+        text = io.StringIO()
+        if self.stats is not None:
+            self.stats.stream = text
+            self.stats.sort_stats('cumulative').print_stats(limit)
+        if self.memory_top is not None:
+            text.write(f'Peak traced memory: {self.peak_memory} bytes\n')
+            for statistic in self.memory_top[:limit]:
+                text.write(f'{statistic}\n')
+        return text.getvalue()
+
+
+@contextmanager
+def profile(cpu=True, memory=True):
+    """Profile a block with cProfile and/or tracemalloc, yielding a `Profile` filled in when the block ends."""
+    result = Profile()
+    profiler = cProfile.Profile() if cpu else None
+    started_tracing = memory and not tracemalloc.is_tracing()
+
+    if started_tracing:
+        tracemalloc.start()
+    if memory:
+        tracemalloc.reset_peak()
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield result
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            result.stats = pstats.Stats(profiler)
+        if memory:
+            result.peak_memory = tracemalloc.get_traced_memory()[1]
+            result.memory_top = tracemalloc.take_snapshot().statistics('lineno')
+        if started_tracing:
+            tracemalloc.stop()
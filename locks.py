@@ -0,0 +1,62 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class ReadWriteLock:
+    """asyncio lock held by any number of readers or by a single writer.
+
+    Waiting writers are served before new readers, so a steady stream of
+    queries cannot hold off an update indefinitely.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._condition = None
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    def __getstate__(self):
+        # the asyncio primitives belong to the running loop, so a copy binds to its own
+        state = self.__dict__.copy()
+        state['_loop'] = state['_condition'] = None
+        return state
+
+    def _bind(self):
+        # asyncio primitives belong to one event loop, so an idle lock starts afresh in a new one
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reading(self):
+        self._bind()
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writing and self._waiting_writers == 0)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def writing(self):
+        self._bind()
+        async with self._condition:
+            self._waiting_writers += 1
+            try:
+                await self._condition.wait_for(lambda: not self._writing and self._readers == 0)
+            finally:
+                self._waiting_writers -= 1
+                # readers held back by this writer may go ahead if it was cancelled
+                self._condition.notify_all()
+            self._writing = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writing = False
+                self._condition.notify_all()
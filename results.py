@@ -0,0 +1,105 @@
+"""A bounded cache of query results, dropped whenever the data they were computed from changes."""
+import threading
+import time
+from collections import OrderedDict
+
+# ways of choosing the result to evict when the cache is full
+POLICIES = ('lru', 'fifo')
+
+
+class ResultCache:
+    """Query results keyed by method and arguments, holding at most `maxsize` of them.
+
+    When the cache is full, the 'lru' policy evicts the least recently used
+    result and 'fifo' the oldest one. Results older than `ttl` seconds, if
+    given, are computed again. Every lookup passes the current version of the
+    data, and all results are dropped as soon as it differs from the version
+    they were computed from.
+    """
+
+    def __init__(self, maxsize=128, ttl=None, policy='lru'):
+        # check parameters
+        if not (type(maxsize) == int):
+            raise TypeError("Result cache size 'maxsize' must be an integer")
+
+        if maxsize < 0:
+            raise ValueError("Result cache size 'maxsize' must be non-negative")
+
+        if not (ttl is None or type(ttl) == int or type(ttl) == float):
+            raise TypeError("Result lifetime 'ttl' must be a number of seconds or None")
+
+        if ttl is not None and not ttl > 0:
+            raise ValueError("Result lifetime 'ttl' must be positive")
+
+        if policy not in POLICIES:
+            raise ValueError(f"Eviction policy must be one of {', '.join(POLICIES)}")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.policy = policy
+        self._results = OrderedDict()  # key: (expiry time or None, result)
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __getstate__(self):
+        # locks cannot be pickled, so a copy gets a lock of its own
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get(self, key, version, compute):
+        """Return the result for `key` computed from data at `version`, calling `compute()` on a miss."""
+        with self._lock:
+            if version != self._version:
+                if self._results:
+                    self.invalidations += 1
+                    self._results.clear()
+                self._version = version
+
+            entry = self._results.get(key)
+            if entry is not None:
+                expiry, result = entry
+                if expiry is None or time.monotonic() < expiry:
+                    self.hits += 1
+                    if self.policy == 'lru':
+                        self._results.move_to_end(key)
+                    return result
+
+                del self._results[key]
+                self.expirations += 1
+
+            self.misses += 1
+
+        # computed outside the lock, so a slow query does not hold up hits on other keys
+        result = compute()
+
+        with self._lock:
+            if self.maxsize > 0 and version == self._version:
+                self._results[key] = (None if self.ttl is None else time.monotonic() + self.ttl, result)
+                self._results.move_to_end(key)
+                while len(self._results) > self.maxsize:
+                    self._results.popitem(last=False)
+                    self.evictions += 1
+
+        return result
+
+    def clear(self):
+        """Drop every result, keeping the counters."""
+        with self._lock:
+            self._results.clear()
+
+    def stats(self):
+        """Return the settings, number of results held and hit/miss/eviction counters as a dict."""
+        with self._lock:
+            return {'maxsize': self.maxsize, 'ttl': self.ttl, 'policy': self.policy, 'size': len(self._results),
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'invalidations': self.invalidations}
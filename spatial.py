@@ -0,0 +1,197 @@
+import heapq
+import numpy as np
+from math import pi, sin
+from utils import EARTH_RADIUS
+
+
+# above this many points a tree search per query beats scanning every point
+SCAN_LIMIT = 4096
+
+
+def unit_vectors(lats, lons):
+    """Convert arrays of latitudes and longitudes in degrees to 3D unit vectors."""
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    return np.column_stack((np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)))
+
+
+def km_to_chord(distance):
+    """Straight-line chord on the unit sphere corresponding to a great-circle distance in km."""
+    return 2 * sin(min(distance / EARTH_RADIUS, pi) / 2)
+
+
+class SphericalIndex:
+    """KD-tree over points on the Earth's surface.
+
+    Points are stored as 3D unit vectors, so the straight-line (chord) distance
+    between two of them increases with their great-circle distance and ordinary
+    bounding-box pruning gives exact nearest-neighbour and radius searches.
+    Results are positions in the latitude/longitude arrays given to the constructor.
+    """
+
+    def __init__(self, lats, lons, leaf_size=32):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        points = unit_vectors(self.lats, self.lons)
+        self._index = np.arange(len(points))
+        self._lower = []
+        self._upper = []
+        self._ranges = []
+        self._children = []
+
+        if len(points) > 0:
+            self._build(points, 0, len(points), leaf_size)
+
+        # leaf points are kept contiguous so each leaf is a single slice
+        self._points = points[self._index]
+
+    def __len__(self):
+        return len(self._index)
+
+    def _build(self, points, start, end, leaf_size):
+        block = points[self._index[start:end]]
+        lower, upper = block.min(axis=0), block.max(axis=0)
+        node = len(self._ranges)
+        self._lower.append(tuple(lower.tolist()))
+        self._upper.append(tuple(upper.tolist()))
+        self._ranges.append((start, end))
+        self._children.append(None)
+
+        if end - start > leaf_size:
+            # split on the median of the widest dimension
+            dim = int(np.argmax(upper - lower))
+            mid = (start + end) // 2
+            order = np.argpartition(block[:, dim], mid - start)
+            self._index[start:end] = self._index[start:end][order]
+            left = self._build(points, start, mid, leaf_size)
+            right = self._build(points, mid, end, leaf_size)
+            self._children[node] = (left, right)
+
+        return node
+
+    def _box_distance(self, node, point):
+        # squared distance from the point to the node's bounding box
+        total = 0.0
+        for p, lo, hi in zip(point, self._lower[node], self._upper[node]):
+            if p < lo:
+                total += (lo - p) ** 2
+            elif p > hi:
+                total += (p - hi) ** 2
+        return total
+
+    def nearest(self, lat, lon, n):
+        """Return (positions, chord distances) of the n points closest to a location, nearest first.
+
+        Ties are broken by position, so the result only depends on the input arrays.
+        """
+        point = tuple(unit_vectors([lat], [lon])[0].tolist())
+        target = np.array(point)
+        n = min(n, len(self))
+        best = []  # max-heap of (-squared distance, -position)
+
+        if n > 0:
+            queue = [(0.0, 0)]
+            while queue:
+                box_distance, node = heapq.heappop(queue)
+                if len(best) == n and box_distance > -best[0][0]:
+                    break
+
+                if self._children[node] is not None:
+                    for child in self._children[node]:
+                        heapq.heappush(queue, (self._box_distance(child, point), child))
+                    continue
+
+                start, end = self._ranges[node]
+                distances = ((self._points[start:end] - target) ** 2).sum(axis=1)
+                if len(best) == n:
+                    close = np.flatnonzero(distances <= -best[0][0])
+                else:
+                    close = range(end - start)
+
+                for i in close:
+                    entry = (-float(distances[i]), -int(self._index[start + i]))
+                    if len(best) < n:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+
+        best.sort(reverse=True)
+        positions = np.array([-position for _, position in best], dtype=np.int64)
+        chords = np.sqrt(np.array([-distance for distance, _ in best], dtype=np.float64))
+        return positions, chords
+
+    def nearest_many(self, lats, lons, n, chunk_size=None):
+        """Return (positions, chord distances) arrays of shape (M, n) for M query points.
+
+        Small indexes are searched by comparing each chunk of `chunk_size` queries
+        against every point in one vectorized pass, which bounds memory at
+        chunk_size x len(self) distances (by default about 4 million). Larger
+        indexes walk the tree once per query, which is cheaper than a full scan.
+        Rows are ordered nearest first, with ties broken by position as in `nearest`.
+        """
+        queries = unit_vectors(lats, lons)
+        n = min(n, len(self))
+        positions = np.empty((len(queries), n), dtype=np.int64)
+        chords = np.empty((len(queries), n), dtype=np.float64)
+
+        if chunk_size is None:
+            chunk_size = max(1, 2 ** 22 // max(len(self), 1))
+
+        if n == 0:
+            return positions, chords
+
+        if len(self) > SCAN_LIMIT:
+            for i, (lat, lon) in enumerate(zip(np.asarray(lats).tolist(), np.asarray(lons).tolist())):
+                positions[i], chords[i] = self.nearest(lat, lon, n)
+            return positions, chords
+
+        for start in range(0, len(queries), chunk_size):
+            block = queries[start:start + chunk_size]
+            distances = np.zeros((len(block), len(self)), dtype=np.float64)
+            for dim in range(3):
+                distances += (block[:, dim, None] - self._points[None, :, dim]) ** 2
+
+            # cheap unordered selection of the n closest, then repair rows with ties at the cut
+            if n < len(self):
+                chosen = np.argpartition(distances, n - 1, axis=1)[:, :n]
+            else:
+                chosen = np.broadcast_to(np.arange(len(self)), distances.shape).copy()
+            chosen_distances = np.take_along_axis(distances, chosen, axis=1)
+            cut = chosen_distances.max(axis=1)
+            ties = (distances == cut[:, None]).sum(axis=1) > (chosen_distances == cut[:, None]).sum(axis=1)
+
+            for row in np.flatnonzero(ties):
+                candidates = np.flatnonzero(distances[row] <= cut[row])
+                order = np.lexsort((self._index[candidates], distances[row, candidates]))[:n]
+                chosen[row] = candidates[order]
+                chosen_distances[row] = distances[row, chosen[row]]
+
+            original = self._index[chosen]
+            order = np.lexsort((original, chosen_distances), axis=1)
+            positions[start:start + len(block)] = np.take_along_axis(original, order, axis=1)
+            chords[start:start + len(block)] = np.sqrt(np.take_along_axis(chosen_distances, order, axis=1))
+
+        return positions, chords
+
+    def within(self, lat, lon, chord):
+        """Return the positions of all points within a chord distance of a location (unordered)."""
+        point = tuple(unit_vectors([lat], [lon])[0].tolist())
+        target = np.array(point)
+        limit = chord ** 2
+        found = []
+
+        stack = [0] if len(self) > 0 else []
+        while stack:
+            node = stack.pop()
+            if self._box_distance(node, point) > limit:
+                continue
+
+            if self._children[node] is not None:
+                stack.extend(self._children[node])
+                continue
+
+            start, end = self._ranges[node]
+            distances = ((self._points[start:end] - target) ** 2).sum(axis=1)
+            found.append(self._index[start:end][distances <= limit])
+
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
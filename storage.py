@@ -0,0 +1,537 @@
+import os
+import numpy as np
+
+# arrays written by GlacierStore.save, one .npy file each
+STORED_ARRAYS = ('ids', 'names', 'units', 'lats', 'lons', 'codes', 'offsets', 'years', 'balances', 'id_order')
+
+# measurements an out-of-core store holds in memory at once, see GlacierStore.keep_on_disk
+OUT_OF_CORE_ROWS = 1 << 20
+
+# layout of the measurements an out-of-core store has spilled to disk before merging them into its table
+SPILLED = np.dtype([('row', '<i8'), ('year', '<i2'), ('balance', '<f8'), ('partial', '?')])
+
+
+def encode_columns(ids, names, units, lats, lons, codes):
+    """Convert sequences of glacier attributes into the column arrays of a GlacierStore."""
+    return (np.array([gid.encode() for gid in ids], dtype='S5'),
+            np.array([name.encode() for name in names], dtype=bytes),
+            np.array([unit.encode() for unit in units], dtype='S2'),
+            np.array(lats, dtype=np.float64),
+            np.array(lons, dtype=np.float64),
+            np.array(codes, dtype=np.int16))
+
+
+def fold_measurements(rows, years, balances, partial):
+    """Combine the measurements of each row and year, in the order they were taken.
+
+    Follows the rules of `Glacier.add_mass_balance_measurement`: the first
+    measurement of a glacier-year sets its value, later partial measurements
+    are added to it and later full measurements are ignored. Returns
+    (rows, years, values, partial_sums) with one entry per glacier-year, sorted
+    by row then year, where `values` is what a glacier-year with no earlier
+    measurement ends up with and `partial_sums` is what an existing one gains.
+    """
+    # lexsort is stable, so measurements of a glacier-year keep their order
+    order = np.lexsort((years, rows))
+    rows, years, balances, partial = rows[order], years[order], balances[order], partial[order]
+
+    starts = np.ones(len(rows), dtype=bool)
+    starts[1:] = (rows[1:] != rows[:-1]) | (years[1:] != years[:-1])
+    start_index = np.flatnonzero(starts)
+
+    if len(start_index) == 0:
+        return rows, years, balances, balances
+
+    values = np.add.reduceat(np.where(starts | partial, balances, 0.0), start_index)
+    partial_sums = np.add.reduceat(np.where(partial, balances, 0.0), start_index)
+    return rows[start_index], years[start_index], values, partial_sums
+
+
+class GlacierStore:
+    """Columnar storage for the glaciers of a collection.
+
+    Glacier attributes are held in contiguous arrays (one element per glacier)
+    and mass-balance measurements in a CSR-style table: the measurements of the
+    glacier in row i are years[offsets[i]:offsets[i + 1]] and the matching
+    slice of balances, sorted by year. After `keep_on_disk`, the year and
+    balance arrays are memory-mapped files and only the offsets stay in memory.
+    """
+
+    def __init__(self, ids, names, units, lats, lons, codes, id_order=None):
+        # columns are arrays as returned by encode_columns
+        self.ids = ids
+        self.names = names
+        self.units = units
+        self.lats = lats
+        self.lons = lons
+        self.codes = codes
+
+        # sorted view of the ids so rows can be found without a per-glacier dict
+        self.id_order = np.argsort(self.ids, kind='stable') if id_order is None else id_order
+        self._sorted_ids = self.ids[self.id_order]
+
+        self.offsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        self.years = np.empty(0, dtype=np.int16)
+        self.balances = np.empty(0, dtype=np.float64)
+
+        # measurements added since the table was last rebuilt, as lists and then array blocks
+        self._pending_rows = []
+        self._pending_years = []
+        self._pending_balances = []
+        self._pending_partial = []
+        self._pending_blocks = []
+
+        self._pending_count = 0
+
+        # set by keep_on_disk: the directory of the table files, and the measurements spilled there per row
+        self.directory = None
+        self._spilled_counts = None
+
+        # incremented whenever glaciers or measurements are added, so derived results can be cached
+        self.version = 0
+        # set when the store is shared by readers that expect it never to change
+        self.read_only = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, glacier_id):
+        """Return the row of the glacier with the given ID, or -1 if it is not stored."""
+        if type(glacier_id) != str:
+            return -1
+
+        key = glacier_id.encode()
+        i = np.searchsorted(self._sorted_ids, key)
+        if i < len(self._sorted_ids) and self._sorted_ids[i] == key:
+            return int(self.id_order[i])
+        return -1
+
+    def append(self, glacier_id, name, unit, lat, lon, code):
+        """Add a glacier as a new row and return the row.
+
+        Every column is copied, so building the store in one go is much faster.
+        """
+        self._check_writable()
+        self.compact()
+        self.version += 1
+        row = encode_columns([glacier_id], [name], [unit], [lat], [lon], [code])
+        self.ids, self.names, self.units, self.lats, self.lons, self.codes = \
+            [np.concatenate((column, value)) for column, value in
+             zip((self.ids, self.names, self.units, self.lats, self.lons, self.codes), row)]
+        self.offsets = np.append(self.offsets, self.offsets[-1])
+
+        self.id_order = np.argsort(self.ids, kind='stable')
+        self._sorted_ids = self.ids[self.id_order]
+        if self.directory is not None:
+            self._spilled_counts = np.zeros(len(self.ids), dtype=np.int64)
+
+        return len(self.ids) - 1
+
+    def rows(self, glacier_ids):
+        """Vectorized `row`: return the rows of a sequence of IDs (-1 where unknown)."""
+        keys = np.asarray(glacier_ids)
+        if keys.dtype.kind != 'S':
+            keys = np.char.encode(keys.astype(str))
+        if len(self._sorted_ids) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+
+        i = np.minimum(np.searchsorted(self._sorted_ids, keys), len(self._sorted_ids) - 1)
+        return np.where(self._sorted_ids[i] == keys, self.id_order[i], -1)
+
+    def add_measurements(self, rows, years, mass_balances, partial):
+        """Queue a block of already validated measurements given as arrays."""
+        self._check_writable()
+        self.flush()
+        self.version += 1
+        self._pending_blocks.append((np.asarray(rows, dtype=np.int64),
+                                     np.asarray(years, dtype=np.int16),
+                                     np.asarray(mass_balances, dtype=np.float64),
+                                     np.asarray(partial, dtype=bool)))
+        self._pending_count += len(rows)
+        self._spill_if_full()
+
+    def add_measurement(self, row, year, mass_balance, partial):
+        self._check_writable()
+        self.version += 1
+        self._pending_rows.append(row)
+        self._pending_years.append(year)
+        self._pending_balances.append(mass_balance)
+        self._pending_partial.append(partial)
+        self._spill_if_full()
+
+    def _check_writable(self):
+        if self.read_only:
+            raise TypeError("Glacier store is read-only, so glaciers and measurements cannot be added")
+
+    def flush(self):
+        """Move measurements queued in Python lists into a compact array block."""
+        if not self._pending_rows:
+            return
+
+        self._pending_blocks.append((np.array(self._pending_rows, dtype=np.int64),
+                                     np.array(self._pending_years, dtype=np.int16),
+                                     np.array(self._pending_balances, dtype=np.float64),
+                                     np.array(self._pending_partial, dtype=bool)))
+        self._pending_count += len(self._pending_rows)
+        self._pending_rows = []
+        self._pending_years = []
+        self._pending_balances = []
+        self._pending_partial = []
+
+    def compact(self):
+        """Merge pending measurements into the year/balance table (see `fold_measurements`)."""
+        if self.directory is not None:
+            self._compact_on_disk()
+            return
+
+        self.flush()
+        if not self._pending_blocks:
+            return
+
+        counts = np.diff(self.offsets)
+        pending_rows, pending_years, pending_balances, pending_partial = zip(*self._pending_blocks)
+        self._pending_blocks = []
+        self._pending_count = 0
+
+        rows = np.concatenate([np.repeat(np.arange(len(counts)), counts), *pending_rows])
+        years = np.concatenate([self.years, *pending_years])
+        balances = np.concatenate([self.balances, *pending_balances])
+        partial = np.concatenate([np.zeros(len(self.years), dtype=bool), *pending_partial])
+
+        rows, self.years, self.balances, _ = fold_measurements(rows, years, balances, partial)
+        self.offsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.ids)), out=self.offsets[1:])
+
+    def keep_on_disk(self, directory):
+        """Move the year/balance table into memory-mapped files in `directory`, and keep it there.
+
+        Measurements added afterwards are spilled to a file in the directory every
+        OUT_OF_CORE_ROWS rows, and `compact` merges them into the table a bounded
+        number of rows at a time, so memory use does not grow with the number of
+        measurements. The directory should not be shared with another store.
+        """
+        self.compact()
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in ('years', 'balances'):
+            with open(directory / f'{name}.bin.tmp', 'wb') as file:
+                getattr(self, name).tofile(file)
+            os.replace(directory / f'{name}.bin.tmp', directory / f'{name}.bin')
+
+        self.directory = directory
+        self._spilled_counts = np.zeros(len(self.ids), dtype=np.int64)
+        (directory / 'spilled.bin').unlink(missing_ok=True)
+        self._map_table()
+
+    def _map_table(self):
+        # memory-map the table files, which np.memmap cannot do while they are empty
+        size = int(self.offsets[-1])
+        self.years = np.memmap(self.directory / 'years.bin', dtype=np.int16, mode='r', shape=(size,)) \
+            if size > 0 else np.empty(0, dtype=np.int16)
+        self.balances = np.memmap(self.directory / 'balances.bin', dtype=np.float64, mode='r', shape=(size,)) \
+            if size > 0 else np.empty(0, dtype=np.float64)
+
+    def _spill_if_full(self):
+        if self.directory is not None and self._pending_count + len(self._pending_rows) >= OUT_OF_CORE_ROWS:
+            self._spill()
+
+    def _spill(self):
+        # append the queued measurements of an out-of-core store to its spill file
+        self.flush()
+        if not self._pending_blocks:
+            return
+
+        with open(self.directory / 'spilled.bin', 'ab') as file:
+            for rows, years, balances, partial in self._pending_blocks:
+                records = np.empty(len(rows), dtype=SPILLED)
+                records['row'], records['year'], records['balance'], records['partial'] = rows, years, balances, partial
+                records.tofile(file)
+                self._spilled_counts += np.bincount(rows, minlength=len(self.ids))
+
+        self._pending_blocks = []
+        self._pending_count = 0
+
+    def _compact_on_disk(self):
+        # merge the spilled measurements into the table files, one bucket of consecutive rows at a time
+        self._spill()
+        spilled = int(self._spilled_counts.sum())
+        if spilled == 0:
+            return
+
+        # buckets of rows holding about OUT_OF_CORE_ROWS old and new measurements each
+        counts = np.diff(self.offsets)
+        totals = np.cumsum(counts + self._spilled_counts)
+        starts = np.searchsorted(totals, np.arange(OUT_OF_CORE_ROWS, totals[-1], OUT_OF_CORE_ROWS), side='right')
+        starts = np.unique(np.concatenate(([0], starts[starts < len(self.ids)])))
+        ends = np.append(starts[1:], len(self.ids))
+        spill_path = self.directory / 'spilled.bin'
+        bucket_paths = [spill_path] if len(starts) == 1 else \
+            [self.directory / f'bucket-{k}.bin' for k in range(len(starts))]
+
+        # with several buckets, first share the spilled measurements out between them, keeping their order
+        if len(starts) > 1:
+            for first in range(0, spilled, OUT_OF_CORE_ROWS):
+                records = np.fromfile(spill_path, dtype=SPILLED, count=min(OUT_OF_CORE_ROWS, spilled - first),
+                                      offset=first * SPILLED.itemsize)
+                buckets = np.searchsorted(starts, records['row'], side='right') - 1
+                order = np.argsort(buckets, kind='stable')
+                records, bounds = records[order], np.searchsorted(buckets[order], np.arange(len(starts) + 1))
+                for k in np.flatnonzero(np.diff(bounds)):
+                    with open(bucket_paths[k], 'ab') as file:
+                        records[bounds[k]:bounds[k + 1]].tofile(file)
+
+        # then fold each bucket into its rows of the table, old measurements first, and write it out
+        new_counts = np.zeros(len(self.ids), dtype=np.int64)
+        with open(self.directory / 'years.bin.tmp', 'wb') as years_file, \
+                open(self.directory / 'balances.bin.tmp', 'wb') as balances_file:
+            for start, end, path in zip(starts, ends, bucket_paths):
+                records = np.fromfile(path, dtype=SPILLED) if path.is_file() else np.empty(0, dtype=SPILLED)
+                first, last = self.offsets[start], self.offsets[end]
+                rows, years, balances, _ = fold_measurements(
+                    np.concatenate([np.repeat(np.arange(start, end), counts[start:end]), records['row']]),
+                    np.concatenate([self.years[first:last], records['year']]),
+                    np.concatenate([self.balances[first:last], records['balance']]),
+                    np.concatenate([np.zeros(last - first, dtype=bool), records['partial']]))
+                years.tofile(years_file)
+                balances.tofile(balances_file)
+                new_counts[start:end] = np.bincount(rows - start, minlength=end - start)
+
+        for name in ('years', 'balances'):
+            os.replace(self.directory / f'{name}.bin.tmp', self.directory / f'{name}.bin')
+        for path in bucket_paths + [spill_path]:
+            path.unlink(missing_ok=True)
+
+        self.offsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum(new_counts, out=self.offsets[1:])
+        self._spilled_counts = np.zeros(len(self.ids), dtype=np.int64)
+        self._map_table()
+
+    def save(self, directory):
+        """Write the store's arrays to .npy files in `directory`.
+
+        Each file is written under a temporary name and then renamed over the old
+        one, so processes that have the previous files memory-mapped are unaffected.
+        """
+        self.compact()
+        for name in STORED_ARRAYS:
+            temporary = directory / f'{name}.npy.tmp'
+            with open(temporary, 'wb') as file:
+                np.save(file, getattr(self, name))
+            os.replace(temporary, directory / f'{name}.npy')
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Read a store written by `save`, memory-mapping its arrays unless `mmap` is False."""
+        arrays = {name: np.load(directory / f'{name}.npy', mmap_mode='r' if mmap else None) for name in STORED_ARRAYS}
+        store = cls(arrays['ids'], arrays['names'], arrays['units'], arrays['lats'], arrays['lons'], arrays['codes'],
+                    id_order=arrays['id_order'])
+        store.offsets = arrays['offsets']
+        store.years = arrays['years']
+        store.balances = arrays['balances']
+        return store
+
+    def mass_balances(self, row):
+        """Return the measurements of one glacier as a {year: balance} dict."""
+        self.compact()
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return dict(zip(self.years[start:end].tolist(), self.balances[start:end].tolist()))
+
+    def table_chunks(self):
+        """Yield (rows, years, balances) of the measurements of runs of consecutive glaciers.
+
+        Each run holds about OUT_OF_CORE_ROWS measurements, never splitting a
+        glacier, so the whole table can be scanned without loading it at once.
+        """
+        self.compact()
+        total = int(self.offsets[-1])
+        bounds = np.r_[0, np.searchsorted(self.offsets, np.arange(OUT_OF_CORE_ROWS, total, OUT_OF_CORE_ROWS)),
+                       len(self.ids)]
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            start, end = self.offsets[first], self.offsets[last]
+            yield (np.repeat(np.arange(first, last), np.diff(self.offsets[first:last + 1])),
+                   np.asarray(self.years[start:end], dtype=np.int64), np.asarray(self.balances[start:end]))
+
+    def span(self, row):
+        """Return (earliest year, latest year, latest balance) of one glacier, all None if it has no measurements."""
+        self.compact()
+        start, end = self.offsets[row], self.offsets[row + 1]
+        if start == end:
+            return None, None, None
+        return int(self.years[start]), int(self.years[end - 1]), float(self.balances[end - 1])
+
+    def earliest_year(self):
+        """Return the year of the earliest measurement of any glacier, or None if there are none."""
+        self.compact()
+        return int(self.years.min()) if len(self.years) > 0 else None
+
+    def latest(self):
+        """Return (rows, years, balances) of the latest measurement of every measured glacier."""
+        self.compact()
+        counts = np.diff(self.offsets)
+        rows = np.flatnonzero(counts)
+        last = self.offsets[rows + 1] - 1
+        return rows, self.years[last], self.balances[last]
+
+
+# fields of a ledger key, big-endian so keys sort by glacier ID, year and then bounds
+LEDGER_KEY = np.dtype([('id', 'S5'), ('year', '>i2'), ('lower', '>i4'), ('upper', '>i4')])
+
+
+def ledger_keys(ids, years, lower_bounds, upper_bounds):
+    """Pack (glacier ID, year, lower bound, upper bound) columns into fixed-width byte strings.
+
+    Keys of the same glacier-year share their first 7 bytes.
+    """
+    keys = np.empty(len(ids), dtype=LEDGER_KEY)
+    keys['id'] = ids
+    keys['year'] = years
+    keys['lower'] = lower_bounds
+    keys['upper'] = upper_bounds
+    return keys.view('S15')
+
+
+def combine_keys(keys, balances, sequence):
+    """Combine the rows of each ledger key the way `Glacier.add_mass_balance_measurement` combines measurements.
+
+    The partial rows of a key are summed, and of the full rows (bounds 9999 to
+    9999) only the first counts. Returns (first, combined): the index of the
+    first row of each key, in order of key, and the balance its rows combine to.
+    """
+    balances = np.asarray(balances, dtype=np.float64)
+
+    # a stable sort of rows in reading order puts each key's first row first
+    by_sequence = np.argsort(sequence, kind='stable')
+    order = by_sequence[np.argsort(keys[by_sequence], kind='stable')]
+    sorted_keys = keys[order]
+
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    first = order[starts]
+    if len(first) == 0:
+        return first, balances[first]
+
+    fields = keys[first].view(LEDGER_KEY)
+    full = (fields['lower'] == 9999) & (fields['upper'] == 9999)
+    sums = np.add.reduceat(balances[order], np.flatnonzero(starts))
+    return first, np.where(full, balances[first], sums)
+
+
+class MeasurementLedger:
+    """Record of the mass-balance rows read into a collection.
+
+    Rows are keyed by glacier ID, year and altitude bounds, with the balance
+    the rows read for each key added to the collection: their sum for partial
+    rows, and the first one for full rows (see `combine_keys`). This lets a new version of a mass-balance file
+    be compared with what was read before, so only new or changed rows are
+    applied (see `GlacierCollection.update_mass_balance_data`).
+    """
+
+    def __init__(self):
+        # sorted keys, with their combined balance and the order each key was first read in
+        self.keys = np.empty(0, dtype='S15')
+        self.balances = np.empty(0, dtype=np.float64)
+        self.sequence = np.empty(0, dtype=np.int64)
+        self._pending = []
+        self._count = 0
+
+    def __len__(self):
+        self._merge()
+        return len(self.keys)
+
+    def record(self, ids, years, lower_bounds, upper_bounds, mass_balances):
+        """Add rows that have been applied to the collection, combining them with the rows of known keys."""
+        self.record_keys(ledger_keys(ids, years, lower_bounds, upper_bounds), mass_balances)
+
+    def record_keys(self, keys, mass_balances):
+        """`record` for rows whose keys were already packed by `ledger_keys`."""
+        sequence = np.arange(self._count, self._count + len(keys))
+        self._count += len(keys)
+        self._pending.append((keys, np.asarray(mass_balances, dtype=np.float64), sequence))
+
+    def _merge(self):
+        if not self._pending:
+            return
+
+        pending_keys, pending_balances, pending_sequence = zip(*self._pending)
+        self._pending = []
+        keys = np.concatenate([self.keys, *pending_keys])
+        balances = np.concatenate([self.balances, *pending_balances])
+        sequence = np.concatenate([self.sequence, *pending_sequence])
+
+        # a known key's entry is read before its new rows, so it combines with them like its first row
+        first, self.balances = combine_keys(keys, balances, sequence)
+        self.keys = keys[first]
+        self.sequence = sequence[first]
+
+    def replace(self, positions, balances):
+        """Set the balances of the keys at ledger `positions` given by `diff`, before any more rows are recorded."""
+        self.balances[positions] = balances
+
+    def rows(self):
+        """Return (ids, years, lower bounds, upper bounds, balances) of every key, sorted by ID, year and bounds."""
+        self._merge()
+        fields = self.keys.view(LEDGER_KEY)
+        return (fields['id'], fields['year'].astype(np.int64), fields['lower'].astype(np.int64),
+                fields['upper'].astype(np.int64), self.balances)
+
+    def first_of_year(self, positions):
+        """Whether the ledger rows at `positions` were read first of all rows of their glacier-year."""
+        self._merge()
+        prefixes = self.keys.view(np.uint8).reshape(-1, 15)[:, :7]
+        starts = np.ones(len(self.keys), dtype=bool)
+        starts[1:] = (prefixes[1:] != prefixes[:-1]).any(axis=1)
+        group = np.cumsum(starts) - 1
+        first_sequence = np.minimum.reduceat(self.sequence, np.flatnonzero(starts)) if len(self.keys) > 0 else self.sequence
+        return self.sequence[positions] == first_sequence[group[positions]]
+
+    def diff(self, ids, years, lower_bounds, upper_bounds, mass_balances):
+        """Compare rows with the ledger.
+
+        The rows of a key given more than once are combined as by `combine_keys`.
+        Returns (rows, positions, balances), where `rows` indexes the first given
+        row of each key that is new or changed, in order, `positions` is the
+        ledger position of each of those keys, or -1 for new keys, and
+        `balances` is the balance its rows combine to.
+        """
+        self._merge()
+        keys = ledger_keys(ids, years, lower_bounds, upper_bounds)
+
+        # the first row of each key, back in the order given
+        rows, balances = combine_keys(keys, np.asarray(mass_balances, dtype=np.float64), np.arange(len(keys)))
+        order = np.argsort(rows)
+        rows, balances = rows[order], balances[order]
+
+        if len(self.keys) == 0:
+            return rows, np.full(len(rows), -1, dtype=np.int64), balances
+
+        positions = np.minimum(np.searchsorted(self.keys, keys[rows]), len(self.keys) - 1)
+        known = self.keys[positions] == keys[rows]
+        changed = ~known | (self.balances[positions] != balances)
+
+        return rows[changed], np.where(known, positions, -1)[changed], balances[changed]
+
+    def save(self, directory):
+        """Write the ledger's arrays to .npy files in `directory`, as `GlacierStore.save` does."""
+        self._merge()
+        for name in ('keys', 'balances', 'sequence'):
+            temporary = directory / f'ledger_{name}.npy.tmp'
+            with open(temporary, 'wb') as file:
+                np.save(file, getattr(self, name))
+            os.replace(temporary, directory / f'ledger_{name}.npy')
+
+    @staticmethod
+    def remove(directory):
+        """Delete a ledger written by `save` to `directory`, if there is one."""
+        for name in ('keys', 'balances', 'sequence'):
+            (directory / f'ledger_{name}.npy').unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, directory):
+        """Read a ledger written by `save`, or return None if there is none."""
+        ledger = None
+        if (directory / 'ledger_keys.npy').is_file():
+            ledger = cls()
+            ledger.keys = np.load(directory / 'ledger_keys.npy')
+            ledger.balances = np.load(directory / 'ledger_balances.npy')
+            ledger.sequence = np.load(directory / 'ledger_sequence.npy')
+            ledger._count = int(ledger.sequence.max()) + 1 if len(ledger.sequence) > 0 else 0
+        return ledger
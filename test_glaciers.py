@@ -1,5 +1,21 @@
-from glaciers import Glacier, GlacierCollection
+from benchmark_glaciers import generate_dataset, glacier_id, run_benchmarks
+from glaciers import Glacier, GlacierCollection, LiveGlacierCollection
+from locks import ReadWriteLock
+from utils import haversine_distance, haversine_distance_array, haversine_distance_matrix
+import asyncio
+import csv
+import glaciers
+import instrumentation
+import json
+import numpy as np
+import os
+import pickle
 import pytest
+import storage
+import subprocess
+import sys
+import threading
+import time
 from pytest import raises
 from pathlib import Path
 
@@ -292,6 +308,25 @@ def test_correct_filter():
     assert len(all_results) == 1696
 
 
+# the code index should give the same glaciers, in collection order, as checking every code
+@pytest.mark.parametrize("columnar", [False, True])
+def test_filter_by_code_index(columnar):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+
+    for pattern in ["638", "52?", "?3?", "??8", "5?8", "???", "000"]:
+        expected = [glacier.name for glacier in collection.glaciers.values()
+                    if all(p in ("?", c) for p, c in zip(pattern, str(glacier.type)))]
+        assert collection.filter_by_code(pattern) == expected
+
+    # results are remembered, but callers get their own copy
+    result = collection.filter_by_code("638")
+    result.append("NOT A GLACIER")
+    assert len(collection.filter_by_code("638")) == 12
+
+    collection.add_glacier(Glacier(glacier_id='99998', name='NEW GLACIER', unit='CH', lat=12.34, lon=56.78, code=638))
+    assert collection.filter_by_code("638")[-1] == "NEW GLACIER"
+
+
 # test invalid inputs into filter method
 invalid_filter_tests = [(10.1, TypeError),
                         ("12345", ValueError),
@@ -348,6 +383,71 @@ def test_invalid_sort(error, n, reverse, data):
         collection.sort_by_latest_mass_balance(n=n, reverse=reverse)
 
 
+# glaciers with equal latest changes should all be kept, in collection order
+@pytest.mark.parametrize("columnar", [False, True])
+def test_sort_ties_and_updates(columnar):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+    for gid in ['03987', '02660']:
+        collection.glaciers[gid].add_mass_balance_measurement(year=2000, mass_balance=-7, partial=False)
+
+    tied = [glacier.id for glacier in collection.sort_by_latest_mass_balance(n=2)]
+    assert tied == [gid for gid in collection.glaciers if gid in ['03987', '02660']]
+
+    # a later measurement replaces the latest change, a partial one adds to it
+    glacier = collection.glaciers['02660']
+    glacier.add_mass_balance_measurement(year=2001, mass_balance=5, partial=False)
+    glacier.add_mass_balance_measurement(year=2001, mass_balance=2, partial=True)
+    glacier.add_mass_balance_measurement(year=1990, mass_balance=-1, partial=False)
+    assert (glacier.earliest_year, glacier.latest_year, glacier.latest_mass_balance) == (1990, 2001, 7)
+
+    assert [glacier.id for glacier in collection.sort_by_latest_mass_balance(n=1)] == ['02660']
+    assert [glacier.id for glacier in collection.sort_by_latest_mass_balance(n=1, reverse=True)] == ['03987']
+
+
+# the summary counts kept as measurements arrive should match a full scan
+@pytest.mark.parametrize("columnar, bulk", [(False, False), (False, True), (True, False)])
+def test_summary_counts(columnar, bulk, capsys):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+    collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'), bulk=bulk)
+    collection.add_glacier(Glacier(glacier_id='99998', name='NEW GLACIER', unit='CH', lat=12.34, lon=56.78, code=638))
+    collection.glaciers['99998'].add_mass_balance_measurement(year=1900, mass_balance=-5, partial=False)
+
+    measured = [v for v in collection.glaciers.values() if v.mass_balances]
+    shrunk = sum(v.mass_balances[max(v.mass_balances)] < 0 for v in measured)
+    assert min(min(v.mass_balances) for v in measured) == 1900
+
+    assert collection.summary()
+    output = capsys.readouterr().out
+    assert "earliest measurement was in 1900" in output
+    assert f"{round(shrunk / len(measured) * 100)}% of glaciers shrunk" in output
+
+
+# glaciers copied from a columnar collection or put into the dict directly should be counted too
+def test_summary_after_other_additions(capsys):
+    columnar = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=True)
+    columnar.read_mass_balance_data(Path('test_data/sheet-EE.csv'))
+    view = columnar.glaciers['03987']
+
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'))
+    with raises(KeyError) as exception:
+        collection.add_glacier(view)
+    del collection.glaciers['03987']
+    assert collection.add_glacier(view)
+    copy = collection.glaciers['03987']
+    assert type(copy) == Glacier and copy.mass_balances == view.mass_balances
+    copy.add_mass_balance_measurement(year=1900, mass_balance=-1, partial=False)
+    assert 1900 not in view.mass_balances
+
+    other = GlacierCollection(Path('test_data/sheet-A.csv'))
+    other.glaciers['99998'] = Glacier(glacier_id='99998', name='NEW GLACIER', unit='CH', lat=1.0, lon=1.0, code=638)
+    other.glaciers['99998'].add_mass_balance_measurement(year=1950, mass_balance=-5, partial=False)
+    assert other.summary()
+    assert "earliest measurement was in 1950" in capsys.readouterr().out
+    other.glaciers['99998'].add_mass_balance_measurement(year=1940, mass_balance=5, partial=False)
+    assert other.summary()
+    assert "earliest measurement was in 1940" in capsys.readouterr().out
+
+
 # test summary method on correct valid data
 def test_valid_summary():
     file = Path('test_data/sheet-A.csv')
@@ -395,3 +495,1220 @@ def test_invalid_plot_extremes(error, plot_file, data):
 
     with raises(error) as exception:
         collection.plot_extremes(plot_file)
+
+
+# the columnar backend should give the same answers as the default one
+def test_columnar_collection_matches_default():
+    file = Path('test_data/sheet-A.csv')
+    mb_file = Path('test_data/sheet-EE.csv')
+    collection = GlacierCollection(file)
+    collection.read_mass_balance_data(mb_file)
+    columnar = GlacierCollection(file, columnar=True)
+    columnar.read_mass_balance_data(mb_file)
+
+    assert len(columnar.glaciers) == len(collection.glaciers)
+    assert list(columnar.glaciers) == list(collection.glaciers)
+
+    for gid in ['03987', '02660', '00051']:
+        glacier, view = collection.glaciers[gid], columnar.glaciers[gid]
+        assert (view.name, view.unit, view.coordinates, view.type) == \
+               (glacier.name, glacier.unit, glacier.coordinates, glacier.type)
+        assert view.mass_balances == pytest.approx(glacier.mass_balances)
+
+    for pattern in ["638", "52?", "?3?", "999", "???"]:
+        assert columnar.filter_by_code(pattern) == collection.filter_by_code(pattern)
+
+    latest = [v.mass_balances[max(v.mass_balances)] for v in collection.sort_by_latest_mass_balance(n=5)]
+    assert [v.mass_balances[max(v.mass_balances)] for v in columnar.sort_by_latest_mass_balance(n=5)] == latest
+    assert columnar.summary()
+
+
+# partial measurements added to a stored glacier are summed like on a Glacier
+def test_columnar_partial_measurements():
+    columnar = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=True)
+    glacier = columnar.glaciers['03987']
+
+    glacier.add_mass_balance_measurement(year=2000, mass_balance=-100, partial=True)
+    glacier.add_mass_balance_measurement(year=2000, mass_balance=-50, partial=True)
+    glacier.add_mass_balance_measurement(year=2000, mass_balance=999, partial=False)
+    glacier.add_mass_balance_measurement(year=1999, mass_balance=10, partial=False)
+
+    assert columnar.glaciers['03987'].mass_balances == {1999: 10, 2000: -150}
+    assert columnar.glaciers['03987'] == glacier
+
+    # edits would be lost in a copy of the store's measurements, so they fail
+    with raises(TypeError) as exception:
+        glacier.mass_balances[2001] = 5
+    with raises(AttributeError) as exception:
+        glacier.mass_balances.update({2001: 5})
+    with raises(AttributeError) as exception:
+        glacier.mass_balances = {2001: 5}
+    assert 2001 not in glacier.mass_balances
+
+
+# the spatial index should give exactly the brute-force answer
+@pytest.mark.parametrize("columnar", [False, True])
+def test_find_nearest_matches_scan(columnar):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+
+    for lat, lon in [(-46.65, -73.18), (0.0, 0.0), (89.9, 179.9), (-90, -180), (45.8, 6.9)]:
+        for n in [0, 1, 7, 50]:
+            assert collection.find_nearest(lat=lat, lon=lon, n=n) == collection._find_nearest_by_scan(lat, lon, n)
+
+
+# radius queries should return every glacier within the radius, nearest first
+def test_find_within_radius():
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'))
+
+    within = collection.find_within_radius(lat=-11.88, lon=-76.05, radius=1500)
+    assert within[0] == "SHULLCON"
+    assert within == collection._find_nearest_by_scan(-11.88, -76.05, len(within))
+    assert collection.find_nearest(lat=-11.88, lon=-76.05, n=len(within) + 1)[-1] not in within
+
+    assert collection.find_within_radius(lat=-11.88, lon=-76.05, radius=0) == ["SHULLCON"]
+    assert len(collection.find_within_radius(lat=0, lon=0, radius=30000)) == len(collection.glaciers)
+
+    with raises(ValueError) as exception:
+        collection.find_within_radius(lat=0, lon=0, radius=-1)
+
+
+# glaciers added after loading should be found by the rebuilt index
+@pytest.mark.parametrize("columnar", [False, True])
+def test_find_nearest_after_add_glacier(columnar):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+    assert collection.find_nearest(lat=12.34, lon=56.78, n=1) != ["NEW GLACIER"]
+
+    glacier = Glacier(glacier_id='99998', name='NEW GLACIER', unit='CH', lat=12.34, lon=56.78, code=638)
+    glacier.add_mass_balance_measurement(year=2000, mass_balance=-5, partial=False)
+    collection.add_glacier(glacier)
+
+    assert collection.find_nearest(lat=12.34, lon=56.78, n=1) == ["NEW GLACIER"]
+    assert collection.glaciers['99998'].mass_balances == {2000: -5}
+
+    with raises(KeyError) as exception:
+        collection.add_glacier(glacier)
+
+
+# a batch of queries should give the same glaciers as one query at a time
+@pytest.mark.parametrize("columnar, chunk_size, scan_limit", [(False, None, 4096),
+                                                              (True, None, 4096),
+                                                              (False, 3, 4096),
+                                                              (True, None, 0)])
+def test_find_nearest_many(columnar, chunk_size, scan_limit, monkeypatch):
+    monkeypatch.setattr('spatial.SCAN_LIMIT', scan_limit)
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+    lats = [-46.65, -11.88, 0.0, 89.9, -90]
+    lons = [-73.18, -76.05, 0.0, 179.9, -180]
+
+    ids, names, distances = collection.find_nearest_many(lats, lons, n=10, chunk_size=chunk_size)
+    assert ids.shape == names.shape == distances.shape == (5, 10)
+    assert names[1, 0] == "SHULLCON" and ids[1, 0] == '00051' and distances[1, 0] == pytest.approx(0, abs=1e-6)
+
+    for i in range(5):
+        assert list(names[i]) == collection.find_nearest(lat=lats[i], lon=lons[i], n=10)
+        assert all(distances[i, :-1] <= distances[i, 1:])
+
+
+# test invalid inputs into the batch find_nearest method
+nearest_many_tests = [(['a', 'b'], [1.0, 2.0], 5, TypeError),
+                      ([1.0, 2.0], [1.0], 5, ValueError),
+                      ([100.0], [1.0], 5, ValueError),
+                      ([1.0], [-200.0], 5, ValueError),
+                      ([1.0], [1.0], '5', TypeError),
+                      ([1.0], [1.0], 9999999, ValueError)]
+
+
+@pytest.mark.parametrize("lats, lons, n, error", nearest_many_tests)
+def test_invalid_find_nearest_many(lats, lons, n, error):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'))
+
+    with raises(error) as exception:
+        collection.find_nearest_many(lats, lons, n=n)
+
+
+# the haversine functions should work in degrees and agree with each other
+def test_haversine_distance():
+    # London to Paris
+    assert haversine_distance(51.5074, -0.1278, 48.8566, 2.3522) == pytest.approx(343.56, abs=0.1)
+    assert haversine_distance(0, 0, 0, 180) == pytest.approx(np.pi * 6371)
+
+    lats = np.array([-30.1649, 0.0, 51.5074, 89.0])
+    lons = np.array([-69.8094, 0.0, -0.1278, -179.5])
+    distances = haversine_distance_array(48.8566, 2.3522, lats, lons)
+    assert distances == pytest.approx([haversine_distance(48.8566, 2.3522, a, b) for a, b in zip(lats.tolist(), lons.tolist())])
+
+    out = np.empty((2, 4))
+    matrix = haversine_distance_matrix(lats[:2], lons[:2], lats, lons, out=out)
+    assert matrix is out
+    assert matrix[1] == pytest.approx(haversine_distance_array(0.0, 0.0, lats, lons))
+    assert matrix[0, 0] == 0
+
+
+# invalid inputs into the array haversine function
+haversine_array_tests = [(TypeError, ['a', 'b'], 0.0),
+                         (ValueError, [0.0, 91.0], 0.0),
+                         (ValueError, [0.0, np.nan], 0.0),
+                         (ValueError, 0.0, [181.0])]
+
+
+@pytest.mark.parametrize("error, lats, lons", haversine_array_tests)
+def test_invalid_haversine_distance_array(error, lats, lons):
+    with raises(error) as exception:
+        haversine_distance_array(0.0, 0.0, lats, lons)
+
+
+# streaming in small chunks should build the same collection
+def test_chunked_loading():
+    file = Path('test_data/sheet-A.csv')
+    mb_file = Path('test_data/sheet-EE.csv')
+    collection = GlacierCollection(file, columnar=True)
+    collection.read_mass_balance_data(mb_file)
+    chunked = GlacierCollection(file, columnar=True, chunk_size=7)
+    chunked.read_mass_balance_data(mb_file, chunk_size=3)
+
+    assert list(chunked.glaciers) == list(collection.glaciers)
+    assert [v.mass_balances for v in chunked.glaciers.values()] == \
+           [v.mass_balances for v in collection.glaciers.values()]
+
+    with raises(ValueError) as exception:
+        GlacierCollection(file, chunk_size=0)
+
+
+# a completely empty file has no header or rows to read
+def test_empty_file_without_header(tmp_path):
+    empty = tmp_path / 'empty.csv'
+    empty.write_text('')
+
+    with raises(EOFError) as exception:
+        GlacierCollection(empty)
+
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'))
+    with raises(EOFError) as exception:
+        collection.read_mass_balance_data(empty)
+
+
+# bulk ingest should give the same measurements as adding them one by one
+@pytest.mark.parametrize("columnar", [False, True])
+def test_bulk_mass_balance_ingest(columnar):
+    file = Path('test_data/sheet-A.csv')
+    mb_file = Path('test_data/sheet-EE.csv')
+    collection = GlacierCollection(file, columnar=columnar)
+    collection.read_mass_balance_data(mb_file)
+    bulk = GlacierCollection(file, columnar=columnar)
+    assert bulk.read_mass_balance_data(mb_file, chunk_size=100, bulk=True)
+
+    assert [v.mass_balances for v in bulk.glaciers.values()] == \
+           [v.mass_balances for v in collection.glaciers.values()]
+
+
+# bulk ingest should reject the same bad files, naming the row
+@pytest.mark.parametrize("columnar", [False, True])
+def test_invalid_bulk_mass_balance_ingest(columnar, tmp_path):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+
+    with raises(KeyError) as exception:
+        collection.read_mass_balance_data(Path('test_data/invalid_id.csv'), bulk=True)
+    assert "row 0" in str(exception.value)
+
+    future = tmp_path / 'future.csv'
+    future.write_text("WGMS_ID,YEAR,LOWER_BOUND,UPPER_BOUND,ANNUAL_BALANCE\n"
+                      "03987,2000,9999,9999,-5\n"
+                      "03987,3000,9999,9999,-5\n")
+    with raises(ValueError) as exception:
+        collection.read_mass_balance_data(future, bulk=True)
+    assert "row 1" in str(exception.value)
+
+    with raises(TypeError) as exception:
+        collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'), bulk='yes')
+
+
+# a collection loaded from a cache should match the one it was saved from
+@pytest.mark.parametrize("columnar", [False, True])
+def test_cache_round_trip(columnar, tmp_path):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+    collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'))
+    assert collection.save_cache(tmp_path / 'cache')
+
+    cached = GlacierCollection.load_cache(tmp_path / 'cache')
+    assert isinstance(cached._store.years, np.memmap)
+    assert list(cached.glaciers) == list(collection.glaciers)
+    assert [v.mass_balances for v in cached.glaciers.values()] == \
+           [v.mass_balances for v in collection.glaciers.values()]
+    assert cached.filter_by_code("52?") == collection.filter_by_code("52?")
+    assert cached.find_nearest(lat=-11.88, lon=-76.05, n=3) == collection.find_nearest(lat=-11.88, lon=-76.05, n=3)
+
+
+# the cache should be rebuilt when a source file changes, but not when it is only touched
+def test_cache_invalidation(tmp_path):
+    glacier_file = tmp_path / 'sheet-A.csv'
+    mb_file = tmp_path / 'sheet-EE.csv'
+    glacier_file.write_text(Path('test_data/sheet-A.csv').read_text())
+    mb_file.write_text("WGMS_ID,YEAR,LOWER_BOUND,UPPER_BOUND,ANNUAL_BALANCE\n03987,2000,9999,9999,-5\n")
+
+    collection = GlacierCollection(glacier_file)
+    collection.read_mass_balance_data(mb_file)
+    collection.save_cache(tmp_path / 'cache')
+
+    os.utime(mb_file, ns=(0, 0))
+    cached = GlacierCollection.load_cache(tmp_path / 'cache')
+    assert isinstance(cached._store.years, np.memmap)
+    assert cached.glaciers['03987'].mass_balances == {2000: -5}
+
+    mb_file.write_text("WGMS_ID,YEAR,LOWER_BOUND,UPPER_BOUND,ANNUAL_BALANCE\n03987,2000,9999,9999,-7\n")
+    rebuilt = GlacierCollection.load_cache(tmp_path / 'cache')
+    assert rebuilt.glaciers['03987'].mass_balances == {2000: -7}
+    assert GlacierCollection.load_cache(tmp_path / 'cache').glaciers['03987'].mass_balances == {2000: -7}
+
+    with raises(FileNotFoundError) as exception:
+        GlacierCollection.load_cache(tmp_path / 'missing')
+
+
+# regional files loaded together should give the same collection as one combined file
+@pytest.mark.parametrize("columnar, workers", [(False, 1), (False, 2), (True, 2)])
+def test_from_files(columnar, workers, tmp_path):
+    for name, parts in [('sheet-A', 3), ('sheet-EE', 2)]:
+        header, *rows = Path(f'test_data/{name}.csv').read_text().splitlines(keepends=True)
+        size = len(rows) // parts + 1
+        for k in range(parts):
+            (tmp_path / f'region{k}-{name}.csv').write_text(header + ''.join(rows[k * size:(k + 1) * size]))
+
+    expected = GlacierCollection(Path('test_data/sheet-A.csv'))
+    expected.read_mass_balance_data(Path('test_data/sheet-EE.csv'))
+
+    collection = GlacierCollection.from_files(tmp_path / '*-sheet-A.csv', tmp_path / '*-sheet-EE.csv',
+                                              columnar=columnar, workers=workers)
+    assert list(collection.glaciers) == list(expected.glaciers)
+    for gid, glacier in expected.glaciers.items():
+        assert collection.glaciers[gid].name == glacier.name
+        assert collection.glaciers[gid].mass_balances == pytest.approx(glacier.mass_balances)
+    assert collection.sort_by_latest_mass_balance(n=3)[0].id == expected.sort_by_latest_mass_balance(n=3)[0].id
+
+    # every file is recorded, so a stale cache can be rebuilt from all of them
+    collection.save_cache(tmp_path / 'cache')
+    (tmp_path / 'region1-sheet-EE.csv').write_text("WGMS_ID,YEAR,LOWER_BOUND,UPPER_BOUND,ANNUAL_BALANCE\n"
+                                                   "03987,1900,9999,9999,-5\n")
+    rebuilt = GlacierCollection.load_cache(tmp_path / 'cache')
+    assert len(rebuilt.glaciers) == len(expected.glaciers)
+    assert rebuilt.glaciers['03987'].mass_balances[1900] == -5
+
+    with raises(KeyError) as exception:
+        GlacierCollection.from_files([tmp_path / 'region0-sheet-A.csv', tmp_path / 'region0-sheet-A.csv'],
+                                     workers=workers)
+
+
+invalid_from_files_tests = [(TypeError, 'test_data/sheet-A.csv', [], None),
+                            (TypeError, [Path('test_data/sheet-A.csv'), 'test_data/sheet-A.csv'], [], None),
+                            (FileNotFoundError, Path('test_data/*.missing'), [], None),
+                            (ValueError, [], [], None),
+                            (FileNotFoundError, [Path('test_data/sheet-A.csv')], [Path('test_data/missing.csv')], None),
+                            (TypeError, [Path('test_data/sheet-A.csv')], [], 2.0),
+                            (ValueError, [Path('test_data/sheet-A.csv')], [], 0)]
+
+
+@pytest.mark.parametrize("error, glacier_files, mass_balance_files, workers", invalid_from_files_tests)
+def test_invalid_from_files(error, glacier_files, mass_balance_files, workers):
+    with raises(error) as exception:
+        GlacierCollection.from_files(glacier_files, mass_balance_files, workers=workers)
+
+
+# batch plots should be rendered once, then only again when a glacier's data changes
+@pytest.mark.parametrize("columnar, workers", [(False, 1), (False, 2), (True, 2)])
+def test_plot_all_mass_balances(columnar, workers, tmp_path, monkeypatch):
+    # a few glaciers' measurements, to keep the number of plots small
+    mb_file = tmp_path / 'mass_balance.csv'
+    mb_file.write_text(''.join(Path('test_data/sheet-EE.csv').read_text().splitlines(keepends=True)[:41]))
+    output_dir = tmp_path / 'plots'
+    output_dir.mkdir()
+
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+    collection.read_mass_balance_data(mb_file)
+    measured = [gid for gid, glacier in collection.glaciers.items() if glacier.mass_balances]
+
+    assert collection.plot_all_mass_balances(output_dir, workers=workers) == measured
+    assert sorted(path.name for path in output_dir.glob('*.png')) == sorted(f'{gid}.png' for gid in measured)
+
+    # nothing is rendered when every plot is up to date
+    with monkeypatch.context() as patch:
+        patch.setattr(glaciers, '_render_mass_balances', lambda batch: pytest.fail("rendered up-to-date plots"))
+        assert collection.plot_all_mass_balances(output_dir, workers=workers) == []
+
+    collection.glaciers[measured[0]].add_mass_balance_measurement(year=1900, mass_balance=-1, partial=False)
+    (output_dir / f'{measured[1]}.png').unlink()
+    assert collection.plot_all_mass_balances(output_dir, workers=workers) == measured[:2]
+    assert collection.plot_all_mass_balances(output_dir, workers=workers, ids=measured[:3]) == []
+
+
+invalid_plot_all_tests = [(TypeError, 'test_data', None, None),
+                          (ValueError, Path('test_data/sheet-A.csv'), None, None),
+                          (TypeError, Path('test_data'), 1.5, None),
+                          (ValueError, Path('test_data'), 0, None),
+                          (TypeError, Path('test_data'), 1, '03987'),
+                          (KeyError, Path('test_data'), 1, ['99999']),
+                          (ValueError, Path('test_data'), 1, ['03987'])]
+
+
+@pytest.mark.parametrize("error, output_dir, workers, ids", invalid_plot_all_tests)
+def test_invalid_plot_all_mass_balances(error, output_dir, workers, ids):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'))
+
+    with raises(error) as exception:
+        collection.plot_all_mass_balances(output_dir, workers=workers, ids=ids)
+
+
+# the async methods should give the same answers as the blocking ones
+@pytest.mark.parametrize("columnar", [False, True])
+def test_async_collection(columnar):
+    async def run():
+        collection = await GlacierCollection.aload(Path('test_data/sheet-A.csv'), Path('test_data/sheet-EE.csv'),
+                                                   columnar=columnar)
+        nearest, codes, top = await asyncio.gather(collection.afind_nearest(-46.65, -73.18, n=3),
+                                                   collection.afilter_by_code("52?"),
+                                                   collection.asort_by_latest_mass_balance(n=2))
+
+        # concurrent partial measurements are each added once
+        await asyncio.gather(*[collection.aadd_mass_balance_measurement('03987', 1900, 1, True) for _ in range(20)])
+
+        with raises(KeyError) as exception:
+            await collection.aadd_mass_balance_measurement('99999', 1900, 1, False)
+
+        return collection, nearest, codes, top
+
+    collection, nearest, codes, top = asyncio.run(run())
+    assert nearest == collection.find_nearest(-46.65, -73.18, n=3)
+    assert codes == collection.filter_by_code("52?")
+    assert top == collection.sort_by_latest_mass_balance(n=2)
+    assert collection.glaciers['03987'].mass_balances[1900] == 20
+
+    # a collection can be used again from another event loop
+    assert asyncio.run(collection.afilter_by_code("52?")) == codes
+
+
+# queries running together right after a change should all see the whole change
+def test_async_queries_after_change():
+    async def run():
+        collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=True)
+        await collection.aread_mass_balance_data(Path('test_data/sheet-EE.csv'), 65536, True)
+        return await asyncio.gather(*[collection.asort_by_latest_mass_balance(n=2) for _ in range(8)])
+
+    for _ in range(10):
+        results = asyncio.run(run())
+        assert all([glacier.id for glacier in result] == [glacier.id for glacier in results[0]] for result in results)
+
+
+# readers share the lock, a writer has it alone and is served before later readers
+def test_read_write_lock():
+    async def run():
+        lock = ReadWriteLock()
+        events = []
+
+        async def reader(name, delay):
+            await asyncio.sleep(delay)
+            async with lock.reading():
+                events.append(f'{name} start')
+                await asyncio.sleep(0.02)
+                events.append(f'{name} end')
+
+        async def writer(delay):
+            await asyncio.sleep(delay)
+            async with lock.writing():
+                events.append('writer start')
+                await asyncio.sleep(0.02)
+                events.append('writer end')
+
+        await asyncio.gather(reader('a', 0), reader('b', 0), writer(0.005), reader('c', 0.01))
+        return events
+
+    events = asyncio.run(run())
+    assert events[:2] == ['a start', 'b start']
+    assert events[4:] == ['writer start', 'writer end', 'c start', 'c end']
+
+
+# updating from a new version of a file should give the same data as reading it afresh
+@pytest.mark.parametrize("columnar, bulk", [(False, False), (False, True), (True, False), (True, True)])
+def test_update_mass_balance_data(columnar, bulk, tmp_path):
+    header = "WGMS_ID,YEAR,LOWER_BOUND,UPPER_BOUND,ANNUAL_BALANCE\n"
+    old_rows = ["03987,2000,9999,9999,-5\n", "03987,2000,1000,1500,2\n", "03987,2000,1500,2000,3\n",
+                "02660,2000,1000,1500,7\n", "02660,2000,9999,9999,100\n", "02660,2001,9999,9999,1\n"]
+    new_rows = ["03987,2000,9999,9999,-6\n", "03987,2000,1000,1500,2\n", "03987,2000,1500,2000,4\n",
+                "02660,2000,1000,1500,7\n", "02660,2000,9999,9999,200\n", "02660,2001,9999,9999,1\n",
+                "02660,2001,0,100,1\n", "03987,2002,9999,9999,8\n"]
+    mb_file = tmp_path / 'sheet-EE.csv'
+    mb_file.write_text(header + ''.join(old_rows))
+
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar, track_rows=True)
+    collection.read_mass_balance_data(mb_file, bulk=bulk)
+    assert collection.update_mass_balance_data(mb_file) == 0
+    assert collection.glaciers['03987'].mass_balances == {2000: 0}
+
+    mb_file.write_text(header + ''.join(new_rows))
+    assert collection.update_mass_balance_data(mb_file) == 5
+    assert collection.update_mass_balance_data(mb_file) == 0
+
+    expected = GlacierCollection(Path('test_data/sheet-A.csv'))
+    expected.read_mass_balance_data(mb_file)
+    for gid in ['03987', '02660']:
+        assert collection.glaciers[gid].mass_balances == expected.glaciers[gid].mass_balances
+    assert collection.sort_by_latest_mass_balance(n=1)[0].id == '03987'
+
+    # the ledger is kept in the cache, so updating a cached collection does not add rows twice
+    collection.save_cache(tmp_path / 'cache')
+    cached = GlacierCollection.load_cache(tmp_path / 'cache')
+    assert cached.update_mass_balance_data(mb_file) == 0
+    assert cached.glaciers['02660'].mass_balances == expected.glaciers['02660'].mass_balances
+
+    unknown_file = tmp_path / 'unknown.csv'
+    unknown_file.write_text(header + "99999,2000,9999,9999,1\n")
+    with raises(KeyError) as exception:
+        collection.update_mass_balance_data(unknown_file)
+
+
+# repeated rows of a file are combined as always, and the ledger combines them the same way
+@pytest.mark.parametrize("bulk", [False, True])
+@pytest.mark.parametrize("chunk_size", [1, 2, 65536])
+def test_repeated_mass_balance_rows(bulk, chunk_size, tmp_path):
+    header = "WGMS_ID,YEAR,LOWER_BOUND,UPPER_BOUND,ANNUAL_BALANCE\n"
+    rows = ["03987,2000,9999,9999,7", "03987,2000,9999,9999,8", "03987,2001,9999,9999,5",
+            "03987,2002,1000,1500,3", "03987,2002,1500,2000,1", "03987,2002,1000,1500,4"]
+    mb_file = tmp_path / 'sheet-EE.csv'
+    mb_file.write_text(header + "\n".join(rows) + "\n")
+    expected = {2000: 7.0, 2001: 5.0, 2002: 8.0}
+
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), track_rows=True)
+    collection.read_mass_balance_data(mb_file, chunk_size=chunk_size, bulk=bulk)
+    assert collection.glaciers['03987'].mass_balances == expected
+    assert collection.update_mass_balance_data(mb_file, chunk_size=chunk_size) == 0
+
+    # a file read twice adds its partial rows twice, and updating from it again undoes that
+    collection.read_mass_balance_data(mb_file, chunk_size=chunk_size, bulk=bulk)
+    assert collection.glaciers['03987'].mass_balances == {2000: 7.0, 2001: 5.0, 2002: 16.0}
+    assert collection.update_mass_balance_data(mb_file, chunk_size=chunk_size) == 2
+    assert collection.glaciers['03987'].mass_balances == expected
+
+    # a repeated row changed in a new version moves its key by the change in the combined balance
+    mb_file.write_text(header + "\n".join(rows[:-1] + ["03987,2002,1000,1500,6"]) + "\n")
+    assert collection.update_mass_balance_data(mb_file, chunk_size=chunk_size) == 1
+    assert collection.glaciers['03987'].mass_balances == {2000: 7.0, 2001: 5.0, 2002: 10.0}
+
+
+# a frozen collection should refuse every change
+@pytest.mark.parametrize("columnar", [False, True])
+def test_frozen_collection(columnar):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+    collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'))
+    expected = collection.filter_by_code("52?")
+    assert collection.freeze() is collection
+    assert collection.filter_by_code("52?") == expected
+
+    with raises(TypeError) as exception:
+        collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'))
+
+    with raises(TypeError) as exception:
+        collection.add_glacier(Glacier(glacier_id='99998', name='NEW GLACIER', unit='CH', lat=1.0, lon=1.0, code=638))
+
+    with raises(TypeError) as exception:
+        collection.glaciers['03987'].add_mass_balance_measurement(year=1900, mass_balance=1, partial=False)
+
+    with raises(TypeError) as exception:
+        collection.glaciers['99998'] = collection.glaciers['03987']
+
+    assert 1900 not in collection.glaciers['03987'].mass_balances
+
+
+# collections and glaciers should survive pickling, result cache and lock included
+@pytest.mark.parametrize("columnar", [False, True])
+@pytest.mark.parametrize("frozen", [False, True])
+def test_pickle_collection(columnar, frozen, capsys):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+    collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'))
+    expected = collection.sort_by_latest_mass_balance(n=3)
+    asyncio.run(collection.asort_by_latest_mass_balance(n=3))
+    if frozen:
+        collection.freeze()
+
+    copy = pickle.loads(pickle.dumps(collection))
+    assert [glacier.id for glacier in copy.sort_by_latest_mass_balance(n=3)] == [glacier.id for glacier in expected]
+    assert asyncio.run(copy.asort_by_latest_mass_balance(n=3)) == copy.sort_by_latest_mass_balance(n=3)
+
+    if frozen:
+        with raises(TypeError) as exception:
+            copy.glaciers['03987'].add_mass_balance_measurement(year=1900, mass_balance=-1, partial=False)
+    else:
+        copy.glaciers['03987'].add_mass_balance_measurement(year=1900, mass_balance=-1, partial=False)
+        assert copy.summary()
+        assert "earliest measurement was in 1900" in capsys.readouterr().out
+        assert 1900 not in collection.glaciers['03987'].mass_balances
+
+    glacier = pickle.loads(pickle.dumps(collection.glaciers['03987']))
+    assert glacier.mass_balances == collection.glaciers['03987'].mass_balances
+    if not columnar:
+        assert glacier._collections == ()
+
+
+# queries during a reload should see the old data or the new, never a mix
+def test_live_collection_reload(tmp_path):
+    glacier_file = tmp_path / 'sheet-A.csv'
+    mb_file = tmp_path / 'sheet-EE.csv'
+    glacier_file.write_text(Path('test_data/sheet-A.csv').read_text())
+    header = "WGMS_ID,YEAR,LOWER_BOUND,UPPER_BOUND,ANNUAL_BALANCE\n"
+    mb_file.write_text(header + "03987,2000,9999,9999,-5\n02660,2000,9999,9999,5\n")
+
+    live = LiveGlacierCollection([glacier_file], tmp_path / '*-EE.csv', workers=1)
+    old = live.current
+    assert [glacier.id for glacier in live.sort_by_latest_mass_balance(n=2)] == ['02660', '03987']
+
+    answers = set()
+    stop = threading.Event()
+
+    def query():
+        while not stop.is_set():
+            answers.add(tuple(glacier.id for glacier in live.sort_by_latest_mass_balance(n=2)))
+
+    threads = [threading.Thread(target=query) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+
+    (tmp_path / 'extra-EE.csv').write_text(header + "03987,2001,9999,9999,50\n")
+    for _ in range(5):
+        live.reload()
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    assert answers <= {('02660', '03987'), ('03987', '02660')}
+    assert [glacier.id for glacier in live.sort_by_latest_mass_balance(n=2)] == ['03987', '02660']
+    assert old.glaciers['03987'].mass_balances == {2000: -5}
+    assert asyncio.run(live.areload([glacier_file], [mb_file]))
+    assert [glacier.id for glacier in live.sort_by_latest_mass_balance(n=2)] == ['02660', '03987']
+
+
+# the synthetic benchmark data should load, and every benchmark should run on it
+def test_benchmarks(tmp_path):
+    assert len({glacier_id(number) for number in range(0, 10 ** 6, 997)}) == len(range(0, 10 ** 6, 997))
+
+    glacier_file, mb_file = generate_dataset(tmp_path / 'small', 20)
+    collection = GlacierCollection(glacier_file)
+    collection.read_mass_balance_data(mb_file)
+    assert len(collection.glaciers) == 20
+
+    results = run_benchmarks([20], tmp_path, repeat=1)
+    assert {result['backend'] for result in results['results']} == {'dict', 'columnar'}
+    assert all(len(result['seconds']) == 1 for result in results['results'])
+
+
+# instrumentation should time registered operations only while enabled
+def test_instrumentation():
+    original = GlacierCollection.find_nearest
+    instrumentation.reset()
+    instrumentation.enable()
+    try:
+        collection = GlacierCollection(Path('test_data/sheet-A.csv'))
+        collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'), bulk=True)
+        for n in range(1, 4):
+            collection.find_nearest(-46.65, -73.18, n=n)
+        columnar = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=True)
+        columnar.glaciers['03987'].add_mass_balance_measurement(year=2000, mass_balance=1, partial=False)
+    finally:
+        instrumentation.disable()
+
+    assert GlacierCollection.find_nearest is original
+    collection.find_nearest(-46.65, -73.18, n=3)
+
+    stats = GlacierCollection.stats()
+    assert stats['GlacierCollection.find_nearest']['calls'] == 3
+    assert stats['GlacierCollection.__init__']['calls'] == 2
+    assert stats['GlacierCollection.__init__']['rows'] == 2 * len(collection.glaciers)
+    assert stats['GlacierCollection._read_mass_balance_bulk']['rows_per_second'] > 0
+    assert stats['Glacier.add_mass_balance_measurement']['calls'] == 1
+    assert stats['glaciers.haversine_distance_array']['calls'] >= 3
+    entry = stats['GlacierCollection.find_nearest']
+    assert entry['p50'] <= entry['p90'] <= entry['p99'] <= entry['max']
+
+    assert json.loads(instrumentation.to_json())['GlacierCollection.find_nearest']['calls'] == 3
+    assert 'glaciers_operation_seconds_count{operation="GlacierCollection.find_nearest"} 3' in \
+        instrumentation.to_prometheus().splitlines()
+
+    with instrumentation.profile() as profile:
+        collection.filter_by_code("5??")
+    assert profile.peak_memory >= 0 and 'filter_by_code' in profile.report()
+
+
+# compact glaciers should give the same mass_balances as a dict, however many measurements they hold
+@pytest.mark.parametrize("years", [0, 1, 2, 8, 9, 30])
+def test_compact_glacier(years):
+    glacier = Glacier('04532', 'AGUA NEGRA', 'AR', -30.1649, -69.8094, 638)
+    assert not hasattr(glacier, '__dict__')
+    assert glacier.coordinates == (-30.1649, -69.8094)
+
+    expected = {}
+    for year in range(1980, 1980 + years):
+        glacier.add_mass_balance_measurement(year=year, mass_balance=year - 1990, partial=False)
+        expected[year] = year - 1990
+    for year in range(1980, 1980 + years, 2):
+        glacier.add_mass_balance_measurement(year=year, mass_balance=0.5, partial=True)
+        glacier.add_mass_balance_measurement(year=year, mass_balance=100, partial=False)
+        expected[year] += 0.5
+    glacier.add_mass_balance_measurement(year=1970, mass_balance=-1, partial=False)
+    expected[1970] = -1
+
+    assert glacier.mass_balances == expected
+    assert list(glacier.mass_balances.items()) == list(expected.items())
+    assert list(glacier.mass_balances.values()) == list(expected.values())
+    assert 1970 in glacier.mass_balances and 1969 not in glacier.mass_balances
+    assert glacier.latest_mass_balance == expected[max(expected)]
+    with raises(KeyError):
+        glacier.mass_balances[1969]
+
+
+# mass_balances can be edited like the dict glaciers used to keep, and collections follow the edits
+@pytest.mark.parametrize("years", [1, 3, 12])
+def test_edit_mass_balances(years, capsys):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'))
+    glacier = collection.glaciers['03987']
+    expected = {year: -1.0 for year in range(1980, 1980 + years)}
+    glacier.mass_balances.update(expected)
+    assert glacier.mass_balances == expected
+    assert (glacier.earliest_year, glacier.latest_year) == (1980, 1979 + years)
+
+    glacier.mass_balances[1979 + years] = 2.5
+    del glacier.mass_balances[1980]
+    expected[1979 + years] = 2.5
+    del expected[1980]
+    assert glacier.mass_balances == expected
+    assert glacier.latest_mass_balance == (2.5 if expected else None)
+    if expected:
+        assert collection.sort_by_latest_mass_balance(n=1) == [glacier]
+        assert collection.summary()
+        output = capsys.readouterr().out
+        assert f"earliest measurement was in {min(expected)}" in output and "0% of glaciers shrunk" in output
+    else:
+        with raises(ZeroDivisionError) as exception:
+            collection.summary()
+
+    glacier.mass_balances = {2001: -3}
+    assert glacier.mass_balances.pop(2001) == -3 and not glacier.mass_balances
+    with raises(KeyError) as exception:
+        del glacier.mass_balances[2001]
+    with raises(TypeError) as exception:
+        glacier.mass_balances[2001] = "-3"
+
+    # equal years are shared through the collection, not between collections
+    other = GlacierCollection(Path('test_data/sheet-A.csv'))
+    for data in [collection, other]:
+        for gid in ['02660', '00051']:
+            data.glaciers[gid].mass_balances.update({1990: 1, 1991: 2})
+    assert collection.glaciers['02660']._years is collection.glaciers['00051']._years
+    assert collection.glaciers['02660']._years is not other.glaciers['02660']._years
+
+    collection.freeze()
+    with raises(TypeError) as exception:
+        collection.glaciers['02660'].mass_balances[1990] = 5
+
+
+# time-series statistics of all glaciers should match those worked out one glacier at a time
+@pytest.mark.parametrize("columnar, years", [(False, None), (True, None), (False, (1990, 2010)), (True, (1990, 2010))])
+def test_time_series_statistics(columnar, years):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+    collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'))
+    first, last = years or (0, 9999)
+    series = {gid: sorted((year, balance) for year, balance in glacier.mass_balances.items() if first <= year <= last)
+              for gid, glacier in collection.glaciers.items()}
+
+    trends = collection.mass_balance_trends(years)
+    fitted = {gid: points for gid, points in series.items() if len(points) >= 2}
+    assert sorted(trends['id']) == sorted(fitted)
+    for gid, count, slope, intercept in zip(trends['id'], trends['count'], trends['slope'], trends['intercept']):
+        assert count == len(fitted[gid])
+        assert [slope, intercept] == pytest.approx(np.polyfit(*zip(*fitted[gid]), 1))
+
+    cumulative = collection.cumulative_mass_balances(years)
+    rolling = collection.rolling_mean_mass_balances(window=5, years=years)
+    rows = [(gid, year) for gid, points in series.items() for year, _ in points]
+    assert list(zip(cumulative['id'], cumulative['year'])) == rows
+    assert list(zip(rolling['id'], rolling['year'])) == rows
+    for k, (gid, year) in enumerate(rows):
+        window = [balance for measured, balance in series[gid] if year - 5 < measured <= year]
+        assert cumulative['cumulative'][k] == pytest.approx(sum(b for y, b in series[gid] if y <= year))
+        assert rolling['count'][k] == len(window)
+        assert rolling['mean'][k] == pytest.approx(sum(window) / len(window))
+
+
+# invalid year ranges and windows of the time-series statistics
+time_series_tests = [(TypeError, 5, [1990, 2000]),
+                     (TypeError, 5, (1990, '2000')),
+                     (ValueError, 5, (2000, 1990)),
+                     (TypeError, 2.5, None),
+                     (ValueError, 0, None)]
+
+
+@pytest.mark.parametrize("error, window, years", time_series_tests)
+def test_invalid_time_series_statistics(error, window, years):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'))
+    with raises(error) as exception:
+        collection.rolling_mean_mass_balances(window=window, years=years)
+
+
+# year-indexed queries should match a scan of every glacier, and see measurements added later
+@pytest.mark.parametrize("columnar", [False, True])
+def test_year_queries(columnar):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+    collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'))
+
+    def scan(year, unit=None):
+        return sorted((gid, glacier.mass_balances[year]) for gid, glacier in collection.glaciers.items()
+                      if year in glacier.mass_balances and unit in (None, glacier.unit))
+
+    for year, unit in [(2000, None), (2000, 'CH'), (1950, 'NO'), (2000, 'ZZ'), (1800, None)]:
+        result = collection.balances_in_year(year, unit)
+        assert sorted(zip(result['id'], result['balance'])) == scan(year, unit)
+
+    means = collection.annual_regional_means()
+    assert list(zip(means['year'], means['unit'])) == sorted(set(zip(means['year'], means['unit'])))
+    for year, unit, count, mean in zip(means['year'], means['unit'], means['count'], means['mean']):
+        balances = [balance for _, balance in scan(int(year), unit)]
+        assert (count, mean) == (len(balances), pytest.approx(sum(balances) / len(balances)))
+
+    collection.glaciers['03987'].add_mass_balance_measurement(year=1800, mass_balance=-5, partial=False)
+    assert collection.balances_in_year(1800)['id'].tolist() == ['03987']
+
+
+# invalid year-indexed queries
+@pytest.mark.parametrize("error, year, unit", [(TypeError, '2000', None), (TypeError, 2000.0, None),
+                                               (TypeError, 2000, 44)])
+def test_invalid_year_queries(error, year, unit):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'))
+    with raises(error) as exception:
+        collection.balances_in_year(year, unit)
+
+
+def write_table(columns, file_path):
+    # write columns to an Arrow or Parquet file, for the tests of typed file ingestion
+    pytest.importorskip('pyarrow')
+    from pyarrow import feather, parquet, table
+    if file_path.suffix == '.parquet':
+        parquet.write_table(table(columns), file_path)
+    else:
+        feather.write_feather(table(columns), file_path)
+    return file_path
+
+
+# Arrow, Feather and Parquet files should load the same collection as the CSV files they hold
+@pytest.mark.parametrize("extension, columnar", [('.parquet', False), ('.parquet', True), ('.feather', False),
+                                                 ('.arrow', True)])
+def test_arrow_files(extension, columnar, tmp_path):
+    pytest.importorskip('pyarrow')
+    from pyarrow import csv
+
+    files = {}
+    for name in ('sheet-A', 'sheet-EE'):
+        # WGMS_ID is read as a number here, so IDs lose their leading zeros until loaded
+        files[name] = write_table(csv.read_csv(f'test_data/{name}.csv'), tmp_path / f'{name}{extension}')
+
+    collection = GlacierCollection(files['sheet-A'], columnar=columnar)
+    collection.read_mass_balance_data(files['sheet-EE'])
+    expected = GlacierCollection(Path('test_data/sheet-A.csv'))
+    expected.read_mass_balance_data(Path('test_data/sheet-EE.csv'))
+
+    assert list(collection.glaciers) == list(expected.glaciers)
+    for gid, glacier in expected.glaciers.items():
+        loaded = collection.glaciers[gid]
+        assert (loaded.name, loaded.unit, loaded.coordinates, loaded.type) == \
+               (glacier.name, glacier.unit, glacier.coordinates, glacier.type)
+        assert loaded.mass_balances == pytest.approx(glacier.mass_balances)
+
+
+# invalid columns of Arrow glacier data files
+glacier = {'WGMS_ID': ['04532', '01657'], 'NAME': ['AGUA NEGRA', 'DE LOS TRES'], 'POLITICAL_UNIT': ['AR', 'AR'],
+           'LATITUDE': [-30.1649, -49.33], 'LONGITUDE': [-69.8094, -73.0], 'PRIM_CLASSIFIC': [6, 5],
+           'FORM': ['3', '4'], 'FRONTAL_CHARS': [8, 4]}
+invalid_table_tests = [(ValueError, {'LATITUDE': None}),
+                       (ValueError, {'LATITUDE': ['-30.1649', '-49.33']}),
+                       (ValueError, {'LONGITUDE': [-69.8094, None]}),
+                       (ValueError, {'LONGITUDE': [-69.8094, 200.0]}),
+                       (ValueError, {'WGMS_ID': ['04532', '1657']}),
+                       (ValueError, {'POLITICAL_UNIT': ['AR', 'ar']}),
+                       (ValueError, {'FORM': ['3', '44']}),
+                       (ValueError, {'PRIM_CLASSIFIC': [0, 5]}),
+                       (KeyError, {'WGMS_ID': ['04532', '04532']}),
+                       (EOFError, {column: [] for column in glacier})]
+
+
+@pytest.mark.parametrize("error, changes", invalid_table_tests)
+def test_invalid_arrow_glacier_file(error, changes, tmp_path):
+    columns = {column: values for column, values in {**glacier, **changes}.items() if values is not None}
+    if error == EOFError:
+        columns = {'WGMS_ID': np.array([], dtype=str), 'NAME': np.array([], dtype=str),
+                   'POLITICAL_UNIT': np.array([], dtype=str), **{column: np.array([], dtype=float) for column in
+                   ('LATITUDE', 'LONGITUDE', 'PRIM_CLASSIFIC', 'FORM', 'FRONTAL_CHARS')}}
+    file_path = write_table(columns, tmp_path / 'sheet-A.parquet')
+    with raises(error) as exception:
+        GlacierCollection(file_path)
+
+
+# invalid Arrow mass-balance files
+@pytest.mark.parametrize("error, changes", [(ValueError, {'YEAR': [2000, 2999]}),
+                                            (ValueError, {'ANNUAL_BALANCE': ['-5', '10']}),
+                                            (ValueError, {'UPPER_BOUND': None}),
+                                            (KeyError, {'WGMS_ID': ['04532', '99999']})])
+def test_invalid_arrow_mass_balance_file(error, changes, tmp_path):
+    collection = GlacierCollection(write_table(glacier, tmp_path / 'sheet-A.feather'))
+    mass_balances = {'WGMS_ID': ['04532', '01657'], 'YEAR': [2000, 2001], 'LOWER_BOUND': [9999, 9999],
+                     'UPPER_BOUND': [9999, 9999], 'ANNUAL_BALANCE': [-5.0, 10.0]}
+    columns = {column: values for column, values in {**mass_balances, **changes}.items() if values is not None}
+    with raises(error) as exception:
+        collection.read_mass_balance_data(write_table(columns, tmp_path / 'sheet-EE.feather'))
+
+
+# filters given when loading should keep the same glaciers and measurements as filtering afterwards
+@pytest.mark.parametrize("columnar", [False, True])
+@pytest.mark.parametrize("bulk", [False, True])
+@pytest.mark.parametrize("units, bbox, years", [({'AR'}, None, None),
+                                                (None, (0, 90, -180, 0), None),
+                                                ({'AR', 'CA'}, (-45, 45, -90, 90), (1990, 2000)),
+                                                (None, None, (1990, 2000))])
+def test_load_filters(columnar, bulk, units, bbox, years):
+    full = GlacierCollection(Path('test_data/sheet-A.csv'))
+    full.read_mass_balance_data(Path('test_data/sheet-EE.csv'))
+    expected = {glacier.id: {year: balance for year, balance in glacier.mass_balances.items()
+                             if years is None or years[0] <= year <= years[1]}
+                for glacier in full.glaciers.values()
+                if (units is None or glacier.unit in units)
+                and (bbox is None or (bbox[0] <= glacier._lat <= bbox[1] and bbox[2] <= glacier._lon <= bbox[3]))}
+
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar, units=units, bbox=bbox)
+    collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'), bulk=bulk, units=units, years=years)
+    assert {identifier: dict(glacier.mass_balances) for identifier, glacier in collection.glaciers.items()} \
+        == expected
+
+    # a collection of every glacier should only get the measurements in the filtered units and years
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+    collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'), bulk=bulk, units=units, years=years)
+    for identifier, glacier in collection.glaciers.items():
+        if units is None or glacier.unit in units:
+            assert dict(glacier.mass_balances) == {year: balance for year, balance in
+                                                   full.glaciers[identifier].mass_balances.items()
+                                                   if years is None or years[0] <= year <= years[1]}
+        else:
+            assert len(glacier.mass_balances) == 0
+
+
+# filters should also apply to Arrow files, files read in parallel and rebuilt caches
+def test_load_filters_files(tmp_path):
+    pytest.importorskip('pyarrow')
+    units, bbox, years = {'AR'}, (0, 90, -180, 180), (1990, 2000)
+    expected = GlacierCollection(Path('test_data/sheet-A.csv'), units=units, bbox=bbox)
+    expected.read_mass_balance_data(Path('test_data/sheet-EE.csv'), units=units, years=years)
+    expected = {identifier: dict(glacier.mass_balances) for identifier, glacier in expected.glaciers.items()}
+
+    arrow = GlacierCollection(write_table(glacier, tmp_path / 'sheet-A.parquet'), units={'AR'}, bbox=(-40, 0, -90, 0))
+    assert list(arrow.glaciers) == ['04532']
+    arrow = GlacierCollection(write_table(glacier, tmp_path / 'sheet-A.feather'), units={'CA'})
+    assert list(arrow.glaciers) == []
+
+    collection = GlacierCollection.from_files([Path('test_data/sheet-A.csv')], [Path('test_data/sheet-EE.csv')],
+                                              workers=1, units=units, bbox=bbox, years=years)
+    assert {identifier: dict(glacier.mass_balances) for identifier, glacier in collection.glaciers.items()} \
+        == expected
+
+    cache_path = tmp_path / 'collection.npz'
+    glacier_file, mass_balance_file = tmp_path / 'sheet-A.csv', tmp_path / 'sheet-EE.csv'
+    glacier_file.write_bytes(Path('test_data/sheet-A.csv').read_bytes())
+    mass_balance_file.write_bytes(Path('test_data/sheet-EE.csv').read_bytes())
+    collection = GlacierCollection(glacier_file, units=units, bbox=bbox)
+    collection.read_mass_balance_data(mass_balance_file, units=units, years=years)
+    collection.save_cache(cache_path)
+    os.utime(mass_balance_file, ns=(0, 0))
+    rebuilt = GlacierCollection.load_cache(cache_path)
+    assert {identifier: dict(glacier.mass_balances) for identifier, glacier in rebuilt.glaciers.items()} \
+        == expected
+
+
+# updates should keep to the filters the file was read with, also when a stale cache replays them
+def test_update_with_filters(tmp_path):
+    header = "WGMS_ID,YEAR,LOWER_BOUND,UPPER_BOUND,ANNUAL_BALANCE,POLITICAL_UNIT\n"
+    mb_file = tmp_path / 'sheet-EE.csv'
+    mb_file.write_text(header + "03987,2000,9999,9999,-5,AR\n03987,1990,9999,9999,3,AR\n")
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), track_rows=True)
+    collection.read_mass_balance_data(mb_file, years=(2000, 2005))
+    assert collection.update_mass_balance_data(mb_file) == 0
+
+    mb_file.write_text(header + "03987,2000,9999,9999,-5,AR\n03987,1990,9999,9999,3,AR\n03987,2001,9999,9999,4,AR\n")
+    assert collection.update_mass_balance_data(mb_file) == 1
+    assert collection.glaciers['03987'].mass_balances == {2000: -5, 2001: 4}
+    assert collection.update_mass_balance_data(mb_file, units={'CA'}) == 0
+
+    collection.save_cache(tmp_path / 'cache')
+    mb_file.write_text(mb_file.read_text() + "03987,1980,9999,9999,7,AR\n")
+    rebuilt = GlacierCollection.load_cache(tmp_path / 'cache')
+    assert rebuilt.glaciers['03987'].mass_balances == {2000: -5, 2001: 4}
+
+
+# invalid load filters
+@pytest.mark.parametrize("error, units, bbox, years", [(TypeError, 'AR', None, None),
+                                                       (TypeError, {'AR', 5}, None, None),
+                                                       (TypeError, None, (0, 10, 0), None),
+                                                       (TypeError, None, (0, 10, 0, '10'), None),
+                                                       (ValueError, None, (10, 0, 0, 10), None),
+                                                       (ValueError, None, (0, 10, 10, 0), None),
+                                                       (ValueError, None, None, (2000, 1990))])
+def test_invalid_load_filters(error, units, bbox, years):
+    with raises(error) as exception:
+        if years is None:
+            GlacierCollection(Path('test_data/sheet-A.csv'), units=units, bbox=bbox)
+        else:
+            GlacierCollection(Path('test_data/sheet-A.csv')).read_mass_balance_data(
+                Path('test_data/sheet-EE.csv'), units=units, years=years)
+    with raises(error) as exception:
+        GlacierCollection.from_files([Path('test_data/sheet-A.csv')], workers=1, units=units, bbox=bbox,
+                                     years=years)
+
+
+# repeated queries should be answered from the result cache until the data changes
+@pytest.mark.parametrize("columnar", [False, True])
+def test_result_cache(columnar):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+    uncached = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar)
+    uncached.configure_result_cache(maxsize=0)
+    for data in (collection, uncached):
+        data.read_mass_balance_data(Path('test_data/sheet-EE.csv'), bulk=True)
+
+    def queries(data):
+        return (data.find_nearest(-46.65, -73.18, n=3), data.filter_by_code('6?8'),
+                [glacier.id for glacier in data.sort_by_latest_mass_balance(n=3)])
+
+    assert queries(collection) == queries(collection) == queries(uncached)
+    stats = collection.result_cache_stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (3, 3, 3)
+    assert uncached.result_cache_stats()['size'] == 0
+
+    # changing a returned list should not change the cached result
+    collection.filter_by_code('6?8').clear()
+    assert collection.filter_by_code('6?8') == uncached.filter_by_code('6?8')
+
+    # 1 and True are different arguments, and only one of them is valid
+    collection.sort_by_latest_mass_balance(1)
+    with raises(TypeError) as exception:
+        collection.sort_by_latest_mass_balance(True)
+
+    # every kind of change should drop the cached results
+    changes = [lambda data: data.glaciers['03987'].add_mass_balance_measurement(2020, -99999.0, False),
+               lambda data: data.add_glacier(Glacier('99999', 'NEW', 'AR', -46.65, -73.18, 638)),
+               lambda data: data.read_mass_balance_data(Path('test_data/sheet-EE.csv'), bulk=True)]
+    for change in changes:
+        for data in (collection, uncached):
+            change(data)
+        invalidations = collection.result_cache_stats()['invalidations']
+        assert queries(collection) == queries(uncached)
+        assert collection.result_cache_stats()['invalidations'] == invalidations + 1
+
+
+# the result cache should evict by its policy and expire results after their lifetime
+@pytest.mark.parametrize("policy, kept", [('lru', ['008', '100']), ('fifo', ['638', '100'])])
+def test_result_cache_eviction(policy, kept, monkeypatch):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'))
+    collection.configure_result_cache(maxsize=2, ttl=60, policy=policy)
+    for code in ('008', '638', '008', '100'):
+        collection.filter_by_code(code)
+    assert collection.result_cache_stats()['evictions'] == 1
+
+    misses = collection.result_cache_stats()['misses']
+    for code in kept:
+        collection.filter_by_code(code)
+    assert collection.result_cache_stats()['misses'] == misses
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 61)
+    collection.filter_by_code(kept[0])
+    stats = collection.result_cache_stats()
+    assert (stats['misses'], stats['expirations']) == (misses + 1, 1)
+
+
+# invalid result cache settings
+@pytest.mark.parametrize("error, maxsize, ttl, policy", [(TypeError, 1.5, None, 'lru'),
+                                                         (ValueError, -1, None, 'lru'),
+                                                         (TypeError, 10, '60', 'lru'),
+                                                         (ValueError, 10, 0, 'lru'),
+                                                         (ValueError, 10, None, 'lfu')])
+def test_invalid_result_cache(error, maxsize, ttl, policy):
+    with raises(error) as exception:
+        GlacierCollection(Path('test_data/sheet-A.csv')).configure_result_cache(maxsize, ttl, policy)
+
+
+# an out-of-core collection should give the same answers as one held in memory, whenever it merges its measurements
+@pytest.mark.parametrize("bulk", [False, True])
+@pytest.mark.parametrize("rows", [None, 100, 7])
+def test_out_of_core(bulk, rows, tmp_path, monkeypatch):
+    if rows is not None:
+        monkeypatch.setattr(storage, 'OUT_OF_CORE_ROWS', rows)
+    expected = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=True)
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), out_of_core=tmp_path / 'measurements')
+    for data in (expected, collection):
+        data.read_mass_balance_data(Path('test_data/sheet-EE.csv'), bulk=bulk)
+        data.read_mass_balance_data(Path('test_data/sheet-EE.csv'), bulk=True)
+        data.glaciers['03987'].add_mass_balance_measurement(2000, 1.5, True)
+
+    assert [glacier.mass_balances for glacier in collection.glaciers.values()] == \
+           [glacier.mass_balances for glacier in expected.glaciers.values()]
+    assert isinstance(collection._store.years, np.memmap) and isinstance(collection._store.balances, np.memmap)
+    assert sorted(path.name for path in (tmp_path / 'measurements').iterdir()) == ['balances.bin', 'years.bin']
+    assert [glacier.id for glacier in collection.sort_by_latest_mass_balance(5)] == \
+           [glacier.id for glacier in expected.sort_by_latest_mass_balance(5)]
+    assert collection.mass_balance_trends()['id'].tolist() == expected.mass_balance_trends()['id'].tolist()
+
+    # the time-series statistics scan the table in runs of glaciers rather than loading it
+    analyses = [lambda data: data.mass_balance_trends(), lambda data: data.mass_balance_trends((1990, 2005)),
+                lambda data: data.cumulative_mass_balances(), lambda data: data.rolling_mean_mass_balances(3),
+                lambda data: data.balances_in_year(2002), lambda data: data.balances_in_year(2002, 'AR'),
+                lambda data: data.balances_in_year(2002, 'XX'), lambda data: data.annual_regional_means()]
+    for analysis in analyses:
+        result, wanted = analysis(collection), analysis(expected)
+        assert list(result) == list(wanted)
+        for key in wanted:
+            if wanted[key].dtype.kind == 'f':
+                assert result[key] == pytest.approx(wanted[key])
+            else:
+                assert result[key].tolist() == wanted[key].tolist()
+    assert 'measurement_table' not in collection._indexes and 'year_index' not in collection._indexes
+
+    # glaciers can still be added, and the collection saved to a cache
+    for data in (expected, collection):
+        data.add_glacier(Glacier('99999', 'NEW', 'AR', -46.65, -73.18, 638))
+        data.glaciers['99999'].add_mass_balance_measurement(2001, -3.0, False)
+    assert collection.glaciers['99999'].mass_balances == {2001: -3.0}
+    assert collection.save_cache(tmp_path / 'cache')
+    cached = GlacierCollection.load_cache(tmp_path / 'cache')
+    assert [glacier.mass_balances for glacier in cached.glaciers.values()] == \
+           [glacier.mass_balances for glacier in expected.glaciers.values()]
+
+    # rows read are not kept, so the collection cannot be updated from a new version of a file
+    with raises(TypeError) as exception:
+        collection.update_mass_balance_data(Path('test_data/sheet-EE.csv'))
+
+
+# from_files should also be able to keep its measurements on disk
+def test_from_files_out_of_core(tmp_path):
+    collection = GlacierCollection.from_files([Path('test_data/sheet-A.csv')], [Path('test_data/sheet-EE.csv')],
+                                              workers=1, out_of_core=tmp_path / 'measurements')
+    expected = GlacierCollection(Path('test_data/sheet-A.csv'))
+    expected.read_mass_balance_data(Path('test_data/sheet-EE.csv'), bulk=True)
+    assert {glacier_id: glacier.mass_balances for glacier_id, glacier in collection.glaciers.items()} == \
+           {glacier_id: dict(glacier.mass_balances) for glacier_id, glacier in expected.glaciers.items()}
+    assert isinstance(collection._store.years, np.memmap)
+
+
+# invalid out-of-core directories
+@pytest.mark.parametrize("error, directory", [(TypeError, 'measurements'), (ValueError, Path('test_data/sheet-A.csv'))])
+def test_invalid_out_of_core(error, directory):
+    with raises(error) as exception:
+        GlacierCollection(Path('test_data/sheet-A.csv'), out_of_core=directory)
+    with raises(error) as exception:
+        GlacierCollection.from_files([Path('test_data/sheet-A.csv')], workers=1, out_of_core=directory)
+
+
+# altitude bands should be kept as read, and summed over an altitude range for every glacier in a year
+@pytest.mark.parametrize("columnar", [False, True])
+@pytest.mark.parametrize("bulk", [False, True])
+def test_altitude_bands(columnar, bulk, tmp_path):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), columnar=columnar, track_rows=True)
+    collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'), bulk=bulk)
+    collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'), bulk=True)
+
+    # the file was read twice, so each band holds its rows summed twice, as mass_balances does
+    bands = {}
+    with open('test_data/sheet-EE.csv') as file:
+        for row in csv.DictReader(file):
+            if row['ANNUAL_BALANCE'] != '' and (row['LOWER_BOUND'], row['UPPER_BOUND']) != ('9999', '9999'):
+                key = (row['WGMS_ID'], int(row['YEAR']), int(row['LOWER_BOUND']), int(row['UPPER_BOUND']))
+                bands[key] = bands.get(key, 0.0) + 2 * float(row['ANNUAL_BALANCE'])
+
+    glacier_bands = collection.altitude_bands('03987')
+    assert list(zip(glacier_bands['year'].tolist(), glacier_bands['lower'].tolist(),
+                    glacier_bands['upper'].tolist(), glacier_bands['balance'].tolist())) == \
+           sorted(key[1:] + (balance,) for key, balance in bands.items() if key[0] == '03987')
+
+    for year, lower, upper in [(2002, 0, 10000), (2002, 1000, 2000), (2010, 1400, 2600), (1800, 0, 10000)]:
+        expected = {}
+        for (identifier, band_year, band_lower, band_upper), balance in bands.items():
+            if band_year == year and lower <= band_lower and band_upper <= upper:
+                expected[identifier] = expected.get(identifier, (0, 0.0))
+                expected[identifier] = (expected[identifier][0] + 1, expected[identifier][1] + balance)
+        result = collection.balances_in_band(year, lower, upper)
+        assert {identifier: (count, balance) for identifier, count, balance in
+                zip(result['id'].tolist(), result['bands'].tolist(), result['balance'].tolist())} == expected
+        assert result['id'].tolist() == [identifier for identifier in collection.glaciers if identifier in expected]
+
+    # a changed band replaces the old one, also in a cached collection
+    header = "WGMS_ID,YEAR,LOWER_BOUND,UPPER_BOUND,ANNUAL_BALANCE\n"
+    (tmp_path / 'sheet-EE.csv').write_text(header + "03987,2002,1000,1500,1\n03987,2002,0,500,-2\n")
+    collection.update_mass_balance_data(tmp_path / 'sheet-EE.csv')
+    collection.save_cache(tmp_path / 'cache')
+    for data in (collection, GlacierCollection.load_cache(tmp_path / 'cache')):
+        result = data.balances_in_band(2002, 0, 1500)
+        assert (result['id'][0], result['bands'][0], result['balance'][0]) == ('03987', 2, -1.0)
+
+
+# invalid altitude-band queries
+@pytest.mark.parametrize("error, year, lower, upper", [(TypeError, '2002', 0, 1000),
+                                                       (TypeError, 2002, 0.5, 1000),
+                                                       (TypeError, 2002, 0, None),
+                                                       (ValueError, 2002, 1000, 0)])
+def test_invalid_balances_in_band(error, year, lower, upper):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), track_rows=True)
+    with raises(error) as exception:
+        collection.balances_in_band(year, lower, upper)
+
+
+@pytest.mark.parametrize("error, glacier_id", [(TypeError, 3987), (KeyError, '99999')])
+def test_invalid_altitude_bands(error, glacier_id, tmp_path):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'), track_rows=True)
+    with raises(error) as exception:
+        collection.altitude_bands(glacier_id)
+
+    out_of_core = GlacierCollection(Path('test_data/sheet-A.csv'), out_of_core=tmp_path / 'measurements')
+    with raises(TypeError) as exception:
+        out_of_core.balances_in_band(2002, 0, 1000)
+
+
+# rows read are only kept when asked for, since the ledger can outgrow the measurements it describes
+def test_track_rows(tmp_path):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'))
+    collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'))
+    assert collection._ledger is None
+    with raises(TypeError) as exception:
+        collection.update_mass_balance_data(Path('test_data/sheet-EE.csv'))
+    with raises(TypeError) as exception:
+        collection.altitude_bands('03987')
+
+    # a snapshot keeps the ledger only of a collection tracking its rows
+    tracked = GlacierCollection.from_files([Path('test_data/sheet-A.csv')], [Path('test_data/sheet-EE.csv')],
+                                           workers=1, track_rows=True)
+    tracked.save_cache(tmp_path / 'cache')
+    assert GlacierCollection.load_cache(tmp_path / 'cache').update_mass_balance_data(Path('test_data/sheet-EE.csv')) == 0
+    collection.save_cache(tmp_path / 'cache')
+    assert GlacierCollection.load_cache(tmp_path / 'cache')._ledger is None
+
+    with raises(TypeError) as exception:
+        GlacierCollection(Path('test_data/sheet-A.csv'), track_rows=1)
+    with raises(ValueError) as exception:
+        GlacierCollection(Path('test_data/sheet-A.csv'), out_of_core=tmp_path / 'measurements', track_rows=True)
+
+
+# importing glaciers should not load matplotlib or pyarrow, which are only needed for plotting and Arrow files
+def test_import_is_light():
+    code = ("import sys, time; start = time.perf_counter(); import glaciers; "
+            "print('matplotlib' in sys.modules or 'pyarrow' in sys.modules, time.perf_counter() - start)")
+    loaded, seconds = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                     check=True, cwd=Path(__file__).parent).stdout.split()
+    assert loaded == 'False'
+    assert float(seconds) < 2
+
+
+# plotting should draw off-screen and not leave figures open
+def test_plots_close_figures(tmp_path):
+    collection = GlacierCollection(Path('test_data/sheet-A.csv'))
+    collection.read_mass_balance_data(Path('test_data/sheet-EE.csv'))
+    collection.glaciers['03987'].plot_mass_balance(tmp_path / 'mass_balance.png')
+    collection.plot_extremes(tmp_path / 'extremes.png')
+
+    from matplotlib import pyplot
+    assert pyplot.get_backend().lower() == 'agg'
+    assert pyplot.get_fignums() == []
@@ -1,4 +1,9 @@
-from math import cos, sin, sqrt, asin
+import hashlib
+import os
+import numpy as np
+from pathlib import Path
+
+EARTH_RADIUS = 6371  # km
 
 
 def haversine_distance(lat1, lon1, lat2, lon2):
@@ -30,8 +35,106 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     if not (-180 <= lon2 <= 180):
         raise ValueError("Invalid longitude 2 given (should be in range -180 to 180)")
 
-    R = 6371
-    inner = pow(sin((lat2 - lat1) / 2), 2) + cos(lat1) * cos(lat2) * pow(sin((lon2 - lon1) / 2), 2)
-    d = 2 * R * asin(sqrt(inner))
+    return float(haversine_distance_array(lat1, lon1, lat2, lon2))
+
+
+def _check_coordinates(values, limit, label):
+    # validate a whole array of latitudes or longitudes at once
+    values = np.asarray(values)
+
+    if not (np.issubdtype(values.dtype, np.integer) or np.issubdtype(values.dtype, np.floating)):
+        raise TypeError(f"{label} is not of accepted numeric type")
+
+    if not np.all((-limit <= values) & (values <= limit)):
+        raise ValueError(f"Invalid {label.lower()} given (should be in range -{limit} to {limit})")
+
+    return values
+
+
+def haversine_distance_array(lat1, lon1, lat2, lon2, out=None):
+    """Return the distances in km between arrays of points around the Earth.
+
+    Latitudes and longitudes are given in degrees, as scalars or arrays that
+    broadcast against each other. Each argument is validated once as a whole.
+    If `out` is given, the distances are written into it and it is returned.
+    """
+    lat1 = _check_coordinates(lat1, 90, "Latitude 1")
+    lon1 = _check_coordinates(lon1, 180, "Longitude 1")
+    lat2 = _check_coordinates(lat2, 90, "Latitude 2")
+    lon2 = _check_coordinates(lon2, 180, "Longitude 2")
+
+    shape = np.broadcast_shapes(lat1.shape, lon1.shape, lat2.shape, lon2.shape)
+    if out is None:
+        out = np.empty(shape, dtype=np.float64)
+    elif out.shape != shape:
+        raise ValueError(f"Output buffer has shape {out.shape}, expected {shape}")
+
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+
+    # out holds the latitude term, scratch the longitude term
+    np.subtract(lat2, lat1, out=out)
+    out *= 0.5
+    np.sin(out, out=out)
+    np.square(out, out=out)
+
+    scratch = np.subtract(lon2, lon1, out=np.empty(shape, dtype=np.float64))
+    scratch *= 0.5
+    np.sin(scratch, out=scratch)
+    np.square(scratch, out=scratch)
+    scratch *= np.cos(lat1) * np.cos(lat2)
+
+    out += scratch
+    np.minimum(out, 1, out=out)
+    np.sqrt(out, out=out)
+    np.arcsin(out, out=out)
+    out *= 2 * EARTH_RADIUS
+
+    return out
+
+
+def haversine_distance_matrix(lats1, lons1, lats2, lons2, out=None):
+    """Return the (M, N) matrix of distances in km between M points and N points.
+
+    The first point set is given by one-dimensional arrays `lats1` and `lons1`,
+    the second by `lats2` and `lons2`, all in degrees.
+    """
+    lats1, lons1 = np.asarray(lats1), np.asarray(lons1)
+    lats2, lons2 = np.asarray(lats2), np.asarray(lons2)
+
+    if not (lats1.ndim == 1 and lats1.shape == lons1.shape and lats2.ndim == 1 and lats2.shape == lons2.shape):
+        raise ValueError("Each set of points must be given as one-dimensional arrays of the same length")
+
+    return haversine_distance_array(lats1[:, None], lons1[:, None], lats2[None, :], lons2[None, :], out=out)
+
+
+def file_fingerprint(path):
+    """Return the absolute path, modification time and size of a file, to detect later changes."""
+    stat = os.stat(path)
+    return {'path': str(Path(path).resolve()), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint_matches(fingerprint):
+    """Whether the file a fingerprint was taken from is unchanged.
+
+    Files whose modification time changed are only hashed if they kept their
+    size, so a file that was touched but not edited still matches.
+    """
+    try:
+        stat = os.stat(fingerprint['path'])
+    except FileNotFoundError:
+        return False
+
+    if (stat.st_mtime_ns, stat.st_size) == (fingerprint['mtime_ns'], fingerprint['size']):
+        return True
 
-    return d
+    return (fingerprint.get('sha256') is not None and stat.st_size == fingerprint['size']
+            and file_hash(fingerprint['path']) == fingerprint['sha256'])